@@ -0,0 +1,192 @@
+import copy
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.models import User
+from authentication.revocation import get_revocation_list
+from core.caches import LocalCache
+from core.invalidation import register_cache
+from core.metrics import register_collector
+
+
+# Users resolved from access tokens, by user id
+user_cache = register_cache(LocalCache(
+    max_size=settings.JWT_USER_RESOLUTION['CACHE_SIZE'],
+    ttl=settings.JWT_USER_RESOLUTION['CACHE_TTL']), by_id=['user'])
+
+
+# Validated access tokens, by digest of the raw token, kept until they expire
+token_cache = register_cache(LocalCache(
+    max_size=settings.JWT_TOKEN_CACHE['SIZE'], ttl=0))
+
+
+@register_collector
+def collect_metrics():
+    """
+    Get the counters of the token and user caches and of the revocation list
+    for core.metrics.
+    """
+    samples = []
+    for name, cache in [('jwt_token', token_cache), ('jwt_user', user_cache)]:
+        stats = cache.stats()
+        labels = {'cache': name}
+        samples += [
+            ('local_cache_hits_total', 'counter',
+             'Local cache lookups that found an entry.', labels, stats['hits']),
+            ('local_cache_misses_total', 'counter',
+             'Local cache lookups that did not.', labels, stats['misses']),
+            ('local_cache_entries', 'gauge',
+             'Entries in local caches.', labels, stats['size']),
+        ]
+    stats = get_revocation_list().stats()
+    samples += [
+        ('token_revocation_checks_total', 'counter',
+         'Token revocation checks.', {}, stats['checks']),
+        ('token_revocation_filter_hits_total', 'counter',
+         'Revocation checks that needed a query.', {}, stats['filter_hits']),
+    ]
+    return samples
+
+
+def invalidate_user(user_id):
+    """
+    Drop a user from the cache so the next request reloads it.
+
+    Args:
+        user_id (int): The id of the changed or deleted user.
+    """
+    user_cache.delete(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that avoids a users query on every request.
+
+    With JWT_USER_RESOLUTION['MODE'] set to 'claims' the user is built from
+    the verified token alone. With 'cache' (the default) users are loaded
+    once and kept in a per-process cache for CACHE_TTL seconds, or until
+    invalidate_user() is called.
+
+    Clients reuse an access token for its whole lifetime, so verified tokens
+    are also cached until they expire, skipping the decoding and signature
+    check on every request but the first. Revoked tokens are still rejected
+    on every request, see authentication.revocation.
+    """
+
+    def get_validated_token(self, raw_token):
+        """
+        Validate a raw token, or get it from the verified token cache, and
+        check that it has not been revoked.
+
+        Args:
+            raw_token (bytes): The encoded token from the request header.
+
+        Returns:
+            Token: The validated token.
+
+        Raises:
+            InvalidToken: If the token is invalid, expired or revoked.
+        """
+        validated_token = self.verify_token(raw_token)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if jti is not None and get_revocation_list().is_revoked(jti):
+            raise InvalidToken(_('Token has been revoked'))
+        return validated_token
+
+    def verify_token(self, raw_token):
+        """
+        Decode and verify a raw token, or get it from the verified token
+        cache, without checking for revocation.
+        """
+        if not token_cache.max_size:
+            return super().get_validated_token(raw_token)
+
+        key = hashlib.blake2b(raw_token, digest_size=16).digest()
+        validated_token = token_cache.get(key)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            lifetime = validated_token['exp'] - time.time()
+            if lifetime > 0:
+                token_cache.set(key, validated_token, ttl=lifetime)
+        return validated_token
+
+    def get_user(self, validated_token):
+        """
+        Get the user of a validated token, from its claims or the cache.
+
+        Args:
+            validated_token (Token): The validated access token.
+
+        Returns:
+            User: The authenticated user.
+        """
+        user = self.get_cached_user(validated_token)
+        if user is None:
+            user = self.load_user(validated_token)
+        return user
+
+    def get_cached_user(self, validated_token):
+        """
+        Get the user of a validated token without querying the database.
+
+        Returns:
+            User: The user, or None if it has to be loaded.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if settings.JWT_USER_RESOLUTION['MODE'] == 'claims':
+            return User(
+                id=user_id,
+                is_superuser=validated_token.get('is_superuser', False))
+
+        user = user_cache.get(user_id)
+        # Hand out a copy so the cached instance is never mutated
+        return copy.copy(user) if user is not None else None
+
+    def load_user(self, validated_token):
+        """
+        Load the user of a validated token and add it to the cache.
+        """
+        # Check that the user still exists and is active
+        user = super().get_user(validated_token)
+        user_cache.set(validated_token[api_settings.USER_ID_CLAIM], user)
+        return copy.copy(user)
+
+    async def aauthenticate(self, request):
+        """
+        Authenticate a request from an async view.
+
+        Tokens and users are taken from the caches on the event loop; only
+        the database queries of cache misses and revocation checks run in a
+        thread.
+
+        Returns:
+            tuple: The user and the validated token, or None if the request
+                has no token.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.verify_token(raw_token)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if jti is not None and await get_revocation_list().ais_revoked(jti):
+            raise InvalidToken(_('Token has been revoked'))
+
+        user = self.get_cached_user(validated_token)
+        if user is None:
+            user = await sync_to_async(self.load_user)(validated_token)
+        return user, validated_token
@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    check_password, identify_hasher, is_password_usable, make_password)
+from django.utils.crypto import constant_time_compare
+
+
+class LoginOverloaded(Exception):
+    """
+    Raised when a password cannot be verified within the queue budget.
+    """
+
+
+def verify_password(password, encoded):
+    """
+    Check a raw password against the stored value of the users.password column.
+
+    Passwords stored before hashing was introduced are kept in plain text;
+    they are still accepted and a hash is returned to replace them. A hash is
+    also returned when the stored one uses an outdated hasher or work factor.
+
+    Args:
+        password (str): The raw password.
+        encoded (str): The stored password, or None for an unknown user.
+
+    Returns:
+        tuple: Whether the password is correct and the new value to store,
+            or None if the stored value is up to date.
+    """
+    if encoded is None:
+        # Unknown user, spend the same time as checking a password would
+        make_password(password)
+        return False, None
+
+    if is_password_usable(encoded):
+        try:
+            identify_hasher(encoded)
+        except ValueError:
+            # Plain text password from before hashing was introduced
+            if constant_time_compare(password, encoded):
+                return True, make_password(password)
+            return False, None
+
+    upgraded = []
+    is_correct = check_password(
+        password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return is_correct, upgraded[0] if upgraded else None
+
+
+class PasswordVerifier:
+    """
+    Run password verification on a bounded thread pool.
+
+    At most `workers` passwords are hashed at the same time, leaving the rest
+    of the CPU to other requests; the hashers release the GIL while hashing.
+    At most `max_pending` more logins wait for a worker, and a login that has
+    waited longer than `queue_budget` seconds is dropped before hashing.
+    Both cases raise LoginOverloaded so the view can shed the request quickly.
+    """
+
+    def __init__(self, workers, max_pending, queue_budget):
+        self.queue_budget = queue_budget
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-verifier')
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def verify(self, password, encoded):
+        """
+        Verify a password on the pool, see verify_password().
+
+        Raises:
+            LoginOverloaded: If the pool is full or the login waited longer
+                than the queue budget.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise LoginOverloaded()
+        enqueued = time.monotonic()
+
+        def run():
+            try:
+                if time.monotonic() - enqueued > self.queue_budget:
+                    raise LoginOverloaded()
+                return verify_password(password, encoded)
+            finally:
+                self.slots.release()
+
+        try:
+            future = self.executor.submit(run)
+        except BaseException:
+            # run() will never release the slot, e.g. after a shutdown
+            self.slots.release()
+            raise
+        return future.result()
+
+
+_verifier = None
+_verifier_pid = None
+_verifier_lock = threading.Lock()
+
+
+def get_password_verifier():
+    """
+    Get the password verifier of the current process.
+
+    The verifier is created on first use, and again in forked worker
+    processes since the threads of a pool do not survive a fork.
+    """
+    global _verifier, _verifier_pid
+    pid = os.getpid()
+    if _verifier_pid != pid:
+        with _verifier_lock:
+            if _verifier_pid != pid:
+                _verifier = PasswordVerifier(**{
+                    key.lower(): value
+                    for key, value in settings.LOGIN_PASSWORD_VERIFIER.items()
+                })
+                _verifier_pid = pid
+    return _verifier
+
+
+def hash_passwords(passwords):
+    """
+    Hash raw passwords, for running on a process pool.
+
+    Args:
+        passwords (list): Raw passwords; None gives an unusable password.
+
+    Returns:
+        list: The encoded passwords, in the same order.
+    """
+    return [make_password(password) for password in passwords]
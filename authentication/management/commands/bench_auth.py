@@ -0,0 +1,73 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.authentication import (
+    CachedJWTAuthentication, token_cache, user_cache)
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the authentication overhead per request with and without '
+        'the verified token cache. A temporary user is created and removed; '
+        'the user cache is warmed first so only token handling is measured.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=20000,
+            help='Number of authenticated requests per run (default: 20000).')
+        parser.add_argument(
+            '--tokens', type=int, default=100,
+            help='Number of distinct access tokens in use (default: 100).')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f'bench-auth-{uuid.uuid4().hex[:12]}')
+        try:
+            factory = APIRequestFactory()
+            requests = [
+                factory.get(
+                    '/api/book/list/',
+                    HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+                for _ in range(options['tokens'])
+            ]
+            authentication = CachedJWTAuthentication()
+            authentication.authenticate(requests[0])
+
+            max_size = token_cache.max_size
+            try:
+                token_cache.max_size = 0
+                uncached = self.run(authentication, requests, options['requests'])
+            finally:
+                token_cache.max_size = max_size
+
+            token_cache.clear()
+            before = token_cache.stats()
+            cached = self.run(authentication, requests, options['requests'])
+            after = token_cache.stats()
+        finally:
+            user.delete()
+            user_cache.clear()
+
+        hits = after['hits'] - before['hits']
+        lookups = hits + after['misses'] - before['misses']
+        self.stdout.write(f'uncached: {uncached:.1f} us/request')
+        self.stdout.write(
+            f'cached:   {cached:.1f} us/request, hit rate {hits / lookups:.1%}')
+        self.stdout.write(f'speedup:  {uncached / cached:.1f}x')
+
+    def run(self, authentication, requests, count):
+        """
+        Authenticate `count` requests, cycling through the given ones.
+
+        Returns:
+            float: The mean time per request in microseconds.
+        """
+        start = time.perf_counter()
+        for index in range(count):
+            authentication.authenticate(requests[index % len(requests)])
+        return (time.perf_counter() - start) / count * 1e6
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark logins per second against the latency of concurrent book '
+        'list requests, in process, at increasing login concurrency. A '
+        'temporary user with a hashed password is created and removed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Seconds to run each concurrency level (default: 10).')
+        parser.add_argument(
+            '--login-concurrency', default='0,4,16,64',
+            help='Comma separated numbers of login threads (default: 0,4,16,64).')
+        parser.add_argument(
+            '--book-concurrency', type=int, default=4,
+            help='Number of book list threads (default: 4).')
+
+    def handle(self, *args, **options):
+        username = f'bench-login-{uuid.uuid4().hex[:12]}'
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(username, password)
+        access_token = str(RefreshToken.for_user(user).access_token)
+
+        # Shed logins are expected, do not log every 503
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        # Measure the hashing pool rather than the login rate limits
+        throttling = override_settings(
+            THROTTLE={**settings.THROTTLE, 'RATES': {}})
+        throttling.enable()
+
+        self.stdout.write(
+            f"{'logins':>8}{'login/s':>10}{'shed/s':>10}{'book/s':>10}"
+            f"{'book p50':>10}{'book p99':>10}")
+        try:
+            levels = [
+                int(value) for value in options['login_concurrency'].split(',')]
+            for logins in levels:
+                result = self.run_level(
+                    username, password, access_token, logins,
+                    options['book_concurrency'], options['duration'])
+                self.stdout.write(
+                    f'{logins:>8}{result["login"]:>10.1f}{result["shed"]:>10.1f}'
+                    f'{result["book"]:>10.1f}{result["p50"]:>8.1f}ms'
+                    f'{result["p99"]:>8.1f}ms')
+        finally:
+            throttling.disable()
+            user.delete()
+
+    def run_level(self, username, password, access_token, logins, books,
+                  duration):
+        """
+        Run login and book list threads side by side for `duration` seconds.
+
+        Returns:
+            dict: Successful and shed logins per second, book requests per
+                second and their p50 and p99 latency in milliseconds.
+        """
+        deadline = time.monotonic() + duration
+        lock = threading.Lock()
+        counts = {200: 0, 503: 0}
+        latencies = []
+
+        def login_worker():
+            client = Client(HTTP_HOST='localhost')
+            while time.monotonic() < deadline:
+                response = client.post(
+                    '/api/login/', {'username': username, 'password': password})
+                with lock:
+                    counts[response.status_code] = (
+                        counts.get(response.status_code, 0) + 1)
+            connection.close()
+
+        def book_worker():
+            client = Client(
+                HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {access_token}')
+            timings = []
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                client.get('/api/book/list/')
+                timings.append((time.perf_counter() - start) * 1000)
+            with lock:
+                latencies.extend(timings)
+            connection.close()
+
+        threads = [threading.Thread(target=login_worker) for _ in range(logins)]
+        threads += [threading.Thread(target=book_worker) for _ in range(books)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies.sort()
+        return {
+            'login': counts[200] / duration,
+            'shed': counts[503] / duration,
+            'book': len(latencies) / duration,
+            'p50': latencies[len(latencies) // 2] if latencies else 0,
+            'p99': latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        }
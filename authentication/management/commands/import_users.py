@@ -0,0 +1,180 @@
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from authentication.hashing import hash_passwords
+from authentication.models import User
+
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users in bulk from a CSV file with username and password '
+        'columns, or a JSONL file of objects with the same keys. Passwords '
+        'are hashed on a process pool and users are loaded with COPY, one '
+        'batch per transaction; existing usernames are skipped, so an '
+        'interrupted import can be run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="Input file, or '-' to read standard input.")
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Input format (default: from the file extension, else csv).')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Users hashed and loaded per batch (default: 10000).')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Hashing processes (default: the number of CPUs).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or (
+            'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        try:
+            input_file = (
+                sys.stdin if path == '-' else open(path, newline='', encoding='utf-8'))
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        totals = {'imported': 0, 'existing': 0, 'invalid': 0}
+        start = time.perf_counter()
+        # Spawned workers do not inherit the database connection
+        executor = ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+        try:
+            rows = read_users(input_file, input_format, totals)
+            batches = iter(lambda: list(
+                itertools.islice(rows, options['batch_size'])), [])
+
+            # Hash the next batch while the current one is loaded, keeping
+            # at most two batches in memory
+            pending = deque()
+            for batch in itertools.chain(batches, [None]):
+                if batch is not None:
+                    batch = self.skip_existing(batch, totals)
+                    pending.append((batch, self.hash_batch(
+                        executor, batch, options['workers'])))
+                if pending and (batch is None or len(pending) == 2):
+                    loaded, hashing = pending.popleft()
+                    passwords = list(itertools.chain.from_iterable(
+                        future.result() for future in hashing))
+                    self.load_batch(loaded, passwords, totals)
+                    self.report(totals, start)
+        finally:
+            executor.shutdown(cancel_futures=True)
+            if input_file is not sys.stdin:
+                input_file.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['imported']} users in {elapsed:.1f}s "
+            f"({totals['imported'] / elapsed:.0f} users/s), skipped "
+            f"{totals['existing']} existing and {totals['invalid']} invalid"))
+
+    def skip_existing(self, batch, totals):
+        """
+        Drop users whose username is taken, before spending time hashing.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT username FROM users WHERE username = ANY(%s)',
+                [[username for username, _ in batch]])
+            existing = {row[0] for row in cursor.fetchall()}
+        totals['existing'] += len(existing)
+        return [user for user in batch if user[0] not in existing]
+
+    def hash_batch(self, executor, batch, workers):
+        """
+        Submit the passwords of a batch to the pool in one chunk per worker.
+
+        Returns:
+            list: The futures of the hashed chunks, in order.
+        """
+        size = max(1, -(-len(batch) // workers))
+        return [
+            executor.submit(
+                hash_passwords, [password for _, password in batch[i:i + size]])
+            for i in range(0, len(batch), size)
+        ]
+
+    def load_batch(self, batch, passwords, totals):
+        """
+        COPY a batch into a temporary table and insert the new usernames.
+        """
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for (username, _), password in zip(batch, passwords):
+            writer.writerow([username, password])
+        data.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS import_users '
+                '(username text, password text) ON COMMIT DELETE ROWS')
+            cursor.copy_expert(
+                'COPY import_users (username, password) FROM STDIN WITH CSV',
+                data)
+            # Usernames created since skip_existing() or repeated in the
+            # input are skipped here
+            cursor.execute(
+                'INSERT INTO users (username, password, is_superuser) '
+                'SELECT DISTINCT ON (username) username, password, false '
+                'FROM import_users '
+                'ON CONFLICT (username) DO NOTHING')
+            totals['imported'] += cursor.rowcount
+            totals['existing'] += len(batch) - cursor.rowcount
+
+    def report(self, totals, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{totals['imported']} imported, {totals['existing']} existing, "
+            f"{totals['invalid']} invalid, "
+            f"{totals['imported'] / elapsed:.0f} users/s")
+
+
+def read_users(input_file, input_format, totals):
+    """
+    Read (username, password) pairs, counting invalid rows in totals.
+
+    Yields:
+        tuple: The username and the raw password, None if it is empty.
+    """
+    if input_format == 'jsonl':
+        records = (parse_json(line) for line in input_file if line.strip())
+    else:
+        records = csv.DictReader(input_file)
+
+    for record in records:
+        username = record.get('username') if isinstance(record, dict) else None
+        password = record.get('password') if username is not None else None
+        if (not isinstance(username, str) or not username.strip()
+                or len(username.strip()) > USERNAME_MAX_LENGTH
+                or password is not None and not isinstance(password, str)):
+            totals['invalid'] += 1
+            continue
+        yield username.strip(), password or None
+
+
+def parse_json(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
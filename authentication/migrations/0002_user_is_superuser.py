@@ -0,0 +1,23 @@
+# Generated by Django 4.2.14 on 2026-10-19 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='is_superuser',
+            field=models.BooleanField(default=False),
+        ),
+        # Keep the default in the database so raw INSERTs into users still work
+        migrations.RunSQL(
+            'ALTER TABLE users ALTER COLUMN is_superuser SET DEFAULT false',
+            'ALTER TABLE users ALTER COLUMN is_superuser DROP DEFAULT',
+        ),
+    ]
@@ -14,7 +14,7 @@ class UserManager(BaseUserManager):
 
     def create_superuser(self, username, password=None):
         user = self.create_user(username, password)
-        user.is_admin = True
+        user.is_superuser = True
         user.save(using=self._db)
         return user
 
@@ -22,6 +22,7 @@ class UserManager(BaseUserManager):
 class User(AbstractBaseUser):
     username = models.CharField(max_length=150, unique=True)
     password = models.CharField(max_length=128)
+    is_superuser = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'users'
@@ -41,3 +42,22 @@ class User(AbstractBaseUser):
     @property
     def is_admin(self):
         return self.is_superuser
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh or access token revoked before its expiry, by its jti claim.
+
+    Rows are inserted by authentication.revocation with the id of the
+    inserting transaction, which workers use to sync their filters.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(auto_now_add=True)
+    txid = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        db_table = 'revoked_tokens'
+
+    def __str__(self):
+        return self.jti
@@ -0,0 +1,12 @@
+from core.db.plans import expect_plan
+
+from authentication.queries import UPDATE_PASSWORD, USER_CREDENTIALS
+
+
+expect_plan(
+    USER_CREDENTIALS, lambda sample: [sample.username],
+    indexes=['users(username)'], max_cost=20)
+
+expect_plan(
+    UPDATE_PASSWORD, lambda sample: ['password', sample.user_id],
+    indexes=['users(id)'], max_cost=20)
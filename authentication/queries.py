@@ -0,0 +1,10 @@
+from core.db.queries import Query
+
+
+USER_CREDENTIALS = Query(
+    'authentication.user_credentials',
+    'SELECT id, password, is_superuser FROM users WHERE username = %s')
+
+UPDATE_PASSWORD = Query(
+    'authentication.update_password',
+    'UPDATE users SET password = %s WHERE id = %s')
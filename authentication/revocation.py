@@ -0,0 +1,211 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.models import RevokedToken
+
+
+class BloomFilter:
+    """
+    A fixed-size set of strings that can answer "definitely not present".
+
+    Membership tests may return false positives, at about `error_rate` once
+    `capacity` keys have been added, but never false negatives.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity = max(1, capacity)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        """
+        Get the bit positions of a key, by double hashing a single digest.
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key))
+
+
+class RevocationList:
+    """
+    Answer whether a token is revoked, mostly without querying the database.
+
+    Every process keeps a Bloom filter of the revoked jtis. A jti that is not
+    in the filter is not revoked; only filter hits are checked against the
+    revoked_tokens table. The filter is delta-synced every `sync_interval`
+    seconds with the tokens revoked since the previous sync, and rebuilt from
+    the unexpired revocations every `rebuild_interval` seconds or when it is
+    over capacity, so tokens revoked by other processes are rejected here at
+    most `sync_interval` seconds later.
+
+    Attributes:
+        checks (int): The number of is_revoked() calls.
+        filter_hits (int): The number of checks that queried the database.
+        revoked (int): The number of checks that found a revoked token.
+    """
+
+    def __init__(self, capacity, error_rate, sync_interval, rebuild_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.filter = None
+        self.watermark = None
+        self.next_sync = 0
+        self.next_rebuild = 0
+        self.checks = 0
+        self.filter_hits = 0
+        self.revoked = 0
+        self._lock = threading.Lock()
+
+    def sync(self, rebuild=False):
+        """
+        Add the tokens revoked since the previous sync to the filter.
+
+        Revocations are read by the id of their inserting transaction: every
+        transaction that commits after a sync has an id at or above the
+        oldest transaction still running at that sync, so reading from there
+        on misses nothing and only re-adds a few jtis.
+
+        Args:
+            rebuild (bool, optional): Build a new filter from every unexpired
+                revocation instead.
+        """
+        rebuild = rebuild or self.filter is None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT txid_snapshot_xmin(txid_current_snapshot()), '
+                'ARRAY(SELECT jti FROM revoked_tokens '
+                'WHERE txid >= %s AND expires_at > now())',
+                [0 if rebuild else self.watermark])
+            watermark, jtis = cursor.fetchone()
+
+        now = time.monotonic()
+        if rebuild:
+            bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+            self.next_rebuild = now + self.rebuild_interval
+        else:
+            bloom = self.filter
+        for jti in jtis:
+            bloom.add(jti)
+        self.filter = bloom
+        self.watermark = watermark
+        self.next_sync = now + self.sync_interval
+
+    def is_revoked(self, jti):
+        """
+        Check whether the token with the given jti claim is revoked.
+
+        Returns:
+            bool: Whether a revocation of the token is stored.
+        """
+        now = time.monotonic()
+        if now >= self.next_sync and self._lock.acquire(blocking=False):
+            # Other threads keep using the current filter meanwhile
+            try:
+                self.sync(
+                    rebuild=now >= self.next_rebuild
+                    or self.filter.count > self.filter.capacity)
+            finally:
+                self._lock.release()
+
+        self.checks += 1
+        if self.filter is not None and jti not in self.filter:
+            return False
+        self.filter_hits += 1
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        self.revoked += revoked
+        return revoked
+
+    async def ais_revoked(self, jti):
+        """
+        Check whether a token is revoked from async code, querying the
+        database in a thread only when is_revoked() would.
+        """
+        if (time.monotonic() >= self.next_sync or self.filter is None
+                or jti in self.filter):
+            return await sync_to_async(self.is_revoked)(jti)
+        self.checks += 1
+        return False
+
+    def revoke(self, token):
+        """
+        Store the revocation of a token and add it to the local filter.
+
+        Args:
+            token (Token): A validated refresh or access token.
+        """
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime.fromtimestamp(token['exp'], tz=timezone.utc)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO revoked_tokens (jti, expires_at, revoked_at, txid) '
+                'VALUES (%s, %s, now(), txid_current()) '
+                'ON CONFLICT (jti) DO NOTHING',
+                [jti, expires_at])
+        if self.filter is not None:
+            self.filter.add(jti)
+
+    def stats(self):
+        """
+        Get the counters of the revocation list.
+
+        Returns:
+            dict: checks, filter_hits, revoked, the rate of checks answered
+                in memory and the number of jtis in the filter.
+        """
+        return {
+            'checks': self.checks,
+            'filter_hits': self.filter_hits,
+            'revoked': self.revoked,
+            'memory_rate': (
+                1 - self.filter_hits / self.checks if self.checks else 0.0),
+            'size': self.filter.count if self.filter is not None else 0,
+        }
+
+
+_revocation_list = None
+_revocation_list_pid = None
+_revocation_list_lock = threading.Lock()
+
+
+def get_revocation_list():
+    """
+    Get the revocation list of the current process.
+
+    The list is created on first use, and again in forked worker processes
+    so that every worker syncs its own filter.
+    """
+    global _revocation_list, _revocation_list_pid
+    pid = os.getpid()
+    if _revocation_list_pid != pid:
+        with _revocation_list_lock:
+            if _revocation_list_pid != pid:
+                _revocation_list = RevocationList(**{
+                    key.lower(): value
+                    for key, value in settings.TOKEN_REVOCATION.items()
+                })
+                _revocation_list_pid = pid
+    return _revocation_list
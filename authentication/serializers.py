@@ -1,6 +1,13 @@
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 from authentication.models import User
+from authentication.revocation import get_revocation_list
+from core.serializers import TimedSerializerMixin
 
 
 class LoginSerializer(serializers.ModelSerializer):
@@ -14,8 +21,42 @@ class LoginSerializer(serializers.ModelSerializer):
         write_only_fields = ['password']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = User
         fields = ['id', 'username']
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh serializer that rejects revoked refresh tokens.
+    """
+
+    def validate(self, attrs):
+        try:
+            refresh = RefreshToken(attrs['refresh'])
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        if get_revocation_list().is_revoked(refresh[api_settings.JTI_CLAIM]):
+            raise InvalidToken(_('Token has been revoked'))
+        return super().validate(attrs)
+
+
+class RevokeTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+    def validate_refresh(self, value):
+        """
+        Check that the refresh token is valid and belongs to the current user.
+
+        Returns:
+            RefreshToken: The validated refresh token.
+        """
+        try:
+            refresh = RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(e.args[0])
+        if refresh.get(api_settings.USER_ID_CLAIM) != self.context['request'].user.id:
+            raise serializers.ValidationError('Token does not belong to the user')
+        return refresh
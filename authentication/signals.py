@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authentication.authentication import invalidate_user
+from authentication.models import User
+from core.invalidation import notify
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, using, **kwargs):
+    """
+    Drop a saved or deleted user from the authentication cache, of this
+    worker and, on commit, of the others.
+    """
+    invalidate_user(instance.id)
+    notify('user', [instance.id], using)
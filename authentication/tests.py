@@ -1,8 +1,27 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management import call_command
 from django.db import connection
-from django.test import TestCase
-from rest_framework.test import APIRequestFactory
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
+from authentication.authentication import (
+    CachedJWTAuthentication, token_cache, user_cache)
+from authentication.hashing import LoginOverloaded, PasswordVerifier
+from authentication.models import User
+from authentication.revocation import (
+    BloomFilter, RevocationList, get_revocation_list)
 from authentication.views import LoginView
 
 
@@ -125,3 +144,363 @@ class LoginViewTestCase(TestCase):
             response.data['error'], 'Invalid Credentials',
             "Expected error message 'Invalid Credentials', received %s" %
             response.data['error'])
+
+    def test_plain_text_password_is_hashed(self):
+        """
+        Test that a password stored in plain text is replaced by a hash on
+        the first successful login and that the hash is accepted afterwards.
+        """
+        request = self.factory.post(
+            '/api/login/', {'username': 'testuser', 'password': 'testpassword'})
+        response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT password FROM users WHERE username = %s', ['testuser'])
+            stored = cursor.fetchone()[0]
+        self.assertNotEqual(stored, 'testpassword')
+        self.assertTrue(stored.startswith('pbkdf2_sha256$'))
+
+        request = self.factory.post(
+            '/api/login/', {'username': 'testuser', 'password': 'testpassword'})
+        response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_hashed_password_invalid_credentials(self):
+        """
+        Test that a wrong password is rejected for a user with a hashed
+        password.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE users SET password = %s WHERE username = %s',
+                [make_password('testpassword'), 'testuser'])
+
+        request = self.factory.post(
+            '/api/login/', {'username': 'testuser', 'password': 'wrong'})
+        response = self.view(request)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_401_UNAUTHORIZED,
+            "Expected status code 401, received %s" % response.status_code)
+
+    def test_unknown_username(self):
+        """
+        Test that a login with an unknown username is rejected with 401.
+        """
+        request = self.factory.post(
+            '/api/login/', {'username': 'unknownuser', 'password': 'wrong'})
+        response = self.view(request)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_401_UNAUTHORIZED,
+            "Expected status code 401, received %s" % response.status_code)
+
+    def test_overloaded(self):
+        """
+        Test that a login is shed with 503 when the password verifier is
+        overloaded.
+        """
+        verifier = mock.Mock()
+        verifier.verify.side_effect = LoginOverloaded()
+        request = self.factory.post(
+            '/api/login/', {'username': 'testuser', 'password': 'testpassword'})
+
+        with mock.patch(
+                'authentication.views.get_password_verifier',
+                return_value=verifier):
+            response = self.view(request)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE,
+            "Expected status code 503, received %s" % response.status_code)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class PasswordVerifierTestCase(SimpleTestCase):
+
+    def slow_verify_password(self, password, encoded):
+        time.sleep(0.3)
+        return True, None
+
+    def test_admission_control(self):
+        """
+        Test that logins are rejected once the pool and its queue are full,
+        and that queued logins past the queue budget are dropped.
+        """
+        verifier = PasswordVerifier(workers=1, max_pending=1, queue_budget=0.1)
+        results = []
+
+        with mock.patch(
+                'authentication.hashing.verify_password',
+                self.slow_verify_password):
+            # Occupy the only worker
+            first = threading.Thread(
+                target=lambda: results.append(verifier.verify('a', 'b')))
+            first.start()
+            time.sleep(0.05)
+
+            # Queue a second login behind it, past the queue budget
+            second_error = []
+
+            def queued():
+                try:
+                    verifier.verify('a', 'b')
+                except LoginOverloaded as error:
+                    second_error.append(error)
+
+            second = threading.Thread(target=queued)
+            second.start()
+            time.sleep(0.05)
+
+            # The pool and the queue are full
+            with self.assertRaises(LoginOverloaded):
+                verifier.verify('a', 'b')
+
+            first.join()
+            second.join()
+
+        self.assertEqual(results, [(True, None)])
+        self.assertEqual(len(second_error), 1)
+
+    def test_failed_submit_releases_slot(self):
+        """
+        Test that a login the pool cannot take, e.g. after a shutdown, gives
+        its slot back instead of leaving later logins overloaded.
+        """
+        verifier = PasswordVerifier(workers=1, max_pending=0, queue_budget=1)
+        verifier.executor.shutdown()
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                verifier.verify('a', 'b')
+        self.assertTrue(verifier.slots.acquire(blocking=False))
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.authentication = CachedJWTAuthentication()
+        self.user = User.objects.create(username='cacheduser', password='x')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        user_cache.clear()
+        token_cache.clear()
+        # Load the revocation filter outside of the counted queries
+        get_revocation_list().sync(rebuild=True)
+
+    def authenticate(self):
+        request = self.factory.get(
+            '/api/book/list/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        user, _ = self.authentication.authenticate(request)
+        return user
+
+    def test_user_is_cached(self):
+        """
+        Test that the user is loaded once and then served from the cache
+        until it changes.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().username, 'cacheduser')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate().username, 'cacheduser')
+
+        # Saving the user invalidates the cached copy
+        self.user.username = 'renameduser'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().username, 'renameduser')
+
+    def test_deleted_user_is_rejected(self):
+        """
+        Test that a deleted user cannot authenticate with a cached token.
+        """
+        self.authenticate()
+        self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(JWT_USER_RESOLUTION={
+        'MODE': 'claims', 'CACHE_SIZE': 10, 'CACHE_TTL': 60})
+    def test_claims_mode(self):
+        """
+        Test that the user is built from the token without any query.
+        """
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(user.id, self.user.id)
+        self.assertFalse(user.is_staff)
+
+
+    def test_validated_token_is_cached(self):
+        """
+        Test that a token is only decoded and verified on its first use.
+        """
+        hits = token_cache.stats()['hits']
+        with mock.patch.object(
+                JWTAuthentication, 'get_validated_token', autospec=True,
+                side_effect=JWTAuthentication.get_validated_token) as validate:
+            self.authenticate()
+            self.authenticate()
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(token_cache.stats()['hits'], hits + 1)
+
+    def test_token_is_cached_until_it_expires(self):
+        """
+        Test that a token is kept for its remaining lifetime and not at all
+        once that has passed.
+        """
+        expires_at = AccessToken(self.token)['exp']
+        with mock.patch.object(token_cache, 'set', wraps=token_cache.set) as set_:
+            with mock.patch('authentication.authentication.time.time',
+                            return_value=expires_at - 30):
+                self.authenticate()
+            self.assertEqual(set_.call_args.kwargs['ttl'], 30)
+
+            token_cache.clear()
+            with mock.patch('authentication.authentication.time.time',
+                            return_value=expires_at + 1):
+                self.authenticate()
+            self.assertEqual(set_.call_count, 1)
+        self.assertEqual(len(token_cache), 0)
+
+
+class BloomFilterTestCase(SimpleTestCase):
+
+    def test_membership(self):
+        """
+        Test that added keys are always found and others rarely are.
+        """
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f'revoked-{i}')
+
+        self.assertTrue(all(f'revoked-{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'valid-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TokenRevocationTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='revokeduser', password='x')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = str(self.refresh.access_token)
+        token_cache.clear()
+        get_revocation_list().sync(rebuild=True)
+
+    def test_revoke(self):
+        """
+        Test that revoked access and refresh tokens are rejected.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(
+            self.client.get('/api/book/list/').status_code, status.HTTP_200_OK)
+
+        response = self.client.post(
+            '/api/login/token/revoke/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        # The access token is rejected although it is in the token cache
+        self.assertEqual(
+            self.client.get('/api/book/list/').status_code,
+            status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post(
+            '/api/login/token/refresh/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_other_users_token(self):
+        """
+        Test that a user cannot revoke the refresh token of another user.
+        """
+        other_user = User.objects.create(username='otheruser', password='x')
+        self.client.force_authenticate(other_user)
+        response = self.client.post(
+            '/api/login/token/revoke/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sync_revocations_of_other_processes(self):
+        """
+        Test that only filter hits query the database, and that a token
+        revoked elsewhere is found after the next sync.
+        """
+        revocation_list = RevocationList(
+            capacity=100, error_rate=0.001, sync_interval=60,
+            rebuild_interval=3600)
+        revocation_list.sync()
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation_list.is_revoked(self.refresh['jti']))
+
+        # Revoked by another process, unknown to this filter until it syncs
+        get_revocation_list().revoke(self.refresh)
+        self.assertFalse(revocation_list.is_revoked(self.refresh['jti']))
+
+        revocation_list.sync()
+        with self.assertNumQueries(1):
+            self.assertTrue(revocation_list.is_revoked(self.refresh['jti']))
+        self.assertEqual(revocation_list.stats()['revoked'], 1)
+
+
+class LoginThrottleTestCase(TestCase):
+
+    @override_settings(THROTTLE={
+        'BACKEND': 'local', 'RATES': {'login_username': '2/min'}})
+    def test_failed_login_attempts_per_username(self):
+        """
+        Test that once the failed login attempts of a username from an IP
+        reach the rate, its attempts from that IP are rejected with 429, while
+        other IPs and successful logins are not limited.
+        """
+        User.objects.create_user('throttleduser', 'secret')
+        client = APIClient()
+        # Keep all attempts in one window
+        self.enterContext(
+            mock.patch('core.throttling.time.time', return_value=1000 * 60))
+        for address, password, expected in [
+                ('10.0.0.1', 'secret', status.HTTP_200_OK),
+                ('10.0.0.1', 'secret', status.HTTP_200_OK),
+                ('10.0.0.1', 'secret', status.HTTP_200_OK),
+                ('10.0.0.1', 'wrong', status.HTTP_401_UNAUTHORIZED),
+                ('10.0.0.1', 'wrong', status.HTTP_401_UNAUTHORIZED),
+                ('10.0.0.1', 'secret', status.HTTP_429_TOO_MANY_REQUESTS),
+                ('10.0.0.2', 'secret', status.HTTP_200_OK)]:
+            response = client.post(
+                '/api/login/', {'username': 'throttleduser', 'password': password},
+                REMOTE_ADDR=address)
+            self.assertEqual(response.status_code, expected)
+            if expected == status.HTTP_429_TOO_MANY_REQUESTS:
+                self.assertIn('Retry-After', response)
+
+
+class ImportUsersCommandTestCase(TestCase):
+
+    def test_import_users(self):
+        """
+        Test that new users are created with hashed passwords while existing
+        usernames and invalid rows are skipped.
+        """
+        User.objects.create(username='existinguser', password='unchanged')
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as input_file:
+            for record in [
+                    {'username': 'importeduser', 'password': 'secret'},
+                    {'username': 'existinguser', 'password': 'other'},
+                    {'username': '', 'password': 'invalid'},
+                    {'username': 'nopassword'}]:
+                input_file.write(json.dumps(record) + '\n')
+
+        out = StringIO()
+        call_command('import_users', path, workers=1, stdout=out)
+
+        self.assertIn(
+            'Imported 2 users', out.getvalue().splitlines()[-1])
+        self.assertTrue(check_password(
+            'secret', User.objects.get(username='importeduser').password))
+        self.assertFalse(
+            User.objects.get(username='nopassword').has_usable_password())
+        self.assertEqual(
+            User.objects.get(username='existinguser').password, 'unchanged')
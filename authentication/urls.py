@@ -1,9 +1,9 @@
 from django.urls import path
-from authentication.views import LoginView
-from rest_framework_simplejwt.views import TokenRefreshView
+from authentication.views import LoginView, RefreshView, RevokeTokenView
 
 
 urlpatterns = [
     path('', LoginView.as_view(), name='login'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh')
+    path('token/refresh/', RefreshView.as_view(), name='token_refresh'),
+    path('token/revoke/', RevokeTokenView.as_view(), name='token_revoke'),
 ]
@@ -1,14 +1,21 @@
-from django.db import connection
 from rest_framework.response import Response
 from rest_framework import status, generics
+from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
 
+from authentication.hashing import LoginOverloaded, get_password_verifier
 from authentication.models import User
-from authentication.serializers import LoginSerializer
+from authentication.queries import UPDATE_PASSWORD, USER_CREDENTIALS
+from authentication.revocation import get_revocation_list
+from authentication.serializers import (
+    LoginSerializer, RevocableTokenRefreshSerializer, RevokeTokenSerializer)
+from core.throttling import LoginIPRateThrottle, LoginUsernameRateThrottle
 
 
 class LoginView(generics.CreateAPIView):
     serializer_class = LoginSerializer
+    throttle_classes = [LoginIPRateThrottle, LoginUsernameRateThrottle]
 
     def post(self, request, *args, **kwargs):
         """
@@ -23,7 +30,8 @@ class LoginView(generics.CreateAPIView):
             Response:
                 The HTTP response object containing the user information,
                 refresh token, and access token. If the credentials are
-                invalid, an error message is returned.
+                invalid, an error message is returned. If the password
+                cannot be verified in time, a 503 response is returned.
         """
         # Get the username and password from the request data
         username = request.data.get('username')
@@ -37,33 +45,82 @@ class LoginView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST)
 
         # Query the database for the user credentials
-        with connection.cursor() as cursor:
-            # Execute the SQL query to check if the user exists
-            cursor.execute(
-                'SELECT id, password FROM users WHERE username = %s', [username])
-            row = cursor.fetchone()
-
-        # Check if the user exists in the database
-        if row is not None:
-            user_id, user_password = row
-
-            # Check if the password is correct
-            if password == user_password:
-                # Create a user object with the retrieved information
-                user = User(id=user_id, username=username)
-                # Generate refresh and access tokens
-                refresh_token = RefreshToken.for_user(user)
-                # Return a success response with the user information, refresh token, and access token
-                return Response({
-                    'user': {
-                        'id': user.id,
-                        'username': user.username
-                    },
-                    'refresh': str(refresh_token),
-                    'access': str(refresh_token.access_token),
-                }, status=status.HTTP_200_OK)
+        row = USER_CREDENTIALS.fetchone([username])
+
+        # Verify the password on the bounded hashing pool, also for unknown
+        # users so that both cases take the same time
+        user_id, user_password, is_superuser = (
+            row if row is not None else (None, None, False))
+        try:
+            is_correct, new_password = get_password_verifier().verify(
+                password, user_password)
+        except LoginOverloaded:
+            # Shed the login quickly rather than queueing it behind others
+            return Response(
+                {'error': 'Too many login attempts, try again later'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'})
+
+        # Check if the user exists and the password is correct
+        if row is not None and is_correct:
+            if new_password is not None:
+                # Replace a plain text or outdated password hash
+                UPDATE_PASSWORD.run([new_password, user_id])
+
+            # Create a user object with the retrieved information
+            user = User(id=user_id, username=username)
+            # Generate refresh and access tokens
+            refresh_token = RefreshToken.for_user(user)
+            # Let authentication trust the admin flag without a query
+            refresh_token['is_superuser'] = is_superuser
+            # Return a success response with the user information, refresh token, and access token
+            return Response({
+                'user': {
+                    'id': user.id,
+                    'username': user.username
+                },
+                'refresh': str(refresh_token),
+                'access': str(refresh_token.access_token),
+            }, status=status.HTTP_200_OK)
+
+        # Count the failure against the username, from this IP
+        LoginUsernameRateThrottle().record(request, self)
 
         # Return an error response if the credentials are invalid
         return Response(
             {'error': 'Invalid Credentials'},
             status=status.HTTP_401_UNAUTHORIZED)
+
+
+class RefreshView(TokenRefreshView):
+    serializer_class = RevocableTokenRefreshSerializer
+
+
+class RevokeTokenView(generics.GenericAPIView):
+    serializer_class = RevokeTokenSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handle HTTP POST request to log out.
+
+        Revokes the given refresh token and the access token of the request,
+        so that neither can be used again before it expires.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            Response: An empty 204 response, or 400 if the refresh token is
+                invalid or belongs to another user.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        revocation_list = get_revocation_list()
+        revocation_list.revoke(serializer.validated_data['refresh'])
+        if request.auth is not None:
+            revocation_list.revoke(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,80 @@
+from django.conf import settings
+
+from book.models import Book
+from book.queries import (
+    BOOKS_BY_GENRE, BOOKS_BY_GENRE_PAGE, LIST_BOOKS, LIST_BOOKS_PAGE)
+from book.serializers import BookSerializer
+from book.views import BOOK_LIST_FLIGHT, BOOKS_BY_GENRE_FLIGHT, stale_books
+from core.async_views import async_api_view, json_response
+from core.db.routers import aget_read_alias
+from core.db.timeouts import DEGRADED_HEADER, arun_with_budget
+
+
+async def aload_books(query, params, using):
+    """
+    Async counterpart of book.views.load_books().
+    """
+    rows = await query.afetchall(params, using=using)
+    books = [
+        Book(id=row[0], title=row[1], author=row[2], genre=row[3])
+        for row in rows
+    ]
+    return BookSerializer(books, many=True).data
+
+
+async def aload_books_with_budget(name, genre, using):
+    """
+    Async counterpart of book.views.load_books_with_budget().
+    """
+    page_size = settings.STATEMENT_TIMEOUTS['PAGE_SIZE']
+    if genre is None:
+        query, page_query, params = LIST_BOOKS, LIST_BOOKS_PAGE, []
+    else:
+        query, page_query, params = BOOKS_BY_GENRE, BOOKS_BY_GENRE_PAGE, [genre]
+    data, degraded = await arun_with_budget(
+        name, lambda: aload_books(query, params, using),
+        fallbacks=[
+            ('stale', lambda: stale_books.get(genre)),
+            ('partial', lambda: aload_books(page_query, params + [page_size], using)),
+        ])
+    if degraded is None:
+        stale_books.set(genre, data)
+    return data, degraded
+
+
+def abooks_response(data, degraded):
+    return json_response(
+        data, headers={DEGRADED_HEADER: degraded} if degraded else None)
+
+
+@async_api_view()
+async def book_list(request):
+    """
+    Async counterpart of BookListView: list all books.
+
+    Returns:
+        HttpResponse: The list of books, or an empty list.
+    """
+    using = await aget_read_alias(request)
+    return abooks_response(*await BOOK_LIST_FLIGHT.ado(
+        using, lambda: aload_books_with_budget('book_list', None, using)))
+
+
+@async_api_view()
+async def books_by_genre(request):
+    """
+    Async counterpart of BooksListByGenreView: list the books of the genre
+    given by the `genre` query parameter.
+
+    Returns:
+        HttpResponse: The list of books, or an empty list if there are none
+            or no genre is given.
+    """
+    genre = request.GET.get('genre', None)
+    if not genre:
+        return json_response([])
+
+    using = await aget_read_alias(request)
+    return abooks_response(*await BOOKS_BY_GENRE_FLIGHT.ado(
+        (genre, using),
+        lambda: aload_books_with_budget('book_by_genre', genre, using)))
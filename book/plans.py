@@ -0,0 +1,23 @@
+from core.db.plans import expect_plan
+
+from book.queries import (
+    BOOKS_BY_GENRE, BOOKS_BY_GENRE_PAGE, LIST_BOOKS, LIST_BOOKS_PAGE)
+
+
+expect_plan(
+    LIST_BOOKS, lambda sample: [],
+    seq_scans=['books'], max_cost=500)
+
+# There is no index on genre: a genre is too large a part of the books for
+# one to pay off
+expect_plan(
+    BOOKS_BY_GENRE, lambda sample: [sample.genre],
+    seq_scans=['books'], max_cost=550)
+
+expect_plan(
+    LIST_BOOKS_PAGE, lambda sample: [100],
+    indexes=['books(id)'], max_cost=50)
+
+expect_plan(
+    BOOKS_BY_GENRE_PAGE, lambda sample: [sample.genre, 100],
+    indexes=['books(id)'], max_cost=300)
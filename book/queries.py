@@ -0,0 +1,20 @@
+from core.db.queries import Query
+
+
+LIST_BOOKS = Query(
+    'book.list',
+    'SELECT id, title, author, genre FROM books')
+
+BOOKS_BY_GENRE = Query(
+    'book.by_genre',
+    'SELECT id, title, author, genre FROM books WHERE genre = %s')
+
+# The first books, for partial results
+LIST_BOOKS_PAGE = Query(
+    'book.list_page',
+    'SELECT id, title, author, genre FROM books ORDER BY id LIMIT %s')
+
+BOOKS_BY_GENRE_PAGE = Query(
+    'book.by_genre_page',
+    'SELECT id, title, author, genre FROM books WHERE genre = %s '
+    'ORDER BY id LIMIT %s')
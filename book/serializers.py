@@ -1,10 +1,20 @@
 from rest_framework import serializers
 
 from book.models import Book
+from core.serializers import TimedListSerializer, TimedSerializerMixin
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Book
         fields = ['id', 'title', 'author', 'genre']
+        list_serializer_class = TimedListSerializer
+
+
+class BookGenreQuerySerializer(serializers.Serializer):
+    """
+    The query parameters of the books by genre view, for the schema.
+    """
+    genre = serializers.CharField(
+        required=False, allow_blank=True, help_text='Filter by genre')
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from book.models import Book
+from core.invalidation import notify
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_cached_books(sender, instance, using, **kwargs):
+    """
+    Drop the cached results depending on books when one is saved or deleted,
+    e.g. from the admin.
+    """
+    notify('book', [instance.id], using)
@@ -1,11 +1,27 @@
-from django.db import connection
-from django.test import TestCase
-from rest_framework.test import APIRequestFactory
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework.test import force_authenticate
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
 
 from authentication.models import User
-from book.views import BookListView, BooksListByGenreView
+from book.models import Book
+from core.db.aio import close_async_pools
+from core.db.queries import Query
+from core.testing import (
+    DATA_SIZES, GENRES, QueryBudgetMixin, create_reviews)
+from book.views import BookListView, BooksListByGenreView, stale_books
+
+
+# A book list query exceeding any statement timeout
+SLOW_LIST_BOOKS = Query(
+    'tests.slow_book_list',
+    'SELECT id, title, author, genre FROM books, pg_sleep(5) ORDER BY id')
 
 
 class BookListViewTestCase(TestCase):
@@ -219,3 +235,164 @@ class BookListByGenreViewTestCase(TestCase):
         # Assert that the response data is an empty list
         expected_books = []
         self.assertEqual(response.data, expected_books)
+
+
+class BookViewsAsyncTestCase(TransactionTestCase):
+    # The async views query over connections of their own, which do not see
+    # the data of an open test transaction
+
+    def setUp(self):
+        self.user = User.objects.create(username='asyncuser', password='x')
+        # Explicit ids leave the sequence, and the ids other tests expect,
+        # untouched
+        Book.objects.bulk_create([
+            Book(id=900000 + i, title=f'Book {i}', author=f'Author {i}',
+                 genre='Adventure' if i % 2 else 'Horror')
+            for i in range(6)
+        ])
+        self.authorization = f'Bearer {AccessToken.for_user(self.user)}'
+        self.client = APIClient(HTTP_AUTHORIZATION=self.authorization)
+
+    def tearDown(self):
+        # Idle connections would keep the test database from being dropped
+        close_async_pools()
+
+    async def test_unauthenticated_request(self):
+        """
+        Test that the async book list requires authentication.
+        """
+        response = await self.async_client.get('/api/async/book/list/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+
+    async def test_same_response_as_sync_views(self):
+        """
+        Test that the async views return the same books as the sync ones.
+        """
+        for path in ['book/list/', 'book/?genre=Horror', 'book/']:
+            with self.subTest(path=path):
+                response = await self.async_client.get(
+                    f'/api/async/{path}', AUTHORIZATION=self.authorization)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                expected = await sync_to_async(self.client.get)(f'/api/{path}')
+                self.assertEqual(
+                    sorted(response.json(), key=str),
+                    sorted(expected.json(), key=str))
+
+    async def test_fallbacks(self):
+        """
+        Test that the async book list falls back like the sync one when it
+        exceeds its statement timeout, and flags the response.
+        """
+        await sync_to_async(stale_books.clear)()
+        self.addCleanup(stale_books.clear)
+        options = {
+            **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'book_list': 0.05},
+            'PAGE_SIZE': 2}
+        with override_settings(STATEMENT_TIMEOUTS=options):
+            with mock.patch('book.async_views.LIST_BOOKS', SLOW_LIST_BOOKS), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = await self.async_client.get(
+                    '/api/async/book/list/', AUTHORIZATION=self.authorization)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['X-Degraded'], 'partial')
+            self.assertEqual(len(response.json()), 2)
+
+            response = await self.async_client.get(
+                '/api/async/book/list/', AUTHORIZATION=self.authorization)
+            self.assertNotIn('X-Degraded', response)
+            books = response.json()
+            self.assertEqual(len(books), 6)
+
+            with mock.patch('book.async_views.LIST_BOOKS', SLOW_LIST_BOOKS), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = await self.async_client.get(
+                    '/api/async/book/list/', AUTHORIZATION=self.authorization)
+            self.assertEqual(response['X-Degraded'], 'stale')
+            self.assertEqual(response.json(), books)
+
+
+class BookQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='budgetuser', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(stale_books.clear)
+
+    def test_query_budgets(self):
+        """
+        Test that listing all books or the books of a genre runs one query,
+        fetching only the listed books, whatever the number of books.
+        """
+        counts = {'list': {}, 'genre': {}}
+        for size in DATA_SIZES:
+            # The fallbacks must not answer with the books of another size
+            stale_books.clear()
+            with self.subTest(size=size), transaction.atomic():
+                books = create_reviews(self.user.id, size, first_id=1000000)
+
+                with self.assertQueryBudget(queries=1, rows=books) as log:
+                    response = self.client.get('/api/book/list/')
+                self.assertNotDegraded(response)
+                self.assertEqual(len(response.data), books)
+                counts['list'][size] = len(log)
+
+                with self.assertQueryBudget(
+                        queries=1, rows=books // len(GENRES) + 1) as log:
+                    response = self.client.get('/api/book/', {'genre': 'Drama'})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotDegraded(response)
+                self.assertEqual(
+                    sorted(book['id'] for book in response.data),
+                    [id for id in range(1000000, 1000000 + books)
+                     if GENRES[id % len(GENRES)] == 'Drama'])
+                counts['genre'][size] = len(log)
+
+                transaction.set_rollback(True)
+
+        for view in counts.values():
+            self.assertConstantQueries(view)
+
+
+class BookStatementTimeoutTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='timeoutuser', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Book.objects.bulk_create([
+            Book(id=2000000 + i, title=f'Timeout {i}', author='Author',
+                 genre='Drama')
+            for i in range(3)
+        ])
+        stale_books.clear()
+        self.addCleanup(stale_books.clear)
+
+    def test_fallbacks(self):
+        """
+        Test that a book list exceeding its statement timeout is answered
+        with the first page of books, then with the last full list, and
+        flagged.
+        """
+        options = {
+            **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'book_list': 0.05},
+            'PAGE_SIZE': 2}
+        with override_settings(STATEMENT_TIMEOUTS=options):
+            with mock.patch('book.views.LIST_BOOKS', SLOW_LIST_BOOKS), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = self.client.get('/api/book/list/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Degraded'], 'partial')
+            self.assertEqual(len(response.json()), 2)
+
+            response = self.client.get('/api/book/list/')
+            self.assertNotIn('X-Degraded', response)
+            books = response.json()
+            self.assertEqual(len(books), 3)
+
+            with mock.patch('book.views.LIST_BOOKS', SLOW_LIST_BOOKS), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = self.client.get('/api/book/list/')
+            self.assertEqual(response['X-Degraded'], 'stale')
+            self.assertEqual(response.json(), books)
@@ -1,12 +1,76 @@
-from django.db import connection
+from django.conf import settings
 from rest_framework.response import Response
 from rest_framework import status, generics
 from rest_framework.permissions import IsAuthenticated
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
 
-from book.serializers import BookSerializer
+from book.serializers import BookGenreQuerySerializer, BookSerializer
 from book.models import Book
+from book.queries import (
+    BOOKS_BY_GENRE, BOOKS_BY_GENRE_PAGE, LIST_BOOKS, LIST_BOOKS_PAGE)
+from core.caches import LocalCache
+from core.db.routers import get_read_alias
+from core.db.timeouts import DEGRADED_HEADER, run_with_budget
+from core.invalidation import register_cache
+from core.schema import schema_overrides
+from core.singleflight import SingleFlight
+
+
+# Concurrent requests for the same books share one query and serialization
+BOOK_LIST_FLIGHT = SingleFlight('book.list')
+BOOKS_BY_GENRE_FLIGHT = SingleFlight('book.by_genre')
+
+# The last books of the list, by None, and of each genre, for when loading
+# them exceeds the statement timeout
+stale_books = register_cache(LocalCache(
+    max_size=settings.STATEMENT_TIMEOUTS['STALE_SIZE'],
+    ttl=settings.STATEMENT_TIMEOUTS['STALE_TTL']), entities=['book'])
+
+
+def load_books(query, params, using):
+    """
+    Run a query of books and serialize them.
+
+    Returns:
+        ReturnList: The serialized books, shared with concurrent requests.
+    """
+    rows = query.fetchall(params, using=using)
+    books = [
+        Book(id=row[0], title=row[1], author=row[2], genre=row[3])
+        for row in rows
+    ]
+    return BookSerializer(books, many=True).data
+
+
+def load_books_with_budget(name, genre, using):
+    """
+    Load the books of a genre, or all books if genre is None, under the
+    statement timeout of the endpoint, falling back to the last books loaded
+    or the first page of them.
+
+    Returns:
+        tuple: The serialized books and the fallback used, or None.
+    """
+    page_size = settings.STATEMENT_TIMEOUTS['PAGE_SIZE']
+    if genre is None:
+        query, page_query, params = LIST_BOOKS, LIST_BOOKS_PAGE, []
+    else:
+        query, page_query, params = BOOKS_BY_GENRE, BOOKS_BY_GENRE_PAGE, [genre]
+    data, degraded = run_with_budget(
+        name, using, lambda: load_books(query, params, using),
+        fallbacks=[
+            ('stale', lambda: stale_books.get(genre)),
+            ('partial', lambda: load_books(page_query, params + [page_size], using)),
+        ])
+    if degraded is None:
+        stale_books.set(genre, data)
+    return data, degraded
+
+
+def books_response(data, degraded):
+    response = Response(data, status=status.HTTP_200_OK)
+    if degraded:
+        response[DEGRADED_HEADER] = degraded
+    return response
 
 
 class BookListView(generics.ListAPIView):
@@ -27,26 +91,14 @@ class BookListView(generics.ListAPIView):
         Returns:
             Response: The HTTP response containing the list of books or an empty list.
         """
-        # Execute the SQL query to retrieve all books
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT id, title, author, genre FROM books')
-            rows = cursor.fetchall()
+        # Retrieve and serialize all books, or wait for a concurrent request
+        # doing it
+        using = get_read_alias(request)
+        data, degraded = BOOK_LIST_FLIGHT.do(
+            using, lambda: load_books_with_budget('book_list', None, using))
 
-        # Check if any books are found
-        if rows:
-            # Create a list of dictionaries containing the book information
-            books = [
-                Book(id=row[0], title=row[1], author=row[2], genre=row[3])
-                for row in rows
-            ]
-        else:
-            # Return an empty list if no books are found
-            books = []
-
-        serializer = BookSerializer(books, many=True)
-
-        # Return the list of books as a JSON response
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Return the list of books as a JSON response, flagged if degraded
+        return books_response(data, degraded)
 
 
 class BooksListByGenreView(generics.ListAPIView):
@@ -60,14 +112,7 @@ class BooksListByGenreView(generics.ListAPIView):
         Response: The HTTP response containing the list of books or an empty list.
     """
 
-    genre_param_config = openapi.Parameter(
-        'genre',
-        in_=openapi.IN_QUERY,
-        description='Filter by genre',
-        type=openapi.TYPE_STRING
-    )
-
-    @swagger_auto_schema(manual_parameters=[genre_param_config,])
+    @schema_overrides(query_serializer=BookGenreQuerySerializer)
     def get(self, request, *args, **kwargs):
         """
         Retrieve a list of all books from the database that match the specified genre.
@@ -82,24 +127,12 @@ class BooksListByGenreView(generics.ListAPIView):
             # Return an empty list if no genre is provided
             return Response([])
 
-        # Execute the SQL query to retrieve all books with the specified genre
-        with connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT id, title, author, genre FROM books WHERE genre = %s', [genre])
-            rows = cursor.fetchall()
-
-        # Check if any books are found
-        if rows:
-            # Create a list of dictionaries containing the book information
-            books = [
-                Book(id=row[0], title=row[1], author=row[2], genre=row[3])
-                for row in rows
-            ]
-        else:
-            # Return an empty list if no books are found
-            books = []
-
-        serializer = BookSerializer(books, many=True)
-
-        # Return the list of books as a JSON response
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Retrieve and serialize the books with the specified genre, or wait
+        # for a concurrent request doing it
+        using = get_read_alias(request)
+        data, degraded = BOOKS_BY_GENRE_FLIGHT.do(
+            (genre, using),
+            lambda: load_books_with_budget('book_by_genre', genre, using))
+
+        # Return the list of books as a JSON response, flagged if degraded
+        return books_response(data, degraded)
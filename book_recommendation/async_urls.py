@@ -0,0 +1,18 @@
+"""
+Async versions of the read endpoints, mounted under api/async/ with the same
+paths as their sync counterparts. They are meant to be served by the ASGI
+application; under WSGI they work but gain nothing.
+"""
+from django.urls import path
+
+from book.async_views import book_list, books_by_genre
+from review.async_views import user_reviews
+from suggest.async_views import suggest_books
+
+
+urlpatterns = [
+    path('book/', books_by_genre, name='async_book_by_genre'),
+    path('book/list/', book_list, name='async_book_list'),
+    path('review/list', user_reviews, name='async_user_reviews'),
+    path('suggest/', suggest_books, name='async_suggest_book'),
+]
@@ -11,12 +11,19 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from datetime import timedelta
+import importlib.util
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# drf_yasg is not an installed app, as importing it costs every worker
+# ~150ms at startup; only the schema routes import it (see core.schema).
+# Its templates and static files are added to DIRS and STATICFILES_DIRS.
+DRF_YASG_DIR = Path(importlib.util.find_spec('drf_yasg').origin).parent
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -43,9 +50,9 @@ INSTALLED_APPS = [
     # Packages
     'rest_framework',
     'rest_framework_simplejwt',
-    'drf_yasg',
 
     # Apps
+    'core.apps.CoreConfig',
     'authentication.apps.AuthenticationConfig',
     'book.apps.BookConfig',
     'review.apps.ReviewConfig',
@@ -57,7 +64,7 @@ AUTH_USER_MODEL = 'authentication.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
     ),
 }
 
@@ -66,6 +73,72 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
+# How CachedJWTAuthentication resolves the user of an access token: 'cache'
+# loads it once per CACHE_TTL seconds per process, 'claims' builds it from the
+# verified token without querying the database.
+JWT_USER_RESOLUTION = {
+    'MODE': os.environ.get('JWT_USER_MODE', 'cache'),
+    'CACHE_SIZE': int(os.environ.get('JWT_USER_CACHE_SIZE', 10000)),
+    'CACHE_TTL': float(os.environ.get('JWT_USER_CACHE_TTL', 60)),
+}
+
+# Number of verified access tokens CachedJWTAuthentication keeps per process
+# until they expire, 0 to verify every request.
+JWT_TOKEN_CACHE = {
+    'SIZE': int(os.environ.get('JWT_TOKEN_CACHE_SIZE', 10000)),
+}
+
+# Revoked tokens are kept in the revoked_tokens table and mirrored in a Bloom
+# filter of about CAPACITY jtis per process, so that only filter hits query
+# the database. Each process syncs its filter every SYNC_INTERVAL seconds and
+# rebuilds it every REBUILD_INTERVAL seconds to drop expired revocations.
+TOKEN_REVOCATION = {
+    'CAPACITY': int(os.environ.get('TOKEN_REVOCATION_CAPACITY', 100000)),
+    'ERROR_RATE': float(os.environ.get('TOKEN_REVOCATION_ERROR_RATE', 0.001)),
+    'SYNC_INTERVAL': float(os.environ.get('TOKEN_REVOCATION_SYNC_INTERVAL', 5)),
+    'REBUILD_INTERVAL': float(
+        os.environ.get('TOKEN_REVOCATION_REBUILD_INTERVAL', 3600)),
+}
+
+# Events of the review outbox, see review.outbox. The purge_review_events
+# command deletes those every consumer has committed and, so that a consumer
+# that stopped does not keep them forever, those older than RETENTION_DAYS.
+REVIEW_OUTBOX = {
+    'RETENTION_DAYS': float(os.environ.get('REVIEW_OUTBOX_RETENTION_DAYS', 7)),
+}
+
+# Sliding-window rate limits, see core.throttling. BACKEND is 'shm', the
+# default, for counters shared by the workers of a host in a memory-mapped
+# file at SHM_PATH, by default in the temporary directory, 'cache' to share
+# them across hosts through the default cache, or 'local' for per-process
+# counters, which only hold with a single process and are the default of
+# `manage.py test` so that test runs do not share counters. An empty rate
+# disables a throttle. The login_username rate counts failed logins per
+# username and IP.
+THROTTLE = {
+    'BACKEND': os.environ.get(
+        'THROTTLE_BACKEND', 'local' if sys.argv[1:2] == ['test'] else 'shm'),
+    'SHM_PATH': os.environ.get('THROTTLE_SHM_PATH', ''),
+    'SHM_SLOTS': int(os.environ.get('THROTTLE_SHM_SLOTS', 65536)),
+    'RATES': {
+        'login_ip': os.environ.get('THROTTLE_LOGIN_IP_RATE', '60/min'),
+        'login_username': os.environ.get(
+            'THROTTLE_LOGIN_USERNAME_RATE', '20/min'),
+        'review': os.environ.get('THROTTLE_REVIEW_RATE', '60/min'),
+        'suggest': os.environ.get('THROTTLE_SUGGEST_RATE', '120/min'),
+    },
+}
+
+# Password verification for logins runs on a bounded thread pool. Logins
+# beyond WORKERS + MAX_PENDING, or waiting longer than QUEUE_BUDGET seconds,
+# are rejected with 503 instead of starving other requests of CPU.
+LOGIN_PASSWORD_VERIFIER = {
+    'WORKERS': int(os.environ.get(
+        'LOGIN_HASHER_WORKERS', max(1, (os.cpu_count() or 1) // 2))),
+    'MAX_PENDING': int(os.environ.get('LOGIN_HASHER_MAX_PENDING', 16)),
+    'QUEUE_BUDGET': float(os.environ.get('LOGIN_HASHER_QUEUE_BUDGET', 0.5)),
+}
+
 # SWAGGER
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -76,9 +149,19 @@ SWAGGER_SETTINGS = {
         },
     },
     'PERSIST_AUTH': True,
+    # The UI loads the precomputed schema, see OPENAPI_SCHEMA
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
 }
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.db.slow_queries.SlowQueryMiddleware',
+    'core.invalidation.InvalidationMiddleware',
+    'core.db.routers.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,7 +176,7 @@ ROOT_URLCONF = 'book_recommendation.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [DRF_YASG_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -112,17 +195,185 @@ WSGI_APPLICATION = 'book_recommendation.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# With POSTGRES_POOL enabled connections are checked out of a per-process
+# pool (core.db.backends.postgresql) and returned at the end of every request.
+# Otherwise each request opens its own connection, unless
+# POSTGRES_CONN_MAX_AGE is set to keep the connection of each thread for that
+# many seconds, checking that it still works before reusing it with health
+# checks enabled. Only set it under WSGI: under ASGI requests run their
+# queries on threads that do not outlive them, so persistent connections
+# would leak, and POSTGRES_POOL is the way to reuse them.
+POSTGRES_POOL = os.environ.get('POSTGRES_POOL', '').lower() in ('1', 'true', 'yes')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': (
+            'core.db.backends.postgresql' if POSTGRES_POOL
+            else 'django.db.backends.postgresql'),
         'NAME': os.environ.get('POSTGRES_NAME'),
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('POSTGRES_HOST'),
         'PORT': os.environ.get('POSTGRES_PORT'),
+        'CONN_MAX_AGE': (
+            0 if POSTGRES_POOL
+            else int(os.environ.get('POSTGRES_CONN_MAX_AGE', 0))),
+        'CONN_HEALTH_CHECKS': os.environ.get(
+            'POSTGRES_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes'),
+        # Run the named queries of core.db.queries as prepared statements
+        # on connections that are reused
+        'PREPARE': os.environ.get(
+            'POSTGRES_PREPARE', 'true').lower() in ('1', 'true', 'yes'),
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+            'MAX_SIZE': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 20)),
+            # Seconds to wait for a free connection before failing
+            'TIMEOUT': float(os.environ.get('POSTGRES_POOL_TIMEOUT', 10)),
+            # Connections idle for longer are pinged before being reused
+            'CHECK_IDLE': float(os.environ.get('POSTGRES_POOL_CHECK_IDLE', 30)),
+            'MAX_LIFETIME': float(
+                os.environ.get('POSTGRES_POOL_MAX_LIFETIME', 3600)),
+        },
+    }
+}
+
+# A read replica is only configured when POSTGRES_REPLICA_HOST is set. Its
+# other connection settings default to those of the primary, so pointing it
+# at the same server is enough to try routing locally. Tests read the
+# replica through the connection of the primary.
+if os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get(
+            'POSTGRES_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.environ.get(
+            'POSTGRES_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.environ.get(
+            'POSTGRES_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.environ.get('POSTGRES_REPLICA_HOST'),
+        'PORT': os.environ.get(
+            'POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'POOL': dict(DATABASES['default']['POOL']),
+        'TEST': {'MIRROR': 'default'},
     }
+    # Read-your-writes pins are kept by user id in the 'primary_pins' cache
+    # by default, see core.db.routers, which must be shared by the workers:
+    # Redis by default, or e.g. Memcached with
+    # POSTGRES_REPLICA_PIN_CACHE_BACKEND. A DatabaseCache needs `manage.py
+    # createcachetable` and queries the primary on every routed read.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'primary_pins': {
+            'BACKEND': os.environ.get(
+                'POSTGRES_REPLICA_PIN_CACHE_BACKEND',
+                'django.core.cache.backends.redis.RedisCache'),
+            'LOCATION': os.environ.get(
+                'POSTGRES_REPLICA_PIN_CACHE_LOCATION', 'redis://localhost:6379'),
+        },
+    }
+
+DATABASE_ROUTERS = ['core.db.routers.PrimaryReplicaRouter']
+
+DATABASE_REPLICA = {
+    # Apps whose ORM reads go to the replica
+    'APPS': ['book'],
+    # Seconds a user's reads stay on the primary after they write a review
+    'STICKY_SECONDS': float(os.environ.get('POSTGRES_REPLICA_STICKY_SECONDS', 5)),
+    # Where pins are kept, 'cache' or 'cookie'
+    'PIN_STORE': os.environ.get('POSTGRES_REPLICA_PIN_STORE', 'cache'),
+    # Cache of the pins with the 'cache' store, shared by the workers when
+    # there is a replica
+    'CACHE': 'primary_pins' if 'replica' in DATABASES else 'default',
+}
+
+# Request metrics, see core.metrics. With several worker processes DIR must
+# be set to a directory shared by the workers of a host, emptied on start.
+# The metrics view requires TOKEN as a bearer token, or a staff user logged in
+# to the admin when it is empty.
+METRICS = {
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    'DIR': os.environ.get('METRICS_DIR', ''),
+    'FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+    'SERVER_TIMING': os.environ.get(
+        'METRICS_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes'),
+}
+
+# The OpenAPI schema, generated into DIR by the generate_schema command and
+# served with an ETag and MAX_AGE seconds of Cache-Control, see core.schema
+OPENAPI_SCHEMA = {
+    'DIR': os.environ.get('OPENAPI_SCHEMA_DIR', BASE_DIR / 'openapi'),
+    'MAX_AGE': int(os.environ.get('OPENAPI_SCHEMA_MAX_AGE', 3600)),
+}
+
+# Sampled log of slow SQL queries, see core.db.slow_queries. THRESHOLD and
+# FLUSH_INTERVAL are in seconds. With several worker processes DIR must be set
+# to a directory shared by the workers of a host, emptied on start.
+SLOW_QUERIES = {
+    'ENABLED': os.environ.get(
+        'SLOW_QUERIES', 'false').lower() in ('1', 'true', 'yes'),
+    'THRESHOLD': float(os.environ.get('SLOW_QUERIES_THRESHOLD', 0.1)),
+    'SAMPLE_RATE': float(os.environ.get('SLOW_QUERIES_SAMPLE_RATE', 0.01)),
+    'DIR': os.environ.get('SLOW_QUERIES_DIR', ''),
+    'WINDOW': 1000,
+    'MAX_FINGERPRINTS': 500,
+    'FLUSH_INTERVAL': 5,
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+}
+
+# Statement timeout budgets of the read endpoints in seconds, by URL name, and
+# their fallbacks, see core.db.timeouts. A budget of 0 disables it. Partial and
+# popularity-based results have PAGE_SIZE rows, the latter read from the
+# table kept by the refresh_popular_books command; the last results of
+# endpoints are kept STALE_TTL seconds, STALE_SIZE per endpoint. The budget of
+# the streamed export applies to each of its batches.
+STATEMENT_TIMEOUTS = {
+    'BUDGETS': {
+        'book_list': float(os.environ.get('STATEMENT_TIMEOUT_BOOK_LIST', 2)),
+        'book_by_genre': float(
+            os.environ.get('STATEMENT_TIMEOUT_BOOK_BY_GENRE', 1)),
+        'user_reviews': float(
+            os.environ.get('STATEMENT_TIMEOUT_USER_REVIEWS', 1)),
+        'suggest_book': float(os.environ.get('STATEMENT_TIMEOUT_SUGGEST', 1)),
+        'export_reviews': float(
+            os.environ.get('STATEMENT_TIMEOUT_EXPORT', 30)),
+    },
+    'FALLBACK_BUDGET': 0.25,
+    'PAGE_SIZE': 100,
+    'STALE_SIZE': 1000,
+    'STALE_TTL': 3600,
+}
+
+# Coalescing of concurrent identical computations, see core.singleflight.
+# With ADVISORY_LOCKS, processes also coordinate through advisory locks on the
+# USING database and hand results over through CACHE, which must then be
+# shared by the processes. TIMEOUT and POLL_INTERVAL are in seconds.
+SINGLE_FLIGHT = {
+    'ADVISORY_LOCKS': os.environ.get(
+        'SINGLE_FLIGHT_ADVISORY_LOCKS', 'false').lower() in ('1', 'true', 'yes'),
+    'USING': 'default',
+    'CACHE': 'default',
+    'TIMEOUT': float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 10)),
+    'POLL_INTERVAL': 0.01,
+}
+
+# Invalidation of the local caches of every worker through LISTEN/NOTIFY on
+# CHANNEL of the USING database, see core.invalidation. RECONNECT_INTERVAL is
+# in seconds.
+INVALIDATION = {
+    'ENABLED': os.environ.get(
+        'CACHE_INVALIDATION', 'false').lower() in ('1', 'true', 'yes'),
+    'CHANNEL': 'cache_invalidation',
+    'USING': 'default',
+    'RECONNECT_INTERVAL': 1,
 }
 
+# Warm the application when the wsgi or asgi module is loaded, before a
+# pre-forking server (e.g. gunicorn --preload) forks, see core.preload
+PRELOAD = os.environ.get('PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -160,6 +411,8 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+STATICFILES_DIRS = [DRF_YASG_DIR / 'static']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -17,36 +17,22 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.urls import include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from core.views import metrics, schema, schema_ui, slow_queries
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Book Recommendation API",
-        default_version='v1',
-        description="Test description",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="great.kian2001@gmail.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/login/', include('authentication.urls')),
     path('api/book/', include('book.urls')),
     path('api/review/', include('review.urls')),
     path('api/suggest/', include('suggest.urls')),
+    path('api/async/', include('book_recommendation.async_urls')),
+    path('metrics', metrics, name='metrics'),
+    path('api/slow-queries/', slow_queries, name='slow_queries'),
 
-    # Swagger
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0),
-         name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger',
-         cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc',
-         cache_timeout=0), name='schema-redoc'),
+    # Swagger, served from the artifact of the generate_schema command
+    path('swagger<format>/', schema, name='schema-json'),
+    path('swagger/', schema_ui, {'renderer': 'swagger'},
+         name='schema-swagger-ui'),
+    path('redoc/', schema_ui, {'renderer': 'redoc'}, name='schema-redoc'),
 ]
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'book_recommendation.settings')
 
 application = get_wsgi_application()
+
+if settings.PRELOAD:
+    from core.preload import preload
+    preload()
@@ -0,0 +1,76 @@
+"""
+Helpers for plain Django async views serving the read-only API.
+
+DRF views are synchronous, so under ASGI every request holds a thread for
+its whole duration. The async views authenticate, throttle and render like
+their DRF counterparts but await the database instead.
+"""
+import functools
+
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+def json_response(data, status=200, headers=None):
+    """
+    Render data the way DRF's JSONRenderer does.
+    """
+    return HttpResponse(
+        JSONRenderer().render(data), content_type='application/json',
+        status=status, headers=headers)
+
+
+def async_api_view(throttle_classes=()):
+    """
+    Decorate an async GET view that requires an authenticated user.
+
+    The request is authenticated with the first default authentication class
+    that supports async views (see CachedJWTAuthentication.aauthenticate), and
+    request.user and request.auth are set before the view is called.
+
+    Args:
+        throttle_classes (list, optional): Throttles to apply, see
+            core.throttling.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return json_response(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=405, headers={'Allow': 'GET'})
+
+            authenticator = next(
+                authentication_class()
+                for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+                if hasattr(authentication_class, 'aauthenticate'))
+            unauthorized = {'WWW-Authenticate': authenticator.authenticate_header(request)}
+            try:
+                result = await authenticator.aauthenticate(request)
+            except exceptions.APIException as e:
+                return json_response(
+                    e.detail if isinstance(e.detail, dict) else {'detail': e.detail},
+                    status=401, headers=unauthorized)
+            if result is None:
+                return json_response(
+                    {'detail': exceptions.NotAuthenticated.default_detail},
+                    status=401, headers=unauthorized)
+            request.user, request.auth = result
+
+            for throttle_class in throttle_classes:
+                throttle = throttle_class()
+                if not throttle.allow_request(request, view):
+                    throttled = exceptions.Throttled(throttle.wait())
+                    return json_response(
+                        {'detail': throttled.detail}, status=429,
+                        headers={'Retry-After': '%d' % throttled.wait})
+
+            try:
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as e:
+                # e.g. StatementTimeoutExceeded
+                return json_response({'detail': e.detail}, status=e.status_code)
+        return wrapper
+    return decorator
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, Warning, register
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.db.routers import has_replica
+
+
+def uses_pin_cache():
+    return (
+        has_replica()
+        and settings.DATABASE_REPLICA['PIN_STORE'] == 'cache')
+
+
+@register(Tags.caches)
+def check_primary_pin_cache(app_configs, **kwargs):
+    """
+    Check that the read-your-writes pins are kept in a cache shared by the
+    workers, and not in the database, when a replica is configured with the
+    'cache' pin store, see core.db.routers.
+    """
+    if not uses_pin_cache():
+        return []
+    alias = settings.DATABASE_REPLICA['CACHE']
+    if alias not in settings.CACHES:
+        return [Error(
+            f'The {alias!r} cache of read-your-writes pins is not configured.',
+            hint='Set POSTGRES_REPLICA_PIN_CACHE_BACKEND and '
+                 'POSTGRES_REPLICA_PIN_CACHE_LOCATION to a cache shared by '
+                 'the workers, e.g. Redis or Memcached, or keep the pins in '
+                 'cookies with POSTGRES_REPLICA_PIN_STORE=cookie.',
+            id='core.E001')]
+    if isinstance(caches[alias], (LocMemCache, DummyCache)):
+        return [Error(
+            f'The {alias!r} cache of read-your-writes pins is local to each '
+            f'process, so reads after a write can go to the replica.',
+            hint='Set POSTGRES_REPLICA_PIN_CACHE_BACKEND to a cache shared by '
+                 'the workers, e.g. Redis or Memcached, or keep the pins in '
+                 'cookies with POSTGRES_REPLICA_PIN_STORE=cookie.',
+            id='core.E001')]
+    if isinstance(caches[alias], DatabaseCache):
+        return [Warning(
+            f'The {alias!r} cache of read-your-writes pins is a database '
+            f'cache, which queries the primary on every read routed to the '
+            f'replica.',
+            hint='Use Redis or Memcached, or keep the pins in cookies with '
+                 'POSTGRES_REPLICA_PIN_STORE=cookie.',
+            id='core.W001')]
+    return []
+
+
+@register(Tags.database)
+def check_primary_pin_table(app_configs, databases=None, **kwargs):
+    """
+    Check that the table of a database cache of pins exists, with
+    `manage.py check --database default`.
+    """
+    if not uses_pin_cache() or DEFAULT_DB_ALIAS not in (databases or []):
+        return []
+    cache = caches[settings.DATABASE_REPLICA['CACHE']]
+    if not isinstance(cache, DatabaseCache):
+        return []
+    connection = connections[DEFAULT_DB_ALIAS]
+    if cache._table not in connection.introspection.table_names():
+        return [Error(
+            f'The table {cache._table!r} of the cache of read-your-writes '
+            f'pins does not exist.',
+            hint='Run `manage.py createcachetable`.',
+            id='core.E002')]
+    return []
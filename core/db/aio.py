@@ -0,0 +1,218 @@
+"""
+Non-blocking PostgreSQL queries for async views.
+
+psycopg2 connections opened in asynchronous mode never block: queries are
+sent and their results read as the socket becomes ready, which is awaited on
+the event loop. Each event loop keeps a pool of such connections per
+database, up to its POOL MAX_SIZE setting, and closes those older than its
+POOL MAX_LIFETIME setting.
+
+psycopg2 only notices that the server closed a connection, e.g. on a
+restart, a failover or an idle timeout, when a query on it fails. A query
+failing with an OperationalError on an idle connection of the pool is run
+once more on a new connection, which is safe for reads. A query cancelled by
+its statement_timeout is not, and leaves its connection usable.
+
+Asynchronous connections are always in autocommit mode, so every query runs
+in a transaction of its own. They are meant for reads. Each query is sent
+along with the statement_timeout of the current context, see
+core.db.timeouts.astatement_timeout(), in the same round trip.
+"""
+import asyncio
+import time
+import weakref
+
+import psycopg2
+from psycopg2 import errors, extensions
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.db.slow_queries import current_recorder
+from core.db.timeouts import current_statement_timeout
+from core.metrics import current_timing
+
+
+async def wait(connection):
+    """
+    Wait until the pending operation of an asynchronous connection is done.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+
+        def wake():
+            if not ready.done():
+                ready.set_result(None)
+
+        fd = connection.fileno()
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f'Unexpected poll state {state}')
+
+
+def with_statement_timeout(sql):
+    """
+    Prefix a query with the SET of the statement_timeout of the current
+    context, or of the default one, so that the timeout of an earlier query
+    on the connection does not apply.
+    """
+    timeout = current_statement_timeout.get()
+    if timeout is None:
+        setting = 'DEFAULT'
+    else:
+        setting = f"'{max(round(timeout * 1000), 1)}ms'"
+    return f'SET statement_timeout TO {setting}; {sql}'
+
+
+class AsyncConnectionPool:
+    """
+    A pool of asynchronous connections for one event loop.
+    """
+
+    def __init__(self, conn_params, max_size, max_lifetime=float('inf')):
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        # Idle connections with the time they were opened
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_size)
+
+    async def fetchall(self, sql, params=None):
+        """
+        Run a query and fetch all of its rows.
+
+        Returns:
+            list: The rows as tuples.
+        """
+        async with self._slots:
+            connection, created, reused = await self._acquire()
+            start = time.perf_counter()
+            try:
+                try:
+                    rows = await self._fetchall(connection, sql, params)
+                except errors.QueryCanceled:
+                    raise
+                except psycopg2.OperationalError:
+                    if not reused:
+                        raise
+                    # The server may have closed the idle connection
+                    connection.close()
+                    connection, created = await self._connect()
+                    rows = await self._fetchall(connection, sql, params)
+            except errors.QueryCanceled:
+                # The query timed out, the connection is still usable
+                self._idle.append((connection, created))
+                raise
+            except BaseException:
+                # The connection may be left in the middle of a query
+                connection.close()
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                timing = current_timing.get()
+                if timing is not None:
+                    timing.add_query(duration)
+                recorder = current_recorder.get()
+                if recorder is not None:
+                    recorder.record(sql, duration)
+            self._idle.append((connection, created))
+            return rows
+
+    async def _fetchall(self, connection, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(with_statement_timeout(sql), params)
+            await wait(connection)
+            return cursor.fetchall()
+
+    async def _acquire(self):
+        """
+        Get an idle connection, or a new one.
+
+        Returns:
+            tuple: The connection, the time it was opened and whether it was
+                idle.
+        """
+        now = time.monotonic()
+        while self._idle:
+            connection, created = self._idle.pop()
+            if connection.closed:
+                continue
+            if now - created > self.max_lifetime:
+                connection.close()
+                continue
+            return connection, created, True
+        connection, created = await self._connect()
+        return connection, created, False
+
+    async def _connect(self):
+        connection = psycopg2.connect(**self.conn_params, async_=1)
+        try:
+            await wait(connection)
+        except BaseException:
+            connection.close()
+            raise
+        return connection, time.monotonic()
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool(using=DEFAULT_DB_ALIAS):
+    """
+    Get the pool of asynchronous connections of the running event loop to
+    the database with the given alias.
+    """
+    loop = asyncio.get_running_loop()
+    pools = _pools.get(loop)
+    if pools is None:
+        # Connections of a closed loop can never be used again
+        for other_loop, other_pools in list(_pools.items()):
+            if other_loop.is_closed():
+                for pool in other_pools.values():
+                    pool.close()
+                del _pools[other_loop]
+        pools = _pools[loop] = {}
+    pool = pools.get(using)
+    if pool is None:
+        database = connections[using]
+        conn_params = database.get_connection_params()
+        conn_params.pop('cursor_factory', None)
+        options = database.settings_dict['POOL']
+        pool = pools[using] = AsyncConnectionPool(
+            conn_params, options['MAX_SIZE'], options['MAX_LIFETIME'])
+    return pool
+
+
+def close_async_pools():
+    """
+    Close the idle connections of the pools of every event loop.
+    """
+    for pools in list(_pools.values()):
+        for pool in pools.values():
+            pool.close()
+
+
+async def fetchall(sql, params=None, using=DEFAULT_DB_ALIAS):
+    """
+    Run a read query without blocking the event loop, see
+    AsyncConnectionPool.fetchall().
+    """
+    return await get_async_pool(using).fetchall(sql, params)
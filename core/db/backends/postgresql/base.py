@@ -0,0 +1,112 @@
+"""
+PostgreSQL backend that checks connections out of a per-process pool.
+
+Django opens a connection for each request and closes it at the end of it,
+or after CONN_MAX_AGE seconds. With this backend closing hands the connection
+back to the pool instead, so requests reuse already authenticated
+connections. The pool is configured by the POOL key of the database settings,
+see core.db.pool.ConnectionPool for the meaning of its options.
+"""
+import os
+import threading
+
+from django.db.backends.postgresql import base, creation
+
+from core.db.pool import ConnectionPool
+from core.metrics import register_collector
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, options):
+    """
+    Get the pool of the current process for the given connection parameters.
+
+    Forked worker processes get pools of their own, since connections cannot
+    be shared between processes.
+    """
+    global _pools_pid
+    pid = os.getpid()
+    with _pools_lock:
+        if _pools_pid != pid:
+            _pools.clear()
+            _pools_pid = pid
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**{
+                option.lower(): value for option, value in options.items()
+            })
+        return pool
+
+
+def get_pool_stats():
+    """
+    Get the stats of the pools of the current process, by database alias.
+    """
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {key[0]: pool.stats() for key, pool in pools.items()}
+
+
+@register_collector
+def collect_metrics():
+    """
+    Get the pool stats for core.metrics.
+    """
+    samples = []
+    for alias, stats in get_pool_stats().items():
+        labels = {'database': alias}
+        samples += [
+            ('db_pool_connections', 'gauge', 'Pooled connections.',
+             {**labels, 'state': 'idle'}, stats['idle']),
+            ('db_pool_connections', 'gauge', 'Pooled connections.',
+             {**labels, 'state': 'in_use'}, stats['in_use']),
+            ('db_pool_checkouts_total', 'counter',
+             'Connections checked out.', labels, stats['checkouts']),
+            ('db_pool_waits_total', 'counter',
+             'Checkouts that waited for a connection.', labels, stats['waits']),
+            ('db_pool_wait_seconds_total', 'counter',
+             'Time spent waiting for a connection.', labels, stats['wait_time']),
+            ('db_pool_timeouts_total', 'counter',
+             'Checkouts that timed out.', labels, stats['timeouts']),
+        ]
+    return samples
+
+
+def close_pools():
+    """
+    Close the idle connections of every pool of the current process.
+    """
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would prevent dropping it
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(
+            (self.alias, repr(sorted(conn_params.items()))),
+            self.settings_dict['POOL'])
+        return self.pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,249 @@
+"""
+Plan regression checks for the named queries of core.db.queries.
+
+The plans module of each app declares, with expect_plan(), what the plans of
+its queries must look like on the reference dataset of generate_dataset:
+the indexes they use, the tables they may read with sequential scans and
+a ceiling on their estimated cost. check_plans() runs EXPLAIN (FORMAT JSON)
+on every query, reports the expectations a plan breaks, and diffs the shape
+of each plan (its nodes, without costs) against the baseline in BASELINE_PATH,
+so that a Postgres upgrade or a schema change that flips a plan shows up
+even when it still meets the expectations.
+
+Queries of apps without an expectation are reported too, so that new hot
+queries get one.
+"""
+import difflib
+from pathlib import Path
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import autodiscover_modules
+
+from core.db import queries
+
+
+# Arguments of generate_dataset for the dataset the expectations hold on
+REFERENCE_DATASET = {
+    'users': 1000, 'books': 10000, 'reviews': 50000, 'genres': 20, 'seed': 0,
+    'prefix': 'plans',
+}
+
+BASELINE_PATH = Path(__file__).with_name('plans.txt')
+
+_expectations = {}
+
+
+class PlanExpectation:
+    """
+    What the plan of a query must look like, see expect_plan().
+    """
+
+    def __init__(self, query, params, indexes, seq_scans, max_cost):
+        self.query = query
+        self.params = params
+        self.indexes = set(indexes)
+        self.seq_scans = set(seq_scans)
+        self.max_cost = max_cost
+
+
+def expect_plan(query, params, indexes=(), seq_scans=(), max_cost=None):
+    """
+    Declare what the plan of a query must look like.
+
+    Args:
+        query (Query): The query.
+        params (callable): A function taking a Sample of the dataset and
+            returning the parameters to explain the query with.
+        indexes (iterable): The indexes the plan must use, as
+            'table(column, ...)'.
+        seq_scans (iterable): The tables the plan may read with sequential
+            scans; any other table must be read through an index.
+        max_cost (float): The ceiling of the estimated total cost.
+    """
+    _expectations[query.name] = PlanExpectation(
+        query, params, indexes, seq_scans, max_cost)
+
+
+class Sample:
+    """
+    Parameter values taken from a dataset of generate_dataset: the user with
+    the median number of reviews, one of their reviews and its book, and
+    the largest genre.
+    """
+
+    def __init__(self, prefix, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT u.id, u.username, count(*) AS reviews
+                FROM users u JOIN reviews r ON r.user_id = u.id
+                WHERE u.username LIKE %s
+                GROUP BY u.id, u.username
+                ORDER BY reviews, u.id
+                """,
+                [f'{prefix}-%'])
+            users = cursor.fetchall()
+            if not users:
+                raise ValueError(f'No dataset with prefix {prefix!r}')
+            self.user_id, self.username, _ = users[len(users) // 2]
+            cursor.execute(
+                'SELECT id, book_id, rating FROM reviews WHERE user_id = %s '
+                'ORDER BY id LIMIT 1',
+                [self.user_id])
+            self.review_id, self.book_id, self.rating = cursor.fetchone()
+            cursor.execute(
+                'SELECT genre FROM books WHERE title LIKE %s '
+                'GROUP BY genre ORDER BY count(*) DESC, genre LIMIT 1',
+                [f'{prefix} book %'])
+            self.genre = cursor.fetchone()[0]
+
+
+def get_index_columns(using=DEFAULT_DB_ALIAS):
+    """
+    Get the table and columns of every index, as 'table(column, ...)', by
+    index name.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT i.relname, t.relname,
+                   array_agg(a.attname ORDER BY k.position)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_class t ON t.oid = x.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            CROSS JOIN LATERAL unnest(x.indkey) WITH ORDINALITY k(attnum, position)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE n.nspname = current_schema()
+            GROUP BY i.relname, t.relname
+            """)
+        return {
+            index: f'{table}({", ".join(columns)})'
+            for index, table, columns in cursor.fetchall()
+        }
+
+
+def explain(query, params, using=DEFAULT_DB_ALIAS):
+    """
+    Get the plan of a query from EXPLAIN (FORMAT JSON), which does not run it.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {query.sql}', params)
+        return cursor.fetchone()[0][0]['Plan']
+
+
+def walk(plan, parent=None, depth=0):
+    yield plan, parent, depth
+    for child in plan.get('Plans', []):
+        yield from walk(child, plan, depth + 1)
+
+
+def plan_shape(plan, index_columns):
+    """
+    Describe the nodes of a plan, one per line, without costs or row
+    estimates, with indexes named by their table and columns.
+    """
+    lines = []
+    for node, parent, depth in walk(plan):
+        line = node['Node Type']
+        if node.get('Join Type') and node['Node Type'] != 'Hash':
+            line += f" ({node['Join Type']})"
+        if 'Strategy' in node:
+            line += f" ({node['Strategy']})"
+        if 'Index Name' in node:
+            line += f" using {index_columns.get(node['Index Name'], node['Index Name'])}"
+        if 'Relation Name' in node:
+            line += f" on {node['Relation Name']}"
+        if node.get('Parent Relationship') in ('SubPlan', 'InitPlan'):
+            name = node['Subplan Name']
+            # A hashed subplan runs once, any other once per row of its parent
+            if f'hashed {name}' in str(parent):
+                name = f'hashed {name}'
+            line = f'{name}: {line}'
+        lines.append('  ' * depth + line)
+    return lines
+
+
+def check_plan(expectation, plan, index_columns):
+    """
+    Get the expectations a plan breaks, as messages.
+    """
+    violations = []
+    used = set()
+    for node, _, _ in walk(plan):
+        if 'Index Name' in node:
+            used.add(index_columns.get(node['Index Name'], node['Index Name']))
+        if (node['Node Type'] == 'Seq Scan'
+                and node['Relation Name'] not in expectation.seq_scans):
+            violations.append(f"sequential scan on {node['Relation Name']}")
+    for index in sorted(expectation.indexes - used):
+        violations.append(f'index {index} not used')
+    if (expectation.max_cost is not None
+            and plan['Total Cost'] > expectation.max_cost):
+        violations.append(
+            f"cost {plan['Total Cost']:.0f} above {expectation.max_cost:.0f}")
+    return violations
+
+
+def read_baseline(path=BASELINE_PATH):
+    """
+    Read the plan shapes of a baseline file, by query name.
+    """
+    baseline = {}
+    if not Path(path).exists():
+        return baseline
+    name = None
+    for line in Path(path).read_text().splitlines():
+        if line.startswith('## '):
+            name = line[3:]
+            baseline[name] = []
+        elif line and name is not None:
+            baseline[name].append(line)
+    return baseline
+
+
+def write_baseline(shapes, path=BASELINE_PATH):
+    Path(path).write_text(''.join(
+        f'## {name}\n' + ''.join(f'{line}\n' for line in shape) + '\n'
+        for name, shape in sorted(shapes.items())))
+
+
+def check_plans(sample, using=DEFAULT_DB_ALIAS, baseline=None):
+    """
+    Explain every query with an expectation and check its plan.
+
+    Args:
+        sample (Sample): The parameter values to explain the queries with.
+        baseline (dict): The plan shapes to diff against, by query name.
+
+    Returns:
+        list: A dict per query, with its plan shape, estimated cost, the
+            expectations it breaks and the diff of its shape with the
+            baseline.
+    """
+    autodiscover_modules('plans')
+    index_columns = get_index_columns(using)
+    labels = {app_config.label for app_config in apps.get_app_configs()}
+    results = []
+    for name, query in sorted(queries._queries.items()):
+        expectation = _expectations.get(name)
+        if expectation is None:
+            if name.partition('.')[0] in labels:
+                results.append({
+                    'query': name, 'shape': [], 'cost': None, 'diff': [],
+                    'violations': ['no plan expectation']})
+            continue
+        plan = explain(query, expectation.params(sample), using)
+        shape = plan_shape(plan, index_columns)
+        diff = []
+        if baseline is not None:
+            diff = list(difflib.unified_diff(
+                baseline.get(name, []), shape, 'baseline', 'current',
+                lineterm=''))
+        results.append({
+            'query': name, 'shape': shape, 'cost': plan['Total Cost'],
+            'violations': check_plan(expectation, plan, index_columns),
+            'diff': diff,
+        })
+    return results
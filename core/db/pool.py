@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import deque
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection becomes available within the pool timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of psycopg2 connections with a minimum and maximum
+    size.
+
+    Connections are checked out with getconn() and handed back with
+    putconn(). A connection that has been idle for more than `check_idle`
+    seconds is pinged on checkout, and one older than `max_lifetime` seconds
+    is replaced, so that connections dropped by the server or the network are
+    never handed out. When all `max_size` connections are in use, getconn()
+    waits up to `timeout` seconds for one to be returned.
+
+    Connections are returned as they are apart from rolling back an open
+    transaction; session settings must be reset by the code that sets them.
+    """
+
+    def __init__(self, min_size, max_size, timeout, check_idle, max_lifetime):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+        # Idle connections as (connection, created at, returned at)
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._condition = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.discarded = 0
+
+    def getconn(self, connect):
+        """
+        Check out a healthy connection, opening one if the pool is not full.
+
+        Args:
+            connect (callable): Opens a new connection.
+
+        Raises:
+            PoolTimeout: If no connection is available within the timeout.
+        """
+        if self._size < self.min_size:
+            self.fill(connect)
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f'No database connection available within '
+                            f'{self.timeout}s ({self.max_size} in use)')
+                    waited = True
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection = None
+                    self._size += 1
+
+            if connection is None:
+                connection = self._open(connect)
+            elif not self._is_healthy(connection, returned_at):
+                self._discard(connection)
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._condition:
+                self.checkouts += 1
+                if waited:
+                    self.waits += 1
+                    self.wait_time += elapsed
+                    self.max_wait_time = max(self.max_wait_time, elapsed)
+            return connection
+
+    def putconn(self, connection):
+        """
+        Return a connection, rolling back any transaction left open.
+        """
+        if not connection.closed and (
+                connection.info.transaction_status != TRANSACTION_STATUS_IDLE):
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+        if connection.closed or (
+                connection.info.transaction_status != TRANSACTION_STATUS_IDLE):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def fill(self, connect):
+        """
+        Open connections until the pool holds at least min_size of them.
+        """
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            self.putconn(self._open(connect))
+
+    def close(self):
+        """
+        Close every idle connection. Checked out ones are closed when they
+        are returned if the pool is not used anymore.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Get the size and counters of the pool.
+
+        Returns:
+            dict: size, idle and in_use connections, checkouts, the number
+                of checkouts that waited with their total and maximum wait
+                time in seconds, timeouts and discarded connections.
+        """
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+            }
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        self._created[id(connection)] = time.monotonic()
+        return connection
+
+    def _is_healthy(self, connection, returned_at):
+        now = time.monotonic()
+        if connection.closed:
+            return False
+        if now - self._created.get(id(connection), now) > self.max_lifetime:
+            return False
+        if now - returned_at > self.check_idle:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except Exception:
+                return False
+            # The ping opened a transaction unless in autocommit mode
+            if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        return True
+
+    def _discard(self, connection):
+        self._created.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._size -= 1
+            self.discarded += 1
+            self._condition.notify()
@@ -0,0 +1,181 @@
+"""
+Named SQL queries.
+
+The raw SQL queries the views run on every request are declared once each,
+as a Query in the queries module of their app, and run through it:
+
+    BOOKS_BY_GENRE = Query('book.by_genre', 'SELECT ... WHERE genre = %s')
+    rows = BOOKS_BY_GENRE.fetchall([genre], using=alias)
+
+On PostgreSQL, when the PREPARE key of the database settings is set and
+connections are reused (pooled or with CONN_MAX_AGE), a query is prepared
+on the first run on each connection and executed by name afterwards, so the
+server parses and plans it once per connection instead of once per run.
+The PREPARE is not passed through execute wrappers, so query counts do not
+depend on whether the connection already had the statement.
+
+Every query counts its calls, time and rows in each process. They are
+exposed as metrics, see core.metrics, and by the query_stats command.
+Queries of async views go through core.db.aio and are not prepared.
+"""
+import re
+import threading
+import time
+import weakref
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.db import aio
+from core.metrics import register_collector
+
+
+_queries = {}
+_lock = threading.Lock()
+
+# Names of the statements prepared on each DB-API connection
+_prepared = weakref.WeakKeyDictionary()
+
+
+def to_positional(sql):
+    """
+    Convert the %s placeholders of a query to the $1, $2... of PREPARE.
+
+    Returns:
+        tuple: The converted SQL and its number of parameters.
+    """
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    return re.sub(r'%([%s])', replace, sql), count
+
+
+def should_prepare(db):
+    """
+    Whether queries are prepared on the connections of a DatabaseWrapper.
+    """
+    settings_dict = db.settings_dict
+    return (
+        db.vendor == 'postgresql' and settings_dict.get('PREPARE', False)
+        and (settings_dict['CONN_MAX_AGE'] != 0
+             or settings_dict['ENGINE'] == 'core.db.backends.postgresql'))
+
+
+class Query:
+    """
+    A named SQL query, with %s placeholders.
+    """
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.statement = re.sub(r'\W', '_', name)
+        prepared_sql, count = to_positional(sql)
+        self.prepare_sql = f'PREPARE {self.statement} AS {prepared_sql}'
+        self.execute_sql = f'EXECUTE {self.statement}' + (
+            f'({", ".join(["%s"] * count)})' if count else '')
+        self.calls = 0
+        self.time = 0.0
+        self.rows = 0
+        with _lock:
+            if name in _queries:
+                raise ValueError(f'A query named {name!r} already exists')
+            _queries[name] = self
+
+    def __repr__(self):
+        return f'<Query {self.name}>'
+
+    def record(self, duration, rows):
+        with _lock:
+            self.calls += 1
+            self.time += duration
+            self.rows += rows
+
+    def execute(self, cursor, params=()):
+        """
+        Run the query on a cursor of a Django connection.
+
+        Returns:
+            CursorWrapper: The cursor, to fetch the rows from.
+        """
+        db = cursor.db
+        start = time.perf_counter()
+        if should_prepare(db):
+            prepared = _prepared.get(db.connection)
+            if prepared is None:
+                prepared = _prepared[db.connection] = set()
+            if self.statement not in prepared:
+                with db.wrap_database_errors:
+                    cursor.cursor.execute(self.prepare_sql)
+                prepared.add(self.statement)
+            cursor.execute(self.execute_sql, params)
+        else:
+            cursor.execute(self.sql, params)
+        self.record(time.perf_counter() - start, max(cursor.rowcount, 0))
+        return cursor
+
+    def fetchall(self, params=(), using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            return self.execute(cursor, params).fetchall()
+
+    def fetchone(self, params=(), using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            return self.execute(cursor, params).fetchone()
+
+    def run(self, params=(), using=DEFAULT_DB_ALIAS):
+        """
+        Run a query that returns no rows.
+
+        Returns:
+            int: The number of rows changed.
+        """
+        with connections[using].cursor() as cursor:
+            return self.execute(cursor, params).rowcount
+
+    async def afetchall(self, params=(), using=DEFAULT_DB_ALIAS):
+        """
+        Run the query from async code, see core.db.aio.
+        """
+        start = time.perf_counter()
+        rows = await aio.fetchall(self.sql, params, using=using)
+        self.record(time.perf_counter() - start, len(rows))
+        return rows
+
+
+def get_query_stats():
+    """
+    Get the calls, time and rows of every query in the current process.
+
+    Returns:
+        list: A dict per query.
+    """
+    with _lock:
+        return [
+            {'query': query.name, 'calls': query.calls, 'time': query.time,
+             'rows': query.rows}
+            for query in _queries.values()
+        ]
+
+
+@register_collector
+def collect_metrics():
+    """
+    Get the query stats for core.metrics.
+    """
+    samples = []
+    for stats in get_query_stats():
+        labels = {'query': stats['query']}
+        samples += [
+            ('db_query_calls_total', 'counter',
+             'Runs of named queries.', labels, stats['calls']),
+            ('db_query_duration_seconds_total', 'counter',
+             'Time spent in named queries.', labels, stats['time']),
+            ('db_query_rows_total', 'counter',
+             'Rows returned or changed by named queries.', labels, stats['rows']),
+        ]
+    return samples
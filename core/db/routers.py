@@ -0,0 +1,199 @@
+"""
+Primary/replica database routing.
+
+When a `replica` database is configured, reads that tolerate replication lag
+are sent to it and everything else to the primary (`default`):
+
+    - ORM reads of the models of DATABASE_REPLICA['APPS'], through
+      PrimaryReplicaRouter, outside of transactions on the primary
+    - raw SQL reads of the views that ask for get_read_alias()
+
+After a user writes, pin_to_primary() sends their reads to the primary for
+DATABASE_REPLICA['STICKY_SECONDS'] seconds, so that they read their own
+writes even if the replica is behind. Where the pins are kept depends on
+DATABASE_REPLICA['PIN_STORE']:
+
+    cache   the DATABASE_REPLICA['CACHE'] Django cache, keyed by user id, so
+            that pins apply whatever the client keeps, including API clients
+            that authenticate with a bearer token and send no cookies; the
+            default. It must be shared by the workers for a pin to apply to
+            the next request wherever it lands, like Redis or Memcached. A
+            system check (core.E001) rejects a missing cache or one local to
+            the process, and another (core.W001) warns about a database
+            cache, which queries the primary on every routed read. When the
+            cache cannot be reached, reads go to the primary.
+    cookie  a cookie of the client, set by PrimaryPinMiddleware, signed with
+            a timestamp and the user id, checked without any query or cache.
+            Only clients that keep the cookies of the responses and send them
+            back, as browsers do, are pinned: a client without a cookie jar
+            may read from the lagging replica right after its own write.
+
+Without a replica every alias is `default` and nothing is pinned.
+"""
+import logging
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DB_ALIAS = 'replica'
+
+PIN_COOKIE = 'primary_pin'
+
+logger = logging.getLogger(__name__)
+
+
+def has_replica():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def _pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def get_pin_cache():
+    return caches[settings.DATABASE_REPLICA['CACHE']]
+
+
+def pin_to_primary(request):
+    """
+    Send the reads of the user of a request to the primary for the next
+    DATABASE_REPLICA['STICKY_SECONDS'] seconds.
+    """
+    user_id = getattr(request.user, 'id', None)
+    if not has_replica() or user_id is None:
+        return
+    if settings.DATABASE_REPLICA['PIN_STORE'] == 'cookie':
+        # Left on the HttpRequest of a DRF Request for PrimaryPinMiddleware
+        getattr(request, '_request', request).primary_pin = user_id
+    else:
+        try:
+            get_pin_cache().set(
+                _pin_key(user_id), True,
+                timeout=settings.DATABASE_REPLICA['STICKY_SECONDS'])
+        except Exception:
+            # The write is done; its reads go to the primary while the cache
+            # cannot be reached anyway, see get_read_alias()
+            logger.warning(
+                'Could not pin the reads of user %s to the primary', user_id,
+                exc_info=True)
+
+
+def is_pinned_by_cookie(request, user_id):
+    """
+    Whether a request carries a valid pin cookie of its user.
+    """
+    pin = request.get_signed_cookie(
+        PIN_COOKIE, default=None, salt=PIN_COOKIE,
+        max_age=settings.DATABASE_REPLICA['STICKY_SECONDS'])
+    return pin == str(user_id)
+
+
+def get_read_alias(request):
+    """
+    Get the database alias to read from for a request: the replica, unless
+    the user wrote recently or their pin cannot be read.
+    """
+    if not has_replica():
+        return DEFAULT_DB_ALIAS
+    user_id = getattr(request.user, 'id', None)
+    if user_id is None:
+        return REPLICA_DB_ALIAS
+    if settings.DATABASE_REPLICA['PIN_STORE'] == 'cookie':
+        pinned = is_pinned_by_cookie(request, user_id)
+    else:
+        try:
+            pinned = get_pin_cache().get(_pin_key(user_id))
+        except Exception:
+            logger.warning('Could not read the primary pin of user %s',
+                           user_id, exc_info=True)
+            pinned = True
+    return DEFAULT_DB_ALIAS if pinned else REPLICA_DB_ALIAS
+
+
+async def aget_read_alias(request):
+    """
+    Async version of get_read_alias().
+    """
+    if not has_replica():
+        return DEFAULT_DB_ALIAS
+    user_id = getattr(request.user, 'id', None)
+    if user_id is None:
+        return REPLICA_DB_ALIAS
+    if settings.DATABASE_REPLICA['PIN_STORE'] == 'cookie':
+        pinned = is_pinned_by_cookie(request, user_id)
+    else:
+        try:
+            pinned = await get_pin_cache().aget(_pin_key(user_id))
+        except Exception:
+            logger.warning('Could not read the primary pin of user %s',
+                           user_id, exc_info=True)
+            pinned = True
+    return DEFAULT_DB_ALIAS if pinned else REPLICA_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """
+    Set the pin cookie of the requests pinned by pin_to_primary(), see the
+    module docstring. Removed from the chain unless a replica is configured
+    with DATABASE_REPLICA['PIN_STORE'] set to 'cookie'.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not has_replica() or (
+                settings.DATABASE_REPLICA['PIN_STORE'] != 'cookie'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.set_cookie(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.set_cookie(request, await self.get_response(request))
+
+    def set_cookie(self, request, response):
+        user_id = getattr(request, 'primary_pin', None)
+        if user_id is not None:
+            response.set_signed_cookie(
+                PIN_COOKIE, str(user_id), salt=PIN_COOKIE,
+                max_age=math.ceil(settings.DATABASE_REPLICA['STICKY_SECONDS']),
+                secure=request.is_secure(), httponly=True, samesite='Lax')
+        return response
+
+
+class PrimaryReplicaRouter:
+    """
+    Route ORM reads of the models of DATABASE_REPLICA['APPS'] to the replica
+    and all writes and migrations to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not has_replica():
+            return None
+        if model._meta.app_label not in settings.DATABASE_REPLICA['APPS']:
+            return DEFAULT_DB_ALIAS
+        # A transaction on the primary may have written what it reads
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
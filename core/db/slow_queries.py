@@ -0,0 +1,372 @@
+"""
+Sampled log of slow SQL queries.
+
+With SLOW_QUERIES['ENABLED'] set, SlowQueryMiddleware installs an execute
+wrapper on every connection for the duration of each request, and records
+the queries that take at least SLOW_QUERIES['THRESHOLD'] seconds, plus a
+random SLOW_QUERIES['SAMPLE_RATE'] of the others. Under ASGI, queries of
+async views, run through core.db.aio, and of sync views, run in a thread
+with its own connections, are recorded through the current_recorder of the
+request instead, see record_query().
+
+Queries are grouped by fingerprint: their SQL with literals and placeholders
+replaced by ?, lists of them collapsed and whitespace normalised, so that
+the same query with other parameters has the same fingerprint. Prepared
+statements of core.db.queries are fingerprinted by the SQL of their Query.
+Each worker keeps, per fingerprint, the count, number of slow queries, total
+and max duration of the recorded queries and the views that ran them, and
+the last SLOW_QUERIES['WINDOW'] durations for the p99.
+
+With SLOW_QUERIES['DIR'] set, every recorded query is written as a JSON line
+to a rotating log file of the worker in that directory, and the aggregates
+to a JSON file at most every SLOW_QUERIES['FLUSH_INTERVAL'] seconds, which
+the slow_queries view merges, as core.metrics does for metrics.
+"""
+import collections
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+FINGERPRINT_PATTERNS = [
+    # String literals, with '' escapes
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    # Placeholders
+    (re.compile(r'%s|%\(\w+\)s|\$\d+'), '?'),
+    # Numbers, but not digits inside identifiers
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    # IN lists, VALUES rows and ARRAY[...] of any length
+    (re.compile(r'\(\?(?:, ?\?)*\)'), '(...)'),
+    (re.compile(r'\[\?(?:, ?\?)*\]'), '[...]'),
+]
+
+EXECUTE_PATTERN = re.compile(r'\s*EXECUTE (\w+)')
+
+# The recorder of the async request being handled, for queries that do not
+# go through Django's connections (see core.db.aio)
+current_recorder = contextvars.ContextVar('current_slow_query_recorder', default=None)
+
+
+def normalize(sql):
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+@functools.lru_cache(maxsize=1024)
+def get_fingerprint(sql):
+    """
+    Get the fingerprint of a query, see the module docstring.
+
+    Returns:
+        tuple: The fingerprint, the normalised SQL and the name of the Query
+            of a prepared statement, or None.
+    """
+    # Imported here as core.db.aio, which core.db.queries imports, imports
+    # this module
+    from core.db.queries import _queries
+
+    name = None
+    match = EXECUTE_PATTERN.match(sql)
+    if match:
+        query = next(
+            (query for query in _queries.values()
+             if query.statement == match.group(1)), None)
+        if query is not None:
+            sql, name = query.sql, query.name
+    normalized = normalize(sql)
+    fingerprint = hashlib.md5(normalized.encode()).hexdigest()[:16]
+    return fingerprint, normalized, name
+
+
+def percentile(durations, fraction):
+    if not durations:
+        return 0.0
+    durations = sorted(durations)
+    return durations[max(math.ceil(fraction * len(durations)) - 1, 0)]
+
+
+class SlowQueryLog:
+    """
+    The recorded queries of one worker process.
+    """
+
+    def __init__(self, threshold, sample_rate, directory='', window=1000,
+                 max_fingerprints=500, flush_interval=5, max_bytes=10485760,
+                 backup_count=5):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self.flush_interval = flush_interval
+        self.path = (
+            os.path.join(directory, f'{os.getpid()}.json') if directory else None)
+        self.logger = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # Not attached to the logging hierarchy, so that only the file of
+            # this worker gets the lines
+            self.logger = logging.Logger(__name__)
+            self.logger.addHandler(logging.handlers.RotatingFileHandler(
+                os.path.join(directory, f'{os.getpid()}.log'),
+                maxBytes=max_bytes, backupCount=backup_count))
+        # Stats by fingerprint, least recently recorded first
+        self._stats = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._next_flush = 0.0
+
+    def record(self, sql, duration, view):
+        """
+        Record a query if it is slow or sampled.
+
+        Args:
+            sql (str): The SQL, with placeholders.
+            duration (float): The time it took, in seconds.
+            view (str): The name of the view that ran it.
+        """
+        slow = duration >= self.threshold
+        if not slow and random.random() >= self.sample_rate:
+            return
+        fingerprint, normalized, name = get_fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    self._stats.popitem(last=False)
+                stats = self._stats[fingerprint] = {
+                    'fingerprint': fingerprint, 'sql': normalized,
+                    'query': name, 'count': 0, 'slow': 0, 'total': 0.0,
+                    'max': 0.0, 'views': collections.Counter(),
+                    'durations': collections.deque(maxlen=self.window),
+                }
+            else:
+                self._stats.move_to_end(fingerprint)
+            stats['count'] += 1
+            stats['slow'] += slow
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['views'][view] += 1
+            stats['durations'].append(duration)
+        if self.logger is not None:
+            self.logger.warning(json.dumps({
+                'time': time.time(), 'fingerprint': fingerprint,
+                'query': name, 'view': view, 'duration': duration,
+                'slow': slow, 'sql': normalized,
+            }))
+        self.flush()
+
+    def snapshot(self):
+        """
+        Get the stats of the worker.
+        """
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'fingerprints': [
+                    {**stats, 'views': dict(stats['views']),
+                     'durations': list(stats['durations'])}
+                    for stats in self._stats.values()
+                ],
+            }
+
+    def flush(self, force=False):
+        """
+        Write the snapshot of the worker to its file, if a directory is set
+        and the flush interval has passed.
+        """
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_flush:
+            return
+        self._next_flush = now + self.flush_interval
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, self.path)
+
+    def collect(self):
+        """
+        Get the snapshots of every worker, or of this one only when no
+        directory is set.
+        """
+        if self.path is None:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # Removed or being replaced
+                continue
+        return snapshots
+
+
+def merge_snapshots(snapshots):
+    """
+    Merge the stats of the workers by fingerprint.
+
+    Returns:
+        list: A dict per fingerprint, with its SQL, Query name, count, number
+            of slow queries, total, mean, max and p99 durations and views,
+            by total duration, largest first.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for stats in snapshot['fingerprints']:
+            entry = merged.get(stats['fingerprint'])
+            if entry is None:
+                entry = merged[stats['fingerprint']] = {
+                    'fingerprint': stats['fingerprint'], 'sql': stats['sql'],
+                    'query': stats['query'], 'count': 0, 'slow': 0,
+                    'total': 0.0, 'max': 0.0, 'views': collections.Counter(),
+                    'durations': [],
+                }
+            entry['count'] += stats['count']
+            entry['slow'] += stats['slow']
+            entry['total'] += stats['total']
+            entry['max'] = max(entry['max'], stats['max'])
+            entry['views'].update(stats['views'])
+            entry['durations'] += stats['durations']
+    results = []
+    for entry in merged.values():
+        durations = entry.pop('durations')
+        entry['mean'] = entry['total'] / entry['count']
+        entry['p99'] = percentile(durations, 0.99)
+        entry['views'] = dict(entry['views'].most_common())
+        results.append(entry)
+    results.sort(key=lambda entry: (-entry['total'], entry['fingerprint']))
+    return results
+
+
+_log = None
+_log_pid = None
+_log_lock = threading.Lock()
+
+
+def get_slow_query_log():
+    """
+    Get the slow query log of the current process.
+    """
+    global _log, _log_pid
+    pid = os.getpid()
+    if _log_pid != pid:
+        with _log_lock:
+            if _log_pid != pid:
+                options = settings.SLOW_QUERIES
+                _log = SlowQueryLog(
+                    options['THRESHOLD'], options['SAMPLE_RATE'],
+                    directory=options['DIR'], window=options['WINDOW'],
+                    max_fingerprints=options['MAX_FINGERPRINTS'],
+                    flush_interval=options['FLUSH_INTERVAL'],
+                    max_bytes=options['MAX_BYTES'],
+                    backup_count=options['BACKUP_COUNT'])
+                _log_pid = pid
+    return _log
+
+
+class QueryRecorder:
+    """
+    Record the queries of one request in the slow query log, tagged with
+    its view.
+
+    Instances are installed as execute wrappers on every database connection
+    for the duration of the request.
+    """
+
+    def __init__(self, log, request):
+        self.log = log
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        match = self.request.resolver_match
+        self.log.record(
+            sql, duration, match.view_name if match else '<unmatched>')
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Record a query for the async request being handled, if any.
+
+    Installed on every connection when it is created, as sync code called
+    from async requests runs in a thread whose connections the middleware
+    cannot reach, but which shares the context of the request.
+    """
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_record_query(sender, connection, **kwargs):
+    # First, so that the wrappers the sync middleware pops stay last
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class SlowQueryMiddleware:
+    """
+    Record the slow and sampled queries of every request, see the module
+    docstring. Removed from the chain unless SLOW_QUERIES['ENABLED'] is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERIES['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder(get_slow_query_log(), request)
+        wrapped = [connections[alias] for alias in connections]
+        for connection in wrapped:
+            connection.execute_wrappers.append(recorder)
+        try:
+            return self.get_response(request)
+        finally:
+            for connection in wrapped:
+                connection.execute_wrappers.pop()
+
+    async def __acall__(self, request):
+        token = current_recorder.set(
+            QueryRecorder(get_slow_query_log(), request))
+        try:
+            return await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
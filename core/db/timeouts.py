@@ -0,0 +1,225 @@
+"""
+Statement timeout budgets of read endpoints.
+
+Each read endpoint has a budget in STATEMENT_TIMEOUTS['BUDGETS'], by URL
+name, applied to its queries as the Postgres statement_timeout, so that one
+slow query cannot hold a worker for longer:
+
+    books, degraded = run_with_budget(
+        'book_list', using, lambda: load_books(using),
+        fallbacks=[('stale', get_stale), ('partial', load_first_books)])
+
+When a query exceeds the budget, Postgres cancels it and the fallbacks are
+tried in order, each under STATEMENT_TIMEOUTS['FALLBACK_BUDGET'], until one
+returns something other than None: the last result of the endpoint, a
+popularity-based result, a partial page... Views flag degraded responses
+with the DEGRADED_HEADER header, naming the fallback. When every fallback
+fails, StatementTimeoutExceeded answers 503.
+
+The timeout is set and restored through the DB-API connection, like the
+PREPARE of core.db.queries, so that query counts do not change. In a
+transaction, the block runs in a savepoint, so that a cancelled query leaves
+the transaction usable; rolling back to the savepoint also restores the
+previous timeout.
+
+Async views run their budgets with arun_with_budget(): the asynchronous
+queries of core.db.aio each run in a transaction of their own, and are sent
+with the timeout of astatement_timeout() in the current context instead.
+"""
+import contextvars
+import inspect
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connections)
+from psycopg2 import errors
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+logger = logging.getLogger(__name__)
+
+DEGRADED_HEADER = 'X-Degraded'
+
+# The timeout of the asynchronous queries run in the current context, in
+# seconds, see astatement_timeout()
+current_statement_timeout = contextvars.ContextVar(
+    'current_statement_timeout', default=None)
+
+
+class StatementTimeoutExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The request took too long, try again later.'
+    default_code = 'statement_timeout'
+
+
+def execute(db, sql, params=None):
+    """
+    Run a statement on the DB-API connection of a DatabaseWrapper, without
+    the execute wrappers.
+
+    Returns:
+        tuple: The first row, if the statement returns rows.
+    """
+    db.ensure_connection()
+    with db.wrap_database_errors, db.connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone() if cursor.description else None
+
+
+def is_statement_timeout(error):
+    """
+    Whether a database error is the cancellation of a query by
+    statement_timeout.
+    """
+    return isinstance(error.__cause__, errors.QueryCanceled)
+
+
+@contextmanager
+def statement_timeout(timeout, using=DEFAULT_DB_ALIAS):
+    """
+    Set the statement_timeout of a connection for the block, see the module
+    docstring.
+
+    Args:
+        timeout (float): The timeout in seconds.
+    """
+    db = connections[using]
+    in_transaction = db.in_atomic_block
+    if in_transaction:
+        execute(db, 'SAVEPOINT statement_timeout')
+    previous = execute(
+        db,
+        "SELECT current_setting('statement_timeout'), "
+        "set_config('statement_timeout', %s, %s)",
+        [f'{max(round(timeout * 1000), 1)}ms', in_transaction])[0]
+    try:
+        yield
+    except BaseException:
+        try:
+            if in_transaction:
+                execute(db, 'ROLLBACK TO SAVEPOINT statement_timeout')
+                execute(db, 'RELEASE SAVEPOINT statement_timeout')
+            else:
+                execute(
+                    db, "SELECT set_config('statement_timeout', %s, false)",
+                    [previous])
+        except DatabaseError:
+            # The connection is broken, and closed at the end of the request
+            pass
+        raise
+    execute(
+        db, "SELECT set_config('statement_timeout', %s, %s)",
+        [previous, in_transaction])
+    if in_transaction:
+        execute(db, 'RELEASE SAVEPOINT statement_timeout')
+
+
+@contextmanager
+def astatement_timeout(timeout):
+    """
+    Set the statement_timeout of the asynchronous queries of core.db.aio run
+    in the block, see the module docstring.
+
+    Args:
+        timeout (float): The timeout in seconds.
+    """
+    token = current_statement_timeout.set(timeout)
+    try:
+        yield
+    finally:
+        current_statement_timeout.reset(token)
+
+
+def run_with_budget(name, using, compute, fallbacks=()):
+    """
+    Run compute() under the budget of an endpoint, or its fallbacks if the
+    budget is exceeded.
+
+    Args:
+        name (str): The URL name of the endpoint, in
+            STATEMENT_TIMEOUTS['BUDGETS']; without a budget, compute() runs
+            without timeout.
+        using (str): The alias of the database compute() queries.
+        compute (callable): The computation, taking no arguments.
+        fallbacks (list): (name, function) pairs; functions take no
+            arguments and return a result or None.
+
+    Returns:
+        tuple: The result, and the name of the fallback that produced it or
+            None.
+
+    Raises:
+        StatementTimeoutExceeded: If the budget is exceeded and no fallback
+            produced a result.
+    """
+    options = settings.STATEMENT_TIMEOUTS
+    budget = options['BUDGETS'].get(name)
+    if not budget:
+        return compute(), None
+    try:
+        with statement_timeout(budget, using):
+            return compute(), None
+    except OperationalError as e:
+        if not is_statement_timeout(e):
+            raise
+        logger.warning('%s exceeded its statement timeout of %ss', name, budget)
+
+    for fallback_name, fallback in fallbacks:
+        try:
+            with statement_timeout(options['FALLBACK_BUDGET'], using):
+                result = fallback()
+        except OperationalError as e:
+            if not is_statement_timeout(e):
+                raise
+            logger.warning('The %s fallback of %s timed out', fallback_name, name)
+            continue
+        if result is not None:
+            return result, fallback_name
+    raise StatementTimeoutExceeded
+
+
+async def arun_with_budget(name, compute, fallbacks=()):
+    """
+    Async version of run_with_budget(), for computations querying through
+    core.db.aio.
+
+    Args:
+        name (str): The URL name of the endpoint.
+        compute (callable): The computation, a coroutine function taking no
+            arguments.
+        fallbacks (list): (name, function) pairs; functions take no
+            arguments and return a result, None, or an awaitable of either.
+
+    Returns:
+        tuple: The result, and the name of the fallback that produced it or
+            None.
+
+    Raises:
+        StatementTimeoutExceeded: If the budget is exceeded and no fallback
+            produced a result.
+    """
+    options = settings.STATEMENT_TIMEOUTS
+    budget = options['BUDGETS'].get(name)
+    if not budget:
+        return await compute(), None
+    try:
+        with astatement_timeout(budget):
+            return await compute(), None
+    except errors.QueryCanceled:
+        logger.warning('%s exceeded its statement timeout of %ss', name, budget)
+
+    for fallback_name, fallback in fallbacks:
+        try:
+            with astatement_timeout(options['FALLBACK_BUDGET']):
+                result = fallback()
+                if inspect.isawaitable(result):
+                    result = await result
+        except errors.QueryCanceled:
+            logger.warning('The %s fallback of %s timed out', fallback_name, name)
+            continue
+        if result is not None:
+            return result, fallback_name
+    raise StatementTimeoutExceeded
@@ -0,0 +1,318 @@
+"""
+Invalidation of the local caches of every worker through Postgres
+LISTEN/NOTIFY.
+
+Apps register their LocalCache instances with the entities they depend on:
+
+    register_cache(stale_suggestions, entities=['book'], by_id=['review'])
+
+A change of a 'book' then clears the cache, and a change of a 'review'
+deletes the entries keyed by the ids sent with it. Writers call notify()
+with the entity and ids they changed:
+
+    notify('review', [user_id], using)
+
+which sends a NOTIFY with a compact payload, 'review:12,34', in the
+transaction of the write, so that Postgres delivers it to the other workers
+only if it commits; the caches of the writing worker are invalidated on
+commit. Lists of ids too long for one payload are split. Writes run in
+autocommit go with their notify() in an atomic_write() block, without which
+the write would commit on its own:
+
+    with atomic_write(using):
+        UPDATE_REVIEW.fetchone(params, using=using)
+        notify('review', [user_id], using)
+
+With INVALIDATION['ENABLED'] set, InvalidationMiddleware starts a listener
+thread in each worker, on the first request since threads do not survive a
+fork. It holds its own connection to the INVALIDATION['USING'] database, on
+which it LISTENs for notifications and applies them within milliseconds.
+Notifications sent while it is not listening are lost, so the listener
+flushes every registered cache whenever it (re)connects, and retries every
+INVALIDATION['RECONNECT_INTERVAL'] seconds when the connection drops. A
+keepalive detects connections dropped without a reset.
+"""
+import logging
+import os
+import select
+import threading
+from contextlib import nullcontext
+
+import psycopg2
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.metrics import register_collector
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH = '*'
+
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD = 7900
+
+_caches = []
+_stats = {'notifications': 0, 'flushes': 0}
+_stats_lock = threading.Lock()
+
+
+def register_cache(cache, entities=(), by_id=()):
+    """
+    Register a local cache to invalidate, see the module docstring. Every
+    registered cache is cleared on a full flush.
+
+    Args:
+        cache (LocalCache): The cache.
+        entities (iterable): The entities whose changes clear the cache.
+        by_id (iterable): The entities whose changes delete the entries of
+            the cache keyed by their ids.
+    """
+    _caches.append((cache, frozenset(entities), frozenset(by_id)))
+    return cache
+
+
+def invalidate(entity, ids=None):
+    """
+    Invalidate the caches of this worker depending on an entity.
+
+    Args:
+        entity (str): The entity, or FLUSH to clear every cache.
+        ids (iterable): The changed ids, or None when any may have changed.
+    """
+    if entity == FLUSH:
+        flush()
+        return
+    for cache, entities, by_id in _caches:
+        if entity in entities or (entity in by_id and ids is None):
+            cache.clear()
+        elif entity in by_id:
+            for id in ids:
+                cache.delete(id)
+
+
+def flush():
+    """
+    Clear every registered cache of this worker.
+    """
+    with _stats_lock:
+        _stats['flushes'] += 1
+    for cache, _, _ in _caches:
+        cache.clear()
+
+
+def get_payloads(entity, ids=None):
+    """
+    Encode a change as NOTIFY payloads, 'entity:id,id,...', or 'entity:'
+    when any id may have changed.
+    """
+    if entity == FLUSH or ids is None:
+        return [entity if entity == FLUSH else f'{entity}:']
+    payloads = []
+    payload = ''
+    for id in dict.fromkeys(str(id) for id in ids):
+        if payload and len(entity) + len(payload) + len(id) + 2 > MAX_PAYLOAD:
+            payloads.append(f'{entity}:{payload}')
+            payload = ''
+        payload = f'{payload},{id}' if payload else id
+    if payload:
+        payloads.append(f'{entity}:{payload}')
+    return payloads
+
+
+def parse_payload(payload):
+    """
+    Decode a NOTIFY payload of get_payloads().
+
+    Returns:
+        tuple: The entity and the list of ids, or None.
+    """
+    if payload == FLUSH:
+        return FLUSH, None
+    entity, _, ids = payload.partition(':')
+    if not ids:
+        return entity, None
+    return entity, [int(id) if id.isdigit() else id for id in ids.split(',')]
+
+
+def notify(entity, ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    Announce a change to the caches of every worker, see the module
+    docstring.
+
+    Args:
+        entity (str): The changed entity, or FLUSH to clear every cache.
+        ids (iterable): The changed ids, or None when any may have changed.
+        using (str): The alias of the database written to.
+    """
+    ids = None if ids is None else list(ids)
+    if settings.INVALIDATION['ENABLED']:
+        with connections[using].cursor() as cursor:
+            for payload in get_payloads(entity, ids):
+                cursor.execute(
+                    'SELECT pg_notify(%s, %s)',
+                    [settings.INVALIDATION['CHANNEL'], payload])
+    transaction.on_commit(lambda: invalidate(entity, ids), using=using)
+
+
+def atomic_write(using=DEFAULT_DB_ALIAS):
+    """
+    Get a context manager running a write and its notify() in one
+    transaction, or doing nothing when notifications are disabled, as
+    notify() then sends no query.
+
+    Args:
+        using (str): The alias of the database written to.
+    """
+    if settings.INVALIDATION['ENABLED']:
+        return transaction.atomic(using=using)
+    return nullcontext()
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Apply the notifications of other workers to the registered caches, see
+    the module docstring.
+
+    Attributes:
+        connected (threading.Event): Set while the listener is listening.
+    """
+
+    def __init__(self, conn_params, channel, reconnect_interval=1):
+        super().__init__(name='cache-invalidation', daemon=True)
+        self.conn_params = {
+            'keepalives': 1, 'keepalives_idle': 10,
+            'keepalives_interval': 5, 'keepalives_count': 3,
+            **conn_params,
+        }
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+        self._connection = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except (psycopg2.Error, OSError) as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning(
+                    'Cache invalidation listener disconnected: %s', e)
+            finally:
+                self.connected.clear()
+                self.close()
+            # Notifications may be missed until it listens again
+            flush()
+            self._stopped.wait(self.reconnect_interval)
+
+    def listen(self):
+        connection = self._connection = psycopg2.connect(**self.conn_params)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LISTEN {psycopg2.extensions.quote_ident(self.channel, cursor)}')
+        # Entries cached before it listened may be stale
+        flush()
+        self.connected.set()
+        while not self._stopped.is_set():
+            if select.select([connection], [], [], 1.0) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                notification = connection.notifies.pop(0)
+                self.apply(notification.payload)
+
+    def apply(self, payload):
+        with _stats_lock:
+            _stats['notifications'] += 1
+        try:
+            entity, ids = parse_payload(payload)
+        except ValueError:
+            logger.warning('Invalid cache invalidation payload %r', payload)
+            return
+        invalidate(entity, ids)
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def stop(self, timeout=None):
+        """
+        Stop listening and wait for the thread to end.
+        """
+        self._stopped.set()
+        self.join(timeout)
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """
+    Start the listener of the current process if it is not running.
+    """
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid != pid:
+        with _listener_lock:
+            if _listener_pid != pid:
+                options = settings.INVALIDATION
+                conn_params = connections[options['USING']].get_connection_params()
+                conn_params.pop('cursor_factory', None)
+                _listener = InvalidationListener(
+                    conn_params, options['CHANNEL'],
+                    options['RECONNECT_INTERVAL'])
+                _listener.start()
+                _listener_pid = pid
+    return _listener
+
+
+@register_collector
+def collect_metrics():
+    """
+    Get the counters of the cache invalidation of this worker for
+    core.metrics.
+    """
+    listener = _listener if _listener_pid == os.getpid() else None
+    return [
+        ('cache_invalidations_total', 'counter',
+         'Cache invalidation notifications received.', {},
+         _stats['notifications']),
+        ('cache_flushes_total', 'counter',
+         'Full flushes of the local caches.', {}, _stats['flushes']),
+        ('cache_invalidation_listening', 'gauge',
+         'Whether the cache invalidation listener is connected.', {},
+         int(listener is not None and listener.connected.is_set())),
+    ]
+
+
+class InvalidationMiddleware:
+    """
+    Start the cache invalidation listener of the worker, see the module
+    docstring. Removed from the chain unless INVALIDATION['ENABLED'] is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INVALIDATION['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if _listener_pid != os.getpid():
+            start_listener()
+        return self.get_response(request)
@@ -0,0 +1,346 @@
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+
+
+ENDPOINTS = [
+    'login', 'book_list', 'book_by_genre', 'user_reviews', 'suggest',
+    'add_review', 'update_review', 'delete_review',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every endpoint against a dataset from generate_dataset, '
+        'in process through the test client or over HTTP with --url. Each '
+        'endpoint is driven by --concurrency threads for --duration seconds '
+        'as random users of the dataset, and the throughput and latency '
+        'percentiles are written as JSON. In process the rate limits are '
+        'disabled. add_review creates reviews that delete_review removes, '
+        'so the dataset is left as it was when both run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', default='dataset',
+            help='Prefix of the dataset, see generate_dataset (default: dataset).')
+        parser.add_argument(
+            '--password', default='password',
+            help='Password of the dataset users (default: password).')
+        parser.add_argument(
+            '--endpoints', default=','.join(ENDPOINTS),
+            help=f'Comma separated endpoints (default: {",".join(ENDPOINTS)}).')
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Concurrent clients (default: 8).')
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Seconds to run each endpoint (default: 10).')
+        parser.add_argument(
+            '--users', type=int, default=100,
+            help='Number of dataset users to send requests as (default: 100).')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed (default: 0).')
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server, e.g. http://localhost:8000 '
+                 '(default: in process).')
+        parser.add_argument(
+            '--output', help='Write the JSON to a file instead of stdout.')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'].split(',')
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+        rng = random.Random(options['seed'])
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, username FROM users WHERE username LIKE %s '
+                'ORDER BY random() LIMIT %s',
+                [f"{options['prefix']}-%", options['users']])
+            users = [
+                {'id': row[0], 'username': row[1],
+                 'token': str(AccessToken.for_user(User(id=row[0])))}
+                for row in cursor.fetchall()
+            ]
+            cursor.execute(
+                'SELECT DISTINCT genre FROM books WHERE title LIKE %s',
+                [f"{options['prefix']} book %"])
+            genres = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                'SELECT min(id), max(id) FROM books WHERE title LIKE %s',
+                [f"{options['prefix']} book %"])
+            book_range = cursor.fetchone()
+        connection.close()
+        if not users or not genres:
+            raise CommandError(
+                f"No dataset with prefix {options['prefix']!r}, "
+                f"run generate_dataset first.")
+
+        if options['url']:
+            url = urllib.parse.urlsplit(options['url'])
+            make_client = lambda: HttpClient(url)  # noqa: E731
+            throttling = None
+        else:
+            make_client = InProcessClient
+            throttling = override_settings(
+                THROTTLE={**settings.THROTTLE, 'RATES': {}})
+            throttling.enable()
+
+        bench = Bench(
+            users, genres, book_range, options['password'], rng)
+        results = {}
+        try:
+            for endpoint in endpoints:
+                results[endpoint] = bench.run(
+                    endpoint, make_client, options['concurrency'],
+                    options['duration'])
+                self.stderr.write(
+                    f"{endpoint}: {results[endpoint]['throughput']:.1f} req/s, "
+                    f"p99 {results[endpoint]['p99']:.1f}ms, "
+                    f"{results[endpoint]['errors']} errors")
+        finally:
+            if throttling is not None:
+                throttling.disable()
+            bench.cleanup(make_client)
+
+        report = json.dumps({
+            'target': options['url'] or 'in-process',
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'users': len(users),
+            'endpoints': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+
+class InProcessClient:
+    """
+    Send requests to the application through the test client.
+    """
+
+    def __init__(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+        self.client = Client(
+            HTTP_HOST=hosts[0].lstrip('.') if hosts else 'localhost')
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        response = getattr(self.client, method.lower())(
+            path, data=data, content_type='application/json', **headers)
+        return response.status_code, response.content
+
+    def close(self):
+        connection.close()
+
+
+class HttpClient:
+    """
+    Send requests to a running server over a keep-alive connection.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        connection_class = (
+            http.client.HTTPSConnection if url.scheme == 'https'
+            else http.client.HTTPConnection)
+        self.connection = connection_class(url.netloc, timeout=30)
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = None
+        if data is not None:
+            if method == 'GET':
+                path = f'{path}?{urllib.parse.urlencode(data)}'
+            else:
+                body = json.dumps(data)
+        try:
+            self.connection.request(
+                method, self.url.path.rstrip('/') + path, body=body,
+                headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+class Bench:
+    """
+    The requests of each endpoint, as the users of the dataset.
+    """
+
+    def __init__(self, users, genres, book_range, password, rng):
+        self.users = users
+        self.genres = genres
+        self.book_range = book_range
+        self.password = password
+        self.rng = rng
+        self.lock = threading.Lock()
+        # Reviews created by add_review, for update_review and delete_review
+        self.created = []
+
+    def pick_user(self):
+        with self.lock:
+            return self.rng.choice(self.users)
+
+    def send(self, client, endpoint):
+        """
+        Send one request to an endpoint.
+
+        Returns:
+            bool: Whether it succeeded, None if there was nothing to send.
+        """
+        user = self.pick_user()
+        if endpoint == 'login':
+            status, _ = client.request('POST', '/api/login/', {
+                'username': user['username'], 'password': self.password})
+        elif endpoint == 'book_list':
+            status, _ = client.request(
+                'GET', '/api/book/list/', token=user['token'])
+        elif endpoint == 'book_by_genre':
+            with self.lock:
+                genre = self.rng.choice(self.genres)
+            status, _ = client.request(
+                'GET', '/api/book/', {'genre': genre}, token=user['token'])
+        elif endpoint == 'user_reviews':
+            status, _ = client.request(
+                'GET', '/api/review/list', token=user['token'])
+        elif endpoint == 'suggest':
+            status, _ = client.request(
+                'GET', '/api/suggest/', token=user['token'])
+            # Users without reviews get no suggestions
+            return status in (200, 404)
+        elif endpoint == 'add_review':
+            with self.lock:
+                book_id = self.rng.randint(*self.book_range)
+                rating = self.rng.randint(1, 5)
+            status, body = client.request(
+                'POST', '/api/review/add/',
+                {'book_id': book_id, 'rating': rating}, token=user['token'])
+            if status == 201:
+                with self.lock:
+                    self.created.append((user, json.loads(body)['id']))
+            # Books the user reviewed already are rejected
+            return status == 201 or (
+                status == 400 and b'already reviewed' in body)
+        else:
+            with self.lock:
+                if not self.created:
+                    return None
+                if endpoint == 'update_review':
+                    user, review_id = self.rng.choice(self.created)
+                    rating = self.rng.randint(1, 5)
+                else:
+                    user, review_id = self.created.pop()
+            if endpoint == 'update_review':
+                status, _ = client.request(
+                    'PUT', f'/api/review/update/{review_id}/',
+                    {'rating': rating}, token=user['token'])
+            else:
+                status, _ = client.request(
+                    'DELETE', f'/api/review/delete/{review_id}/',
+                    token=user['token'])
+        return 200 <= status < 300
+
+    def run(self, endpoint, make_client, concurrency, duration):
+        """
+        Drive an endpoint from `concurrency` clients for `duration` seconds.
+
+        Returns:
+            dict: The number of requests and errors, the throughput in
+                requests per second and the mean, p50, p95 and p99 latency
+                in milliseconds.
+        """
+        deadline = time.monotonic() + duration
+        latencies = []
+        errors = [0]
+
+        def client_loop():
+            client = make_client()
+            timings = []
+            failed = 0
+            try:
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        ok = self.send(client, endpoint)
+                    except (OSError, http.client.HTTPException):
+                        ok = False
+                    if ok is None:
+                        break
+                    timings.append((time.perf_counter() - start) * 1000)
+                    failed += not ok
+            finally:
+                client.close()
+            with self.lock:
+                latencies.extend(timings)
+                errors[0] += failed
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [
+                    executor.submit(client_loop) for _ in range(concurrency)]:
+                future.result()
+        elapsed = max(time.monotonic() - start, 1e-9)
+        return summarize(latencies, errors[0], elapsed)
+
+    def cleanup(self, make_client):
+        """
+        Delete the reviews created by add_review that delete_review did not.
+        """
+        client = make_client()
+        try:
+            while self.created:
+                user, review_id = self.created.pop()
+                client.request(
+                    'DELETE', f'/api/review/delete/{review_id}/',
+                    token=user['token'])
+        finally:
+            client.close()
+
+
+def percentile(values, fraction):
+    """
+    Get the nearest-rank percentile of sorted values.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 1),
+        'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'p50': round(percentile(latencies, 0.50), 2),
+        'p95': round(percentile(latencies, 0.95), 2),
+        'p99': round(percentile(latencies, 0.99), 2),
+    }
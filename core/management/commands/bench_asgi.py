@@ -0,0 +1,192 @@
+import asyncio
+import io
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from core.db import aio
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test a read endpoint in process: its async version on the ASGI '
+        'application with N concurrent requests on one event loop, against '
+        'the sync version on the WSGI application with N threads, as a '
+        'threaded WSGI worker would run it. --latency adds a delay to every '
+        'query to simulate a remote database. A temporary user is created '
+        'and removed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default='book/list/',
+            help='Endpoint below /api/ and /api/async/ (default: book/list/).')
+        parser.add_argument(
+            '--concurrency', default='1,8,32,128',
+            help='Comma separated concurrency levels (default: 1,8,32,128).')
+        parser.add_argument(
+            '--duration', type=float, default=5,
+            help='Seconds to run each level (default: 5).')
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help='Milliseconds added to every query (default: 0).')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f'bench-asgi-{uuid.uuid4().hex[:12]}')
+        authorization = f'Bearer {AccessToken.for_user(user)}'.encode()
+        connection.close()
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(options['latency'] / 1000)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # Wrappers outlive the connection when it is reopened
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        fetchall = aio.AsyncConnectionPool.fetchall
+
+        async def adelay(pool, sql, params=None):
+            await asyncio.sleep(options['latency'] / 1000)
+            return await fetchall(pool, sql, params)
+
+        if options['latency']:
+            connection_created.connect(add_latency)
+            aio.AsyncConnectionPool.fetchall = adelay
+        self.stdout.write(
+            f"{'server':>8}{'clients':>9}{'req/s':>10}{'p50':>10}{'p99':>10}"
+            f"{'errors':>8}")
+        try:
+            for clients in [
+                    int(value) for value in options['concurrency'].split(',')]:
+                for server in ['wsgi', 'asgi']:
+                    run = self.run_wsgi if server == 'wsgi' else self.run_asgi
+                    result = run(
+                        options['path'], authorization, clients,
+                        options['duration'])
+                    self.stdout.write(
+                        f"{server:>8}{clients:>9}{result['rate']:>10.1f}"
+                        f"{result['p50']:>8.1f}ms{result['p99']:>8.1f}ms"
+                        f"{result['errors']:>8}")
+        finally:
+            connection_created.disconnect(add_latency)
+            aio.AsyncConnectionPool.fetchall = fetchall
+            user.delete()
+
+    def run_wsgi(self, path, authorization, clients, duration):
+        """
+        Send requests to the sync endpoint from `clients` threads.
+        """
+        application = get_wsgi_application()
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': f'/api/{path.split("?")[0]}',
+            'QUERY_STRING': path.partition('?')[2],
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost',
+            'HTTP_AUTHORIZATION': authorization.decode(),
+            'wsgi.url_scheme': 'http',
+        }
+        deadline = time.monotonic() + duration
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def client():
+            timings = []
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                statuses = []
+                body = application(
+                    {**environ, 'wsgi.input': io.BytesIO()},
+                    lambda status, headers: statuses.append(status))
+                b''.join(body)
+                body.close()
+                timings.append((time.perf_counter() - start) * 1000)
+                if not statuses[0].startswith('200'):
+                    with lock:
+                        errors[0] += 1
+            with lock:
+                latencies.extend(timings)
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for future in [executor.submit(client) for _ in range(clients)]:
+                future.result()
+        return summarize(latencies, errors[0], duration)
+
+    def run_asgi(self, path, authorization, clients, duration):
+        """
+        Send requests to the async endpoint from `clients` coroutines on one
+        event loop.
+        """
+        # Connections opened on the threads of a request would outlive it
+        max_age = settings.DATABASES['default']['CONN_MAX_AGE']
+        settings.DATABASES['default']['CONN_MAX_AGE'] = 0
+        application = get_asgi_application()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': f'/api/async/{path.split("?")[0]}',
+            'query_string': path.partition('?')[2].encode(),
+            'headers': [
+                (b'host', b'localhost'), (b'authorization', authorization)],
+            'server': ('localhost', 80),
+        }
+        latencies = []
+        errors = 0
+
+        async def request():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(dict(scope), receive, send)
+            return messages[0]['status']
+
+        async def client(deadline):
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status = await request()
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += status != 200
+
+        async def main():
+            deadline = time.monotonic() + duration
+            await asyncio.gather(*[client(deadline) for _ in range(clients)])
+
+        try:
+            asyncio.run(main())
+        finally:
+            settings.DATABASES['default']['CONN_MAX_AGE'] = max_age
+        return summarize(latencies, errors, duration)
+
+
+def summarize(latencies, errors, duration):
+    latencies.sort()
+    return {
+        'rate': len(latencies) / duration,
+        'p50': latencies[len(latencies) // 2] if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        'errors': errors,
+    }
@@ -0,0 +1,76 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db.plans import (
+    BASELINE_PATH, REFERENCE_DATASET, Sample, check_plans, read_baseline,
+    write_baseline)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on the named queries of every app and check their plans '
+        'against the expectations of the plans module of the app: indexes '
+        'used, tables read with sequential scans and cost ceilings. The '
+        'shape of each plan is diffed against the baseline in '
+        f'{BASELINE_PATH.name}. The expectations hold on the reference '
+        'dataset, which --generate loads.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate', action='store_true',
+            help='Load the reference dataset first, replacing a previous one.')
+        parser.add_argument(
+            '--prefix', default=REFERENCE_DATASET['prefix'],
+            help='Prefix of the dataset to take parameter values from '
+                 f"(default: {REFERENCE_DATASET['prefix']}).")
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Write the current plan shapes to the baseline.')
+        parser.add_argument(
+            '--fail-on-diff', action='store_true',
+            help='Fail when a plan shape differs from the baseline.')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Write the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            call_command(
+                'generate_dataset', clear=True, stdout=self.stderr,
+                **REFERENCE_DATASET)
+        try:
+            sample = Sample(options['prefix'])
+        except ValueError as e:
+            raise CommandError(f'{e}, use --generate.')
+        results = check_plans(sample, baseline=read_baseline())
+
+        if options['update']:
+            write_baseline({
+                result['query']: result['shape'] for result in results
+                if result['shape']})
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for result in results:
+                cost = '' if result['cost'] is None else f"{result['cost']:10.1f}"
+                status = (
+                    self.style.ERROR('FAIL') if result['violations']
+                    else self.style.WARNING('DIFF') if result['diff']
+                    else self.style.SUCCESS('OK'))
+                self.stdout.write(f"{result['query']:<36}{cost:>10}  {status}")
+                for violation in result['violations']:
+                    self.stdout.write(f'    {violation}')
+                if result['diff'] and not options['update']:
+                    self.stdout.write(
+                        ''.join(f'    {line}\n' for line in result['diff']))
+
+        failed = [result['query'] for result in results if result['violations']]
+        if options['fail_on_diff'] and not options['update']:
+            failed += [
+                result['query'] for result in results
+                if result['diff'] and not result['violations']]
+        if failed:
+            raise CommandError(f"Unexpected plans: {', '.join(failed)}")
@@ -0,0 +1,216 @@
+import csv
+import io
+import itertools
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from core.invalidation import FLUSH, notify
+from suggest.popular import refresh_popular_books
+
+
+GENRE_NAMES = [
+    'Fiction', 'Fantasy', 'Romance', 'Mystery', 'Thriller', 'Science Fiction',
+    'Historical', 'Horror', 'Biography', 'Adventure', 'Young Adult', 'Poetry',
+    'Drama', 'Humor', 'Self-Help', 'Travel', 'Philosophy', 'Science',
+    'Classics', 'Crime',
+]
+
+# Rows per COPY
+CHUNK_SIZE = 50000
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset of users, books and reviews and load it '
+        'with COPY. User activity and book popularity follow power laws and '
+        'genre sizes a Zipf distribution; each user rates the books of a '
+        'favourite genre higher. Usernames and titles start with --prefix, '
+        'which --clear uses to remove a previous dataset. Generated reviews '
+        'have no outbox events; the popular books are refreshed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Number of users (default: 1000).')
+        parser.add_argument(
+            '--books', type=int, default=10000,
+            help='Number of books (default: 10000).')
+        parser.add_argument(
+            '--reviews', type=int, default=100000,
+            help='Number of reviews, fewer if users run out of books to '
+                 'review (default: 100000).')
+        parser.add_argument(
+            '--genres', type=int, default=len(GENRE_NAMES),
+            help=f'Number of genres (default: {len(GENRE_NAMES)}).')
+        parser.add_argument(
+            '--user-exponent', type=float, default=1.0,
+            help='Power-law exponent of user activity (default: 1.0).')
+        parser.add_argument(
+            '--book-exponent', type=float, default=0.8,
+            help='Power-law exponent of book popularity (default: 0.8).')
+        parser.add_argument(
+            '--genre-exponent', type=float, default=1.0,
+            help='Zipf exponent of genre sizes (default: 1.0).')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed (default: 0).')
+        parser.add_argument(
+            '--prefix', default='dataset',
+            help='Prefix of usernames and book titles (default: dataset).')
+        parser.add_argument(
+            '--password', default='password',
+            help='Password of every user (default: password).')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Remove the users, books and reviews of a previous dataset '
+                 'with the same prefix first.')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['books'], options['genres']) < 1:
+            raise CommandError('--users, --books and --genres must be positive.')
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        start = time.perf_counter()
+
+        genres = (GENRE_NAMES + [
+            f'Genre {index}'
+            for index in range(len(GENRE_NAMES) + 1, options['genres'] + 1)
+        ])[:options['genres']]
+        genre_weights = power_law(len(genres), options['genre_exponent'])
+        book_genres = rng.choices(
+            range(len(genres)), weights=genre_weights, k=options['books'])
+        favourite_genres = rng.choices(
+            range(len(genres)), weights=genre_weights, k=options['users'])
+        book_weights = power_law(options['books'], options['book_exponent'])
+        cum_book_weights = list(itertools.accumulate(book_weights))
+        activity = Counter(rng.choices(
+            range(options['users']),
+            weights=power_law(options['users'], options['user_exponent']),
+            k=options['reviews']))
+
+        try:
+            with transaction.atomic():
+                if options['clear']:
+                    self.clear(prefix)
+                user_ids = self.reserve_ids('users', options['users'])
+                book_ids = self.reserve_ids('books', options['books'])
+                # Only hash once, all users share the password
+                password = make_password(options['password'])
+                self.copy('users', ['id', 'username', 'password', 'is_superuser'], (
+                    (user_id, f'{prefix}-{index}', password, 'f')
+                    for index, user_id in enumerate(user_ids, start=1)))
+                self.copy('books', ['id', 'title', 'author', 'genre'], (
+                    (book_id, f'{prefix} book {index}',
+                     f'Author {rng.randrange(max(1, options["books"] // 5))}',
+                     genres[book_genres[index - 1]])
+                    for index, book_id in enumerate(book_ids, start=1)))
+                reviews = self.copy('reviews', ['user_id', 'book_id', 'rating'], (
+                    (user_ids[user], book_ids[book],
+                     rate(rng, book_genres[book] == favourite_genres[user]))
+                    for user in range(options['users'])
+                    for book in pick_books(
+                        rng, activity[user], book_weights, cum_book_weights)))
+                notify(FLUSH)
+        except IntegrityError as e:
+            raise CommandError(
+                f'{e}\nA dataset with prefix {prefix!r} may exist already, '
+                f'use --clear or another --prefix.')
+
+        refresh_popular_books(settings.STATEMENT_TIMEOUTS['PAGE_SIZE'])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE users, books, reviews, popular_books')
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['users']} users, {options['books']} books in "
+            f"{len(genres)} genres and {reviews} reviews in "
+            f"{time.perf_counter() - start:.1f}s"))
+
+    def clear(self, prefix):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM reviews
+                WHERE user_id IN (SELECT id FROM users WHERE username LIKE %s)
+                OR book_id IN (SELECT id FROM books WHERE title LIKE %s)
+                """,
+                [f'{prefix}-%', f'{prefix} book %'])
+            cursor.execute(
+                'DELETE FROM users WHERE username LIKE %s', [f'{prefix}-%'])
+            cursor.execute(
+                'DELETE FROM books WHERE title LIKE %s', [f'{prefix} book %'])
+
+    def reserve_ids(self, table, count):
+        """
+        Take `count` ids from the sequence of a table, so that rows loaded
+        with COPY can be referenced without reading them back.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [table, 'id', count])
+            return [row[0] for row in cursor.fetchall()]
+
+    def copy(self, table, columns, rows):
+        """
+        COPY rows into a table in chunks of CHUNK_SIZE.
+
+        Returns:
+            int: The number of rows loaded.
+        """
+        total = 0
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while True:
+                chunk = list(itertools.islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    return total
+                data = io.StringIO()
+                csv.writer(data).writerows(chunk)
+                data.seek(0)
+                cursor.copy_expert(
+                    f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH CSV',
+                    data)
+                total += len(chunk)
+
+
+def power_law(count, exponent):
+    """
+    Get the weights of ranks 1 to `count` under a power law.
+    """
+    return [rank ** -exponent for rank in range(1, count + 1)]
+
+
+def pick_books(rng, count, weights, cum_weights):
+    """
+    Pick `count` distinct book indexes, popular books being more likely.
+    """
+    count = min(count, len(weights))
+    # Redrawing until enough distinct books are picked is fast as long as
+    # the user reviews a small part of the catalogue
+    if count > len(weights) // 10:
+        # Weighted sampling without replacement (Efraimidis-Spirakis)
+        keys = sorted(
+            range(len(weights)),
+            key=lambda index: rng.random() ** (1 / weights[index]))
+        return keys[len(weights) - count:]
+    picked = set()
+    while len(picked) < count:
+        picked.update(rng.choices(
+            range(len(weights)), cum_weights=cum_weights,
+            k=count - len(picked)))
+    return picked
+
+
+def rate(rng, favourite):
+    """
+    Draw a rating, one star higher for books of the user's favourite genre.
+    """
+    rating = rng.choices([1, 2, 3, 4, 5], weights=[5, 10, 25, 35, 25])[0]
+    return min(rating + 1, 5) if favourite else rating
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the OpenAPI schema of the API into OPENAPI_SCHEMA["DIR"], '
+        'in JSON and YAML, for the schema routes to serve. Run it when '
+        'building, after changing views or serializers.'
+    )
+
+    def handle(self, *args, **options):
+        paths = write_schema()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {', '.join(str(path) for path in paths)}"))
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Run in the child interpreter, see core.preload.measure_startup()
+PROBE = (
+    'import json, sys\n'
+    'from core.preload import measure_startup\n'
+    'sys.stdout.write(json.dumps(measure_startup(run_preload={preload})))\n'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Profile the startup of a worker in a fresh interpreter: the time to '
+        'load settings, each app (import, models, ready), the middleware and '
+        'the URLconf, and the import time of each package and of the slowest '
+        'modules, from python -X importtime.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--preload', action='store_true',
+            help='Also time core.preload.preload().')
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help='Number of slowest modules to list (default: 20).')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Write the report as JSON.')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             PROBE.format(preload=options['preload'])],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f'Startup failed:\n{result.stderr[-4000:]}')
+
+        report = json.loads(result.stdout)
+        modules = parse_importtime(result.stderr)
+        packages = defaultdict(float)
+        for name, self_time, _ in modules:
+            packages[name.partition('.')[0]] += self_time
+        report['packages'] = dict(
+            sorted(packages.items(), key=lambda item: -item[1]))
+        report['modules'] = [
+            {'module': name, 'self': self_time, 'cumulative': cumulative}
+            for name, self_time, cumulative in sorted(
+                modules, key=lambda module: -module[1])[:options['top']]
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write('Phases')
+        for phase, duration in report['phases'].items():
+            self.stdout.write(f'  {phase:<40}{duration * 1000:9.1f}ms')
+        self.stdout.write('\nApps (import, models, ready)')
+        for label, phases in report['apps'].items():
+            self.stdout.write(f'  {label:<40}' + ''.join(
+                f"{phases.get(phase, 0) * 1000:9.1f}ms"
+                for phase in ('import', 'models', 'ready')))
+        self.stdout.write('\nImports by package (self time)')
+        for package, duration in list(report['packages'].items())[:options['top']]:
+            self.stdout.write(f'  {package:<40}{duration * 1000:9.1f}ms')
+        self.stdout.write('\nSlowest modules (self, cumulative)')
+        for module in report['modules']:
+            self.stdout.write(
+                f"  {module['module']:<40}{module['self'] * 1000:9.1f}ms"
+                f"{module['cumulative'] * 1000:9.1f}ms")
+
+
+def parse_importtime(output):
+    """
+    Parse the output of python -X importtime.
+
+    Returns:
+        list: (module, self time, cumulative time) tuples, times in seconds.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        if not self_time.strip().isdigit():
+            # The header
+            continue
+        modules.append(
+            (name.strip(), int(self_time) / 1e6, int(cumulative) / 1e6))
+    return modules
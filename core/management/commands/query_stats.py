@@ -0,0 +1,61 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.metrics import get_registry
+
+
+SAMPLES = {
+    'db_query_calls_total': 'calls',
+    'db_query_duration_seconds_total': 'time',
+    'db_query_rows_total': 'rows',
+}
+
+SORT_KEYS = ['time', 'calls', 'mean', 'rows']
+
+
+class Command(BaseCommand):
+    help = (
+        'Show the calls, time and rows of the named queries of '
+        'core.db.queries, summed over the workers that wrote their metrics '
+        'to METRICS["DIR"].'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sort', choices=SORT_KEYS, default='time',
+            help='Sort by total time, calls, mean time or rows (default: time).')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Write the stats as JSON.')
+
+    def handle(self, *args, **options):
+        if not settings.METRICS['DIR']:
+            self.stderr.write(
+                'METRICS_DIR is not set, so the stats of the workers are not '
+                'available; only those of this process are shown.')
+
+        stats = defaultdict(lambda: {'calls': 0, 'time': 0.0, 'rows': 0})
+        for snapshot in get_registry().collect():
+            for name, _, _, labels, value in snapshot['samples']:
+                if name in SAMPLES:
+                    stats[dict(labels)['query']][SAMPLES[name]] += value
+        rows = [
+            {'query': query, **values,
+             'mean': values['time'] / values['calls'] if values['calls'] else 0.0}
+            for query, values in stats.items()
+        ]
+        rows.sort(key=lambda row: (-row[options['sort']], row['query']))
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        self.stdout.write(
+            f"{'query':<36}{'calls':>10}{'total ms':>12}{'mean ms':>10}{'rows':>12}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['query']:<36}{row['calls']:>10}"
+                f"{row['time'] * 1000:>12.1f}{row['mean'] * 1000:>10.3f}"
+                f"{row['rows']:>12}")
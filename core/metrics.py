@@ -0,0 +1,412 @@
+"""
+Per-request performance metrics.
+
+MetricsMiddleware measures every request: total time, the number and time of
+SQL queries, the time spent serializing its data with the serializers of
+core.serializers and rendering the response, and its size. They are
+sent back in a Server-Timing header and aggregated, per view, method and
+status, into histograms exposed in the Prometheus text format by the
+metrics view.
+
+Each worker aggregates in memory. With METRICS['DIR'] set, every worker also
+writes its aggregates to a file of its own in that directory, at most every
+METRICS['FLUSH_INTERVAL'] seconds, and the metrics view merges the files of
+all workers, so any worker can answer a scrape. The directory should be
+emptied when the server starts, as counters of previous runs would be added
+to the new ones.
+
+Other modules add samples, e.g. cache hit counters, with register_collector().
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Time spent handling requests.', DURATION_BUCKETS),
+    'http_request_db_queries': (
+        'SQL queries run per request.', QUERY_BUCKETS),
+    'http_request_db_duration_seconds': (
+        'Time spent in SQL queries per request.', DURATION_BUCKETS),
+    'http_response_serialize_duration_seconds': (
+        'Time spent serializing response data, queries excluded.',
+        DURATION_BUCKETS),
+    'http_response_render_duration_seconds': (
+        'Time spent rendering responses.', DURATION_BUCKETS),
+    'http_response_size_bytes': (
+        'Size of response bodies.', SIZE_BUCKETS),
+}
+
+_collectors = []
+
+# The timing of the request being handled
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+
+def register_collector(collector):
+    """
+    Register a function adding samples to the metrics of the worker.
+
+    The function is called on every flush and returns a list of
+    (name, type, help, labels, value) tuples, where type is 'counter' or
+    'gauge'. Counters are summed over all workers, gauges over the workers
+    that are still running.
+    """
+    _collectors.append(collector)
+    return collector
+
+
+class MetricsRegistry:
+    """
+    The histograms of one worker process.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.path = (
+            os.path.join(directory, f'{os.getpid()}.json') if directory else None)
+        # Bucket counts, then sum and count, by (name, labels)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._next_flush = 0.0
+
+    def observe_request(self, labels, observations):
+        """
+        Add the observations of a request, as (name, value) pairs, to the
+        histograms with the given labels.
+        """
+        with self._lock:
+            for name, value in observations:
+                key = (name, labels)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [0] * (
+                        len(HISTOGRAMS[name][1]) + 2)
+                histogram[bisect.bisect_left(HISTOGRAMS[name][1], value)] += 1
+                histogram[-2] += value
+                histogram[-1] += 1
+
+    def snapshot(self):
+        """
+        Get the histograms and the collected samples of the worker.
+        """
+        with self._lock:
+            histograms = [
+                [name, list(labels), list(histogram)]
+                for (name, labels), histogram in self._histograms.items()
+            ]
+        samples = [
+            [name, kind, help, sorted(labels.items()), value]
+            for collector in _collectors
+            for name, kind, help, labels, value in collector()
+        ]
+        return {
+            'pid': os.getpid(),
+            'histograms': histograms,
+            'samples': samples,
+        }
+
+    def flush(self, force=False):
+        """
+        Write the snapshot of the worker to its file, if a directory is set
+        and the flush interval has passed.
+        """
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_flush:
+            return
+        self._next_flush = now + self.flush_interval
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, self.path)
+
+    def collect(self):
+        """
+        Get the snapshots of every worker, or of this one only when no
+        directory is set.
+        """
+        if self.path is None:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # Removed or being replaced
+                continue
+        return snapshots
+
+
+_registry = None
+_registry_pid = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the metrics registry of the current process.
+    """
+    global _registry, _registry_pid
+    pid = os.getpid()
+    if _registry_pid != pid:
+        with _registry_lock:
+            if _registry_pid != pid:
+                _registry = MetricsRegistry(
+                    settings.METRICS['DIR'], settings.METRICS['FLUSH_INTERVAL'])
+                _registry_pid = pid
+    return _registry
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_sample(name, labels, value):
+    def escape(value):
+        return (
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+    if not labels:
+        return f'{name} {value}'
+    labels = ','.join(f'{label}="{escape(label_value)}"' for label, label_value in labels)
+    return f'{name}{{{labels}}} {value}'
+
+
+def render_metrics(snapshots):
+    """
+    Merge the snapshots of the workers into the Prometheus text format.
+    """
+    histograms = {}
+    samples = {}
+    for snapshot in snapshots:
+        running = is_running(snapshot['pid'])
+        for name, labels, histogram in snapshot['histograms']:
+            if name not in HISTOGRAMS:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                merged[index] += value
+        for name, kind, help, labels, value in snapshot['samples']:
+            if kind == 'gauge' and not running:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            sample = samples.setdefault(key, [kind, help, 0])
+            sample[2] += value
+
+    lines = []
+    for name, (help, buckets) in HISTOGRAMS.items():
+        series = sorted(
+            (labels, histogram)
+            for (key, labels), histogram in histograms.items() if key == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip(buckets, histogram):
+                cumulative += count
+                lines.append(format_sample(
+                    f'{name}_bucket', labels + (('le', bound),), cumulative))
+            lines.append(format_sample(
+                f'{name}_bucket', labels + (('le', '+Inf'),), histogram[-1]))
+            lines.append(format_sample(f'{name}_sum', labels, histogram[-2]))
+            lines.append(format_sample(f'{name}_count', labels, histogram[-1]))
+
+    described = set()
+    for (name, labels), (kind, help, value) in sorted(samples.items()):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+        lines.append(format_sample(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTiming:
+    """
+    The SQL queries, serialize and render time of one request.
+
+    Called as an execute wrapper by time_query() for the queries of the
+    request.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializing = False
+        self.serialize_time = 0.0
+        self.render_start = None
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add_query(time.perf_counter() - start)
+
+    def add_query(self, duration):
+        self.db_time += duration
+        self.queries += 1
+
+    def serialize(self, get_data):
+        """
+        Get the data of a serializer, adding the time spent to serialize_time
+        without that of its queries. Nested serializers are timed with their
+        parent.
+        """
+        if self.serializing:
+            return get_data()
+        self.serializing = True
+        start = time.perf_counter()
+        db_time = self.db_time
+        try:
+            return get_data()
+        finally:
+            self.serializing = False
+            self.serialize_time += max(
+                time.perf_counter() - start - (self.db_time - db_time), 0)
+
+    def rendered(self, response):
+        self.render_time = time.perf_counter() - self.render_start
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Time a query for the request being handled, if any.
+
+    Installed on every connection, as sync code called from async requests
+    runs in a thread whose connections the middleware cannot reach, but
+    which shares the context of the request.
+    """
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    return timing(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_time_query(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+class MetricsMiddleware:
+    """
+    Record the metrics of every request, see the module docstring.
+
+    Under ASGI the middleware stays async, so async views are not moved to
+    a thread; their queries are counted by core.db.aio, and those of sync
+    views, run in a thread with their own connections, by time_query().
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.server_timing = settings.METRICS['SERVER_TIMING']
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timing = request.timing = RequestTiming()
+        # Connections created before the receiver was connected
+        for alias in connections:
+            install_time_query(None, connections[alias])
+        token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timing = request.timing = RequestTiming()
+        token = current_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, total):
+        """
+        Add the Server-Timing header and observe the metrics of a request.
+        """
+        timing = request.timing
+        if self.server_timing:
+            app = max(
+                total - timing.db_time - timing.serialize_time
+                - timing.render_time, 0)
+            response['Server-Timing'] = (
+                f'db;dur={timing.db_time * 1000:.2f};desc="{timing.queries} queries", '
+                f'serialize;dur={timing.serialize_time * 1000:.2f}, '
+                f'render;dur={timing.render_time * 1000:.2f}, '
+                f'app;dur={app * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+        match = request.resolver_match
+        labels = (
+            ('view', match.view_name if match else '<unmatched>'),
+            ('method', request.method),
+            ('status', response.status_code),
+        )
+        observations = [
+            ('http_request_duration_seconds', total),
+            ('http_request_db_queries', timing.queries),
+            ('http_request_db_duration_seconds', timing.db_time),
+            ('http_response_serialize_duration_seconds', timing.serialize_time),
+        ]
+        if timing.render_start is not None:
+            observations.append(
+                ('http_response_render_duration_seconds', timing.render_time))
+        if not response.streaming:
+            observations.append(
+                ('http_response_size_bytes', len(response.content)))
+        registry = get_registry()
+        registry.observe_request(labels, observations)
+        registry.flush()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        request.timing.render_start = time.perf_counter()
+        response.add_post_render_callback(request.timing.rendered)
+        return response
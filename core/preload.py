@@ -0,0 +1,215 @@
+"""
+Warming of a worker before it serves requests.
+
+preload() runs the work that would otherwise fall on the first requests of
+every worker: compiling the URL patterns, importing the classes named in the
+DRF and simplejwt settings, filling the model and serializer field caches and
+loading translations, then the hooks added with register_preload(). It then
+moves every object to the permanent generation with gc.freeze().
+
+Run in the master process of a pre-forking server (gunicorn --preload, with
+PRELOAD set, see the wsgi and asgi modules), the warmed objects are shared
+with the workers, and since the garbage collector no longer visits frozen
+objects, it does not write to their pages and un-share them.
+
+measure_startup() times the phases of the startup, for the profile_startup
+command. Only the standard library is imported here, so that it can be timed
+from a fresh interpreter.
+"""
+import gc
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_hooks = []
+
+
+def register_preload(hook):
+    """
+    Register a function warming something before fork, e.g. a cache or a
+    model loaded from disk. It must not leave threads running or connections
+    open, as they do not survive a fork.
+    """
+    _hooks.append(hook)
+    return hook
+
+
+def warm_urls():
+    """
+    Populate the URL resolvers and compile the regex of every pattern,
+    which Django otherwise does on the first request matching them.
+    """
+    from django.urls import URLResolver, get_resolver
+
+    def walk(resolver):
+        resolver.reverse_dict
+        for pattern in resolver.url_patterns:
+            pattern.pattern.regex
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern)
+            else:
+                yield pattern
+
+    return list(walk(get_resolver()))
+
+
+def warm_settings():
+    """
+    Import the classes named in the DRF and simplejwt settings, which both
+    import on first access.
+    """
+    from rest_framework.settings import api_settings
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+    for app_settings in (api_settings, jwt_settings):
+        for name in app_settings.defaults:
+            getattr(app_settings, name)
+
+
+def warm_models():
+    """
+    Fill the field caches of every model, used to build querysets and
+    ModelSerializer fields.
+    """
+    from django.apps import apps
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta.concrete_fields
+
+
+def warm_serializers(patterns):
+    """
+    Build the fields of the serializers of the views of the URL patterns.
+    """
+    for pattern in patterns:
+        view_class = getattr(pattern.callback, 'view_class', None)
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        if serializer_class is not None:
+            serializer_class().fields
+
+
+def warm_translations():
+    from django.conf import settings
+    from django.utils import translation
+
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+
+
+def preload(freeze=True):
+    """
+    Warm the worker, see the module docstring.
+
+    Args:
+        freeze (bool): Whether to call gc.freeze() afterwards.
+
+    Returns:
+        dict: The time spent in each step, in seconds.
+    """
+    from django.db import connections
+
+    from core.db.backends.postgresql.base import close_pools
+
+    timings = {}
+
+    def timed(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    patterns = timed('urls', warm_urls)
+    timed('settings', warm_settings)
+    timed('models', warm_models)
+    timed('serializers', warm_serializers, patterns)
+    timed('translations', warm_translations)
+    for hook in _hooks:
+        timed(f'{hook.__module__}.{hook.__qualname__}', hook)
+
+    # Connections of the master would be shared by the forked workers
+    connections.close_all()
+    close_pools()
+    if freeze:
+        start = time.perf_counter()
+        gc.collect()
+        gc.freeze()
+        timings['freeze'] = time.perf_counter() - start
+    logger.info(
+        'Preloaded in %.3fs (%s)', sum(timings.values()),
+        ', '.join(f'{name} {duration:.3f}s' for name, duration in timings.items()))
+    return timings
+
+
+def measure_startup(run_preload=False):
+    """
+    Load the WSGI application, timing each phase: settings, the import,
+    models and ready() of every app, middleware, URLconf and preload.
+
+    Meant for a fresh interpreter, see the profile_startup command.
+
+    Returns:
+        dict: The time of each phase and the apps, in seconds.
+    """
+    start = time.perf_counter()
+    from django.apps import AppConfig
+    from django.conf import settings
+
+    phases = {}
+    apps = {}
+
+    def timed(label, phase, function, *args, **kwargs):
+        phase_start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            apps.setdefault(label, {})[phase] = time.perf_counter() - phase_start
+
+    create = AppConfig.create.__func__
+    import_models = AppConfig.import_models
+
+    def timed_create(cls, entry):
+        phase_start = time.perf_counter()
+        app_config = create(cls, entry)
+        apps[app_config.label] = {'import': time.perf_counter() - phase_start}
+        return app_config
+
+    def timed_import_models(self):
+        timed(self.label, 'models', import_models, self)
+        ready = self.ready
+        self.ready = lambda: timed(self.label, 'ready', ready)
+
+    AppConfig.create = classmethod(timed_create)
+    AppConfig.import_models = timed_import_models
+
+    phase_start = time.perf_counter()
+    settings.INSTALLED_APPS
+    phases['settings'] = time.perf_counter() - phase_start
+    try:
+        phase_start = time.perf_counter()
+        import django
+        django.setup(set_prefix=False)
+        phases['apps'] = time.perf_counter() - phase_start
+    finally:
+        AppConfig.create = classmethod(create)
+        AppConfig.import_models = import_models
+
+    phase_start = time.perf_counter()
+    from django.core.handlers.wsgi import WSGIHandler
+    WSGIHandler()
+    phases['middleware'] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    phases['urlconf'] = time.perf_counter() - phase_start
+
+    if run_preload:
+        phase_start = time.perf_counter()
+        preload(freeze=False)
+        phases['preload'] = time.perf_counter() - phase_start
+
+    phases['total'] = time.perf_counter() - start
+    return {'phases': phases, 'apps': apps}
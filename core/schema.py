@@ -0,0 +1,162 @@
+"""
+The OpenAPI schema of the API.
+
+Generating the schema with drf_yasg introspects every view and serializer,
+and importing drf_yasg alone takes longer than most requests, so the schema
+is generated once, by the generate_schema management command at build time,
+and served as a static artifact from OPENAPI_SCHEMA['DIR'] with an ETag.
+Workers without the artifact generate it on their first schema request.
+
+drf_yasg is only imported here, by the schema and documentation routes:
+views describe themselves with schema_overrides() instead of its
+swagger_auto_schema().
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Content type of the artifact of each format, by suffix of the schema URL
+SCHEMA_FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+}
+
+SCHEMA_VERSION = 'v1'
+
+SchemaArtifact = namedtuple('SchemaArtifact', ['content', 'content_type', 'etag'])
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def schema_overrides(**overrides):
+    """
+    Decorate a view method to customize its operation in the schema, without
+    importing drf_yasg.
+
+    Takes the arguments of drf_yasg's swagger_auto_schema() that do not need
+    its classes, e.g. query_serializer, operation_description or tags.
+    Only for the methods of class based views, not actions or @api_view.
+    """
+    def decorator(view_method):
+        view_method._swagger_auto_schema = overrides
+        return view_method
+    return decorator
+
+
+def get_schema_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Book Recommendation API",
+        default_version=SCHEMA_VERSION,
+        description="Test description",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="great.kian2001@gmail.com"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def generate_schema():
+    """
+    Generate the schema of every public endpoint.
+
+    Returns:
+        dict: The encoded schema by format, see SCHEMA_FORMATS.
+    """
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(get_schema_info()).get_schema(
+        request=None, public=True)
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def get_schema_path(format):
+    return os.path.join(settings.OPENAPI_SCHEMA['DIR'], f'swagger{format}')
+
+
+def write_schema():
+    """
+    Generate the schema and write it to OPENAPI_SCHEMA['DIR'].
+
+    Returns:
+        list: The paths written.
+    """
+    paths = []
+    os.makedirs(settings.OPENAPI_SCHEMA['DIR'], exist_ok=True)
+    for format, content in generate_schema().items():
+        path = get_schema_path(format)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, path)
+        paths.append(path)
+    return paths
+
+
+def get_schema(format):
+    """
+    Get the schema in a format, loaded from its artifact, or generated when
+    there is none, once per process.
+
+    Returns:
+        SchemaArtifact: The schema, None if the format is unknown.
+    """
+    if format not in SCHEMA_FORMATS:
+        return None
+    schema = _schemas.get(format)
+    if schema is not None:
+        return schema
+    with _schemas_lock:
+        if format not in _schemas:
+            try:
+                contents = {}
+                for known_format in SCHEMA_FORMATS:
+                    with open(get_schema_path(known_format), 'rb') as file:
+                        contents[known_format] = file.read()
+            except FileNotFoundError:
+                logger.warning(
+                    'No OpenAPI schema in %s, generating it. Run the '
+                    'generate_schema command when building.',
+                    settings.OPENAPI_SCHEMA['DIR'])
+                contents = generate_schema()
+            for known_format, content in contents.items():
+                _schemas[known_format] = SchemaArtifact(
+                    content, SCHEMA_FORMATS[known_format],
+                    hashlib.sha256(content).hexdigest()[:32])
+        return _schemas[format]
+
+
+def render_ui(request, renderer):
+    """
+    Render the documentation UI page, 'swagger' or 'redoc'.
+
+    Only the template of the drf_yasg renderer is rendered: the page loads
+    the precomputed schema from the schema-json route, see SPEC_URL in
+    SWAGGER_SETTINGS and REDOC_SETTINGS, so nothing is introspected here,
+    unlike drf_yasg's schema view which generates the schema to render it.
+
+    Returns:
+        str: The HTML of the page, None if the renderer is unknown.
+    """
+    from django.template.loader import render_to_string
+    from drf_yasg.views import UI_RENDERERS
+
+    if renderer not in UI_RENDERERS:
+        return None
+    ui_renderer = UI_RENDERERS[renderer][0]()
+    context = {'request': request}
+    ui_renderer.set_context(context)
+    context.update(title=get_schema_info().title, version=SCHEMA_VERSION)
+    return render_to_string(ui_renderer.template, context, request)
@@ -0,0 +1,35 @@
+"""
+Serializers whose data is timed as the serialize phase of the request being
+handled, see core.metrics.
+"""
+from rest_framework import serializers
+
+from core.metrics import current_timing
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    """
+    A list serializer timed as a whole, set as the list_serializer_class of
+    the Meta of a TimedSerializerMixin serializer.
+    """
+
+    @property
+    def data(self):
+        timing = current_timing.get()
+        if timing is None:
+            return super().data
+        return timing.serialize(lambda: super(TimedListSerializer, self).data)
+
+
+class TimedSerializerMixin:
+    """
+    Time the data of a serializer. Set TimedListSerializer as the
+    list_serializer_class of its Meta to time it with many=True.
+    """
+
+    @property
+    def data(self):
+        timing = current_timing.get()
+        if timing is None:
+            return super().data
+        return timing.serialize(lambda: super(TimedSerializerMixin, self).data)
@@ -0,0 +1,213 @@
+"""
+Coalescing of concurrent identical computations.
+
+A SingleFlight runs one computation at a time per key: callers arriving
+while a computation of their key is in flight wait for it and get its
+result, or its exception, instead of starting their own:
+
+    BOOK_LIST = SingleFlight('book.list')
+    data = BOOK_LIST.do(using, lambda: load_books(using))
+
+Results are shared between callers and must not be mutated.
+
+Within a process, threads wait on the leader of the flight, and coroutines
+(ado()) on the leader of their event loop. With SINGLE_FLIGHT['ADVISORY_LOCKS']
+set, the leaders of the processes sharing the database also coordinate: each
+takes a Postgres advisory lock for the key, and those that had to wait for
+it take the result the first one left in the SINGLE_FLIGHT['CACHE'] cache,
+if it was computed after they arrived, rather than computing it again. That
+cache must be shared by the processes, e.g. Redis or Memcached; with a local
+cache, processes take turns computing. A leader waits at most
+SINGLE_FLIGHT['TIMEOUT'] seconds for the lock before computing anyway.
+Coroutines only coordinate within their process.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+
+from core.metrics import register_collector
+
+
+logger = logging.getLogger(__name__)
+
+_flights = []
+
+
+class Flight:
+    """
+    A computation in flight, and its outcome once done.
+    """
+
+    def __init__(self):
+        self.arrived = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce the computations of a kind, see the module docstring.
+
+    Attributes:
+        name (str): The name of the kind of computation, part of the keys of
+            advisory locks and cached results.
+        calls (int): The number of do() and ado() calls.
+        shared (int): The number of calls that got the result of another.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        _flights.append(self)
+
+    def __repr__(self):
+        return f'<SingleFlight {self.name}>'
+
+    def do(self, key, compute):
+        """
+        Get the result of compute(), or of the computation in flight for the
+        same key.
+
+        Args:
+            key: A hashable identifying the computation, with str() unique.
+            compute (callable): The computation, taking no arguments.
+        """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if settings.SINGLE_FLIGHT['ADVISORY_LOCKS']:
+                flight.result = self._coordinate(key, compute, flight.arrived)
+            else:
+                flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    async def ado(self, key, compute):
+        """
+        Get the result of await compute(), or of the computation in flight
+        in the running event loop for the same key.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            future = self._async_flights.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._async_flights[(loop, key)] = loop.create_future()
+            else:
+                self.shared += 1
+        if not leader:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled, not this caller
+                return await self.ado(key, compute)
+
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved, so that it is not logged when no caller waits
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._async_flights[(loop, key)]
+
+    def _coordinate(self, key, compute, arrived):
+        """
+        Compute under the advisory lock of the key, or take the result of the
+        process that held it.
+        """
+        options = settings.SINGLE_FLIGHT
+        name = f'singleflight:{self.name}:{key}'
+        lock_id = int.from_bytes(
+            hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big',
+            signed=True)
+        cache = caches[options['CACHE']]
+        deadline = time.monotonic() + options['TIMEOUT']
+        waited = False
+        with connections[options['USING']].cursor() as cursor:
+            while True:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+                if cursor.fetchone()[0]:
+                    break
+                if time.monotonic() >= deadline:
+                    logger.warning(
+                        'Timed out waiting for %s, computing it anyway', name)
+                    return compute()
+                waited = True
+                time.sleep(options['POLL_INTERVAL'])
+            try:
+                if waited:
+                    entry = cache.get(name)
+                    # Only results computed after the caller arrived
+                    if entry is not None and entry[0] >= arrived:
+                        with self._lock:
+                            self.shared += 1
+                        return entry[1]
+                result = compute()
+                cache.set(name, (time.time(), result), options['TIMEOUT'])
+                return result
+            finally:
+                try:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
+                except DatabaseError:
+                    # e.g. in an aborted transaction; the lock is released
+                    # when the connection closes
+                    logger.warning('Could not release the lock of %s', name)
+
+
+@register_collector
+def collect_metrics():
+    """
+    Get the counters of every SingleFlight for core.metrics.
+    """
+    samples = []
+    for flight in _flights:
+        labels = {'flight': flight.name}
+        samples += [
+            ('singleflight_calls_total', 'counter',
+             'Calls of coalesced computations.', labels, flight.calls),
+            ('singleflight_shared_total', 'counter',
+             'Calls that got the result of a concurrent computation.',
+             labels, flight.shared),
+        ]
+    return samples
@@ -0,0 +1,140 @@
+"""
+Query budgets for tests.
+
+A budget caps the number of SQL queries a block of code runs and the number
+of rows they return, e.g. around a request to a view:
+
+    with self.assertQueryBudget(queries=1, rows=books):
+        self.client.get('/api/book/list/')
+
+Views are also checked at several data sizes, since the query count of a
+view must not grow with the data it reads. Their answers must not come from
+a fallback of their statement timeout, which runs fewer queries.
+"""
+from contextlib import contextmanager
+
+from django.db import connection, connections
+
+from core.db.timeouts import DEGRADED_HEADER
+
+
+# Reviews per user the query budgets are checked at
+DATA_SIZES = (1, 100, 10000)
+
+GENRES = ('Adventure', 'Drama', 'Fantasy', 'Horror', 'Romance')
+
+
+class QueryLog:
+    """
+    An execute wrapper recording the SQL and the number of rows returned
+    by every query.
+
+    Rows are counted from the cursor's rowcount, so rows of named cursors,
+    which are only fetched later, are not counted.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        rows = context['cursor'].rowcount if context['cursor'].description else 0
+        self.queries.append((sql, max(rows, 0)))
+        return result
+
+    @property
+    def rows(self):
+        return sum(rows for _, rows in self.queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __str__(self):
+        return '\n'.join(
+            f'{index}. [{rows} rows] {" ".join(sql.split())}'
+            for index, (sql, rows) in enumerate(self.queries, start=1))
+
+
+class QueryBudgetMixin:
+    """
+    Assertions on the queries run by a TestCase.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, queries, rows):
+        """
+        Fail if the block runs more than `queries` queries or fetches more
+        than `rows` rows in total, listing the queries.
+
+        Yields:
+            QueryLog: The queries run by the block.
+        """
+        log = QueryLog()
+        wrapped = [connections[alias] for alias in connections]
+        for wrapped_connection in wrapped:
+            wrapped_connection.execute_wrappers.append(log)
+        try:
+            yield log
+        finally:
+            for wrapped_connection in wrapped:
+                wrapped_connection.execute_wrappers.remove(log)
+        if len(log) > queries or log.rows > rows:
+            self.fail(
+                f'Query budget of {queries} queries and {rows} rows exceeded: '
+                f'{len(log)} queries fetched {log.rows} rows\n{log}')
+
+    def assertNotDegraded(self, response):
+        """
+        Fail if a response is a fallback of the statement timeout of its
+        view, see core.db.timeouts.
+        """
+        if response.has_header(DEGRADED_HEADER):
+            self.fail(
+                f'The response is degraded to its '
+                f'{response[DEGRADED_HEADER]!r} fallback')
+
+    def assertConstantQueries(self, counts):
+        """
+        Fail if the number of queries differs between data sizes.
+
+        Args:
+            counts (dict): The number of queries by data size.
+        """
+        if len(set(counts.values())) > 1:
+            self.fail(
+                'Query count grows with data size: ' + ', '.join(
+                    f'{count} queries at {size}' for size, count in counts.items()))
+
+
+def create_reviews(user_id, count, first_id, unreviewed=10):
+    """
+    Insert `count` books reviewed by a user and `unreviewed` books they did
+    not review, spread over GENRES.
+
+    The books and reviews get ids from first_id on, leaving the sequences
+    alone. Book i is of genre GENRES[i % len(GENRES)] and its review rated
+    i % 5 + 1. The tables are analyzed, so that plans do not depend on when
+    autovacuum last ran.
+
+    Returns:
+        int: The number of books inserted.
+    """
+    books = count + unreviewed
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO books (id, title, author, genre)
+            SELECT i, 'Book ' || i, 'Author ' || i %% 100,
+                   (%s::varchar[])[i %% %s + 1]
+            FROM generate_series(%s, %s) i
+            """,
+            [list(GENRES), len(GENRES), first_id, first_id + books - 1])
+        cursor.execute(
+            """
+            INSERT INTO reviews (id, book_id, user_id, rating)
+            SELECT i, i, %s, i %% 5 + 1
+            FROM generate_series(%s, %s) i
+            """,
+            [user_id, first_id, first_id + count - 1])
+        cursor.execute('ANALYZE books, reviews')
+    return books
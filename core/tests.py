@@ -0,0 +1,1192 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import psycopg2
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from book.models import Book
+from book.queries import LIST_BOOKS
+from core.caches import LocalCache
+from core.db import aio
+from core.db.aio import AsyncConnectionPool, close_async_pools
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.db.queries import Query, to_positional
+from core.db import slow_queries
+from core.db.slow_queries import SlowQueryLog, get_fingerprint, merge_snapshots
+from core.db.timeouts import (
+    StatementTimeoutExceeded, arun_with_budget, is_statement_timeout,
+    run_with_budget, statement_timeout)
+from core import invalidation, preload, schema
+from core.checks import check_primary_pin_cache
+from core.db.plans import (
+    REFERENCE_DATASET, Sample, check_plans, read_baseline)
+from core.invalidation import (
+    FLUSH, InvalidationListener, get_payloads, notify, parse_payload)
+from core.metrics import (
+    MetricsRegistry, RequestTiming, current_timing, render_metrics)
+from core.singleflight import SingleFlight
+from core.db.routers import (
+    PIN_COOKIE, PrimaryPinMiddleware, PrimaryReplicaRouter, get_read_alias,
+    pin_to_primary)
+from review.models import Review
+from review.serializers import ReviewSerializer
+from core.throttling import (
+    CacheCounterStore, LocalCounterStore, SharedMemoryCounterStore,
+    get_shm_path)
+
+
+class LocalCacheTestCase(SimpleTestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """
+        Test that the least recently used entry is evicted when the cache is
+        full.
+        """
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_entries_expire(self):
+        """
+        Test that entries are not returned after their ttl.
+        """
+        cache = LocalCache(max_size=10, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_stats(self):
+        """
+        Test that hits and misses are counted.
+        """
+        cache = LocalCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+
+        self.assertEqual(cache.stats(), {
+            'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'size': 1})
+
+
+class CounterStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def stores(self):
+        return [
+            LocalCounterStore(),
+            SharedMemoryCounterStore(self.path, slots=64),
+            CacheCounterStore(),
+        ]
+
+    def test_limit(self):
+        """
+        Test that requests beyond the limit are rejected until the sliding
+        window has moved past enough of them.
+        """
+        for store in self.stores():
+            with self.subTest(store=type(store).__name__), \
+                    mock.patch('core.throttling.time.time') as now:
+                key = f'test-limit-{id(store)}'
+                now.return_value = 1000 * 60 + 30
+                self.assertEqual(
+                    [store.hit(key, 60, 3) for _ in range(3)], [0, 0, 0])
+                self.assertEqual(store.hit(key, 60, 3), 30)
+
+                # Halfway through the next window half of the previous
+                # count still applies
+                now.return_value += 60
+                self.assertEqual(
+                    [store.hit(key, 60, 3) for _ in range(2)], [0, 0])
+                self.assertGreater(store.hit(key, 60, 3), 0)
+
+                now.return_value += 120
+                self.assertEqual(store.hit(key, 60, 3), 0)
+
+    def test_check_without_counting(self):
+        """
+        Test that checking a key without counting the request leaves its
+        counters unchanged.
+        """
+        for store in self.stores():
+            with self.subTest(store=type(store).__name__), \
+                    mock.patch('core.throttling.time.time') as now:
+                key = f'test-check-{id(store)}'
+                now.return_value = 1000 * 60 + 30
+                self.assertEqual(
+                    [store.hit(key, 60, 1, count=False) for _ in range(2)],
+                    [0, 0])
+                self.assertEqual(store.hit(key, 60, 1), 0)
+                self.assertGreater(store.hit(key, 60, 1, count=False), 0)
+
+    def test_shared_memory_is_shared(self):
+        """
+        Test that two mappings of the same file share their counters.
+        """
+        first = SharedMemoryCounterStore(self.path, slots=64)
+        second = SharedMemoryCounterStore(self.path, slots=64)
+        self.assertEqual(first.hit('shared', 60, 1), 0)
+        self.assertGreater(second.hit('shared', 60, 1), 0)
+
+
+    def test_cache_counter_expired_before_incr(self):
+        """
+        Test that a cache counter expiring between add() and incr() is
+        counted again instead of failing.
+        """
+        store = CacheCounterStore()
+        self.assertEqual(store.hit('test-expired', 60, 3), 0)
+        with mock.patch(
+                'core.throttling.cache.incr', side_effect=ValueError), \
+                mock.patch(
+                    'core.throttling.cache.add',
+                    side_effect=[False, True]) as add:
+            self.assertEqual(store.hit('test-expired', 60, 3), 0)
+        self.assertEqual(add.call_count, 2)
+
+    def test_default_shm_path(self):
+        """
+        Test that the shared-memory counters default to a file of the
+        temporary directory named after the project.
+        """
+        with self.settings(THROTTLE={**settings.THROTTLE, 'SHM_PATH': ''}):
+            path = get_shm_path()
+        self.assertEqual(os.path.dirname(path), tempfile.gettempdir())
+        self.assertTrue(
+            os.path.basename(path).startswith('book_recommendation_throttle_'))
+        with self.settings(
+                THROTTLE={**settings.THROTTLE, 'SHM_PATH': self.path}):
+            self.assertEqual(get_shm_path(), self.path)
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def connect(self):
+        return psycopg2.connect(**connection.get_connection_params())
+
+    def make_pool(self, **options):
+        pool = ConnectionPool(**{
+            'min_size': 0, 'max_size': 1, 'timeout': 0.05, 'check_idle': 30,
+            'max_lifetime': 3600, **options})
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_reuse_and_timeout(self):
+        """
+        Test that returned connections are reused and that checkouts beyond
+        the maximum size time out.
+        """
+        pool = self.make_pool(timeout=0.2)
+        first = pool.getconn(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(self.connect)
+
+        # Wait for the connection to be returned by another thread
+        returner = threading.Timer(0.02, pool.putconn, [first])
+        returner.start()
+        second = pool.getconn(self.connect)
+        returner.join()
+        self.assertIs(second, first)
+        pool.putconn(second)
+
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreater(stats['max_wait_time'], 0)
+
+    def test_broken_connection_is_replaced(self):
+        """
+        Test that a connection that fails its health check on checkout is
+        replaced by a new one.
+        """
+        pool = self.make_pool(check_idle=0)
+        first = pool.getconn(self.connect)
+        pool.putconn(first)
+
+        # Terminate the backend of the idle connection from another session
+        other = self.connect()
+        with other.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_terminate_backend(%s)', [first.get_backend_pid()])
+        other.close()
+
+        second = pool.getconn(self.connect)
+        self.assertIsNot(second, first)
+        with second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.putconn(second)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+
+    async def test_async_broken_connection_is_replaced(self):
+        """
+        Test that a query on an idle async connection closed by the server
+        runs again on a new connection, and that connections older than the
+        maximum lifetime are not reused.
+        """
+        conn_params = connection.get_connection_params()
+        conn_params.pop('cursor_factory', None)
+        pool = AsyncConnectionPool(conn_params, max_size=1)
+        self.addCleanup(pool.close)
+        self.assertEqual(await pool.fetchall('SELECT 1'), [(1,)])
+        first = pool._idle[0][0]
+
+        # Terminate the backend of the idle connection from another session
+        other = self.connect()
+        with other.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_terminate_backend(%s)', [first.get_backend_pid()])
+        other.close()
+
+        self.assertEqual(await pool.fetchall('SELECT 2'), [(2,)])
+        second = pool._idle[0][0]
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+        pool.max_lifetime = 0
+        self.assertEqual(await pool.fetchall('SELECT 3'), [(3,)])
+        self.assertIsNot(pool._idle[0][0], second)
+        self.assertTrue(second.closed)
+
+class PrimaryReplicaRouterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+
+    def request(self, user_id):
+        return SimpleNamespace(user=SimpleNamespace(id=user_id))
+
+    def test_without_replica(self):
+        """
+        Test that everything goes to the primary when no replica is
+        configured.
+        """
+        with mock.patch('core.db.routers.has_replica', return_value=False):
+            self.assertEqual(get_read_alias(self.request(1)), 'default')
+            self.assertIsNone(self.router.db_for_read(Book))
+
+    def test_reads_are_routed_to_replica(self):
+        """
+        Test that reads of replica apps go to the replica, except in a
+        transaction on the primary, and that writes go to the primary.
+        """
+        with mock.patch('core.db.routers.has_replica', return_value=True):
+            self.assertEqual(self.router.db_for_read(Book), 'replica')
+            self.assertEqual(self.router.db_for_read(Review), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Book), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Book), 'default')
+            self.assertTrue(self.router.allow_migrate('default', 'book'))
+            self.assertFalse(self.router.allow_migrate('replica', 'book'))
+
+    def test_reads_stick_to_primary_after_write(self):
+        """
+        Test that a user who wrote reads from the primary until the sticky
+        window ends, while other users keep reading from the replica.
+        """
+        with mock.patch('core.db.routers.has_replica', return_value=True), \
+                self.settings(DATABASE_REPLICA={
+                    **settings.DATABASE_REPLICA, 'STICKY_SECONDS': 0.2,
+                    'PIN_STORE': 'cache', 'CACHE': 'default'}):
+            self.assertEqual(get_read_alias(self.request(1)), 'replica')
+            pin_to_primary(self.request(1))
+            self.assertEqual(get_read_alias(self.request(1)), 'default')
+            self.assertEqual(get_read_alias(self.request(2)), 'replica')
+            self.assertEqual(get_read_alias(self.request(None)), 'replica')
+            time.sleep(0.3)
+            self.assertEqual(get_read_alias(self.request(1)), 'replica')
+
+    def test_unreachable_pin_cache(self):
+        """
+        Test that reads go to the primary when the cache of pins cannot be
+        reached, and that a write does not fail on it.
+        """
+        pins = mock.Mock()
+        pins.get.side_effect = pins.set.side_effect = ConnectionError
+        with mock.patch('core.db.routers.has_replica', return_value=True), \
+                mock.patch('core.db.routers.get_pin_cache', return_value=pins), \
+                self.settings(DATABASE_REPLICA={
+                    **settings.DATABASE_REPLICA, 'PIN_STORE': 'cache'}), \
+                self.assertLogs('core.db.routers', 'WARNING'):
+            pin_to_primary(self.request(1))
+            self.assertEqual(get_read_alias(self.request(1)), 'default')
+            self.assertEqual(get_read_alias(self.request(None)), 'replica')
+
+    def test_reads_stick_to_primary_with_cookie(self):
+        """
+        Test that a write response sets a pin cookie sending the reads of its
+        user to the primary until the sticky window ends.
+        """
+        factory = RequestFactory()
+
+        def request(user_id, cookies=None):
+            request = factory.get('/')
+            request.user = SimpleNamespace(id=user_id)
+            request.COOKIES.update(cookies or {})
+            return request
+
+        with mock.patch('core.db.routers.has_replica', return_value=True), \
+                mock.patch('django.core.signing.time.time') as now, \
+                self.settings(DATABASE_REPLICA={
+                    **settings.DATABASE_REPLICA, 'STICKY_SECONDS': 5,
+                    'PIN_STORE': 'cookie'}):
+            now.return_value = 1000
+
+            def write(request):
+                pin_to_primary(request)
+                return HttpResponse()
+
+            response = PrimaryPinMiddleware(write)(request(1))
+            cookie = response.cookies[PIN_COOKIE]
+            self.assertEqual(cookie['max-age'], 5)
+            self.assertTrue(cookie['httponly'])
+            cookies = {PIN_COOKIE: cookie.value}
+
+            self.assertEqual(get_read_alias(request(1, cookies)), 'default')
+            self.assertEqual(get_read_alias(request(2, cookies)), 'replica')
+            self.assertEqual(
+                get_read_alias(request(1, {PIN_COOKIE: '1'})), 'replica')
+            now.return_value += 6
+            self.assertEqual(get_read_alias(request(1, cookies)), 'replica')
+
+    def test_pin_cache_check(self):
+        """
+        Test that a replica with pins in a missing cache or one local to the
+        process fails the system check, and that pins in a database cache are
+        warned about.
+        """
+        replica_settings = {
+            **settings.DATABASE_REPLICA, 'PIN_STORE': 'cache', 'CACHE': 'pins'}
+        with mock.patch('core.checks.has_replica', return_value=True), \
+                self.settings(DATABASE_REPLICA=replica_settings):
+            self.assertEqual(
+                [error.id for error in check_primary_pin_cache(None)],
+                ['core.E001'])
+            for backend, errors in [('locmem.LocMemCache', ['core.E001']),
+                                    ('db.DatabaseCache', ['core.W001']),
+                                    ('redis.RedisCache', [])]:
+                with self.settings(CACHES={**settings.CACHES, 'pins': {
+                        'BACKEND': f'django.core.cache.backends.{backend}',
+                        'LOCATION': 'primary_pins'}}):
+                    self.assertEqual(
+                        [error.id for error in check_primary_pin_cache(None)],
+                        errors)
+
+
+class MetricsTestCase(TestCase):
+
+    def test_request_metrics(self):
+        """
+        Test that a request gets a Server-Timing header and is counted in the
+        histograms of its view.
+        """
+        user = User.objects.create(username='metricsuser', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/book/list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, '
+            r'render;dur=[\d.]+, app;dur=[\d.]+, total;dur=[\d.]+$')
+
+        with self.settings(METRICS={**settings.METRICS, 'TOKEN': 'secret'}):
+            metrics = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        labels = 'view="book_list",method="GET",status="200"'
+        self.assertIn(
+            f'http_request_db_queries_bucket{{{labels},le="1"}}', metrics)
+        self.assertRegex(
+            metrics,
+            rf'http_response_serialize_duration_seconds_count{{{labels}}} [1-9]')
+        self.assertRegex(
+            metrics, rf'http_request_duration_seconds_count{{{labels}}} [1-9]')
+        self.assertIn('# TYPE http_response_size_bytes histogram', metrics)
+        self.assertIn('local_cache_hits_total{cache="jwt_token"}', metrics)
+
+    def test_metrics_access(self):
+        """
+        Test that the metrics require the token when one is set, and a staff
+        user otherwise.
+        """
+        with self.settings(METRICS={**settings.METRICS, 'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+            self.assertEqual(self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+        with self.settings(METRICS={**settings.METRICS, 'TOKEN': ''}):
+            user = User.objects.create(username='metricsuser', password='x')
+            self.client.force_login(user)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            user.is_superuser = True
+            user.save()
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_serialize_time(self):
+        """
+        Test that nested serializers are timed once, without their queries.
+        """
+        user = User.objects.create(username='metricsuser', password='x')
+        book = Book.objects.create(title='Title', author='Author', genre='Genre')
+        Review.objects.create(user=user, book=book, rating=4)
+        reviews = Review.objects.all()
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        self.addCleanup(current_timing.reset, token)
+        # Every reading of the clock takes a second
+        with mock.patch('time.perf_counter', side_effect=itertools.count()):
+            data = ReviewSerializer(reviews, many=True).data
+        self.assertEqual(data[0]['book']['title'], 'Title')
+        # The reviews, then the book and user of the nested serializers
+        self.assertEqual(timing.queries, 3)
+        self.assertEqual(timing.db_time, 3)
+        # Two readings per query, and one at each end of the list
+        self.assertEqual(timing.serialize_time, 7 - 3)
+        self.assertFalse(timing.serializing)
+
+    async def test_request_metrics_asgi(self):
+        """
+        Test that under ASGI the queries of a sync view, run in a thread, are
+        counted.
+        """
+        user = await User.objects.acreate(username='metricsuser', password='x')
+        token = AccessToken.for_user(user)
+        response = await self.async_client.get(
+            '/api/book/list/', AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        # The user and the books, after the revocation list when it is
+        # refreshed
+        self.assertRegex(
+            response['Server-Timing'], r'^db;dur=[\d.]+;desc="[23] queries"')
+
+    def test_workers_are_merged(self):
+        """
+        Test that the files of all workers are merged, and that gauges of
+        workers that exited are dropped.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry = MetricsRegistry(directory, flush_interval=60)
+        labels = (('view', 'book_list'), ('method', 'GET'), ('status', 200))
+        registry.observe_request(labels, [('http_request_db_queries', 2)])
+        registry.flush(force=True)
+        # A worker that exited
+        exited = registry.snapshot()
+        exited['pid'] = 2 ** 31 - 1
+        exited['samples'] = [
+            ['db_pool_connections', 'gauge', 'Pooled connections.', [], 3],
+            ['db_pool_checkouts_total', 'counter', 'Checkouts.', [], 5],
+        ]
+
+        metrics = render_metrics(registry.collect() + [exited])
+        prefix = 'http_request_db_queries'
+        labels = 'view="book_list",method="GET",status="200"'
+        self.assertIn(f'{prefix}_bucket{{{labels},le="1"}} 0\n', metrics)
+        self.assertIn(f'{prefix}_bucket{{{labels},le="2"}} 2\n', metrics)
+        self.assertIn(f'{prefix}_bucket{{{labels},le="+Inf"}} 2\n', metrics)
+        self.assertIn(f'{prefix}_sum{{{labels}}} 4\n', metrics)
+        self.assertIn('db_pool_checkouts_total 5\n', metrics)
+        self.assertNotIn('db_pool_connections ', metrics)
+
+
+class DatasetTestCase(TransactionTestCase):
+
+    def generate(self, **options):
+        call_command(
+            'generate_dataset', users=20, books=50, reviews=300, genres=4,
+            prefix='test-dataset', stdout=io.StringIO(), **options)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT u.username, b.title, r.rating FROM reviews r
+                JOIN users u ON u.id = r.user_id JOIN books b ON b.id = r.book_id
+                ORDER BY u.username, b.title
+                """)
+            return cursor.fetchall()
+
+    def test_generate_dataset(self):
+        """
+        Test that the dataset has the requested size, that users review a
+        book at most once and that a seed generates the same dataset.
+        """
+        reviews = self.generate(seed=1)
+        self.assertEqual(User.objects.filter(username__startswith='test-dataset-').count(), 20)
+        self.assertEqual(Book.objects.filter(title__startswith='test-dataset book ').count(), 50)
+        self.assertEqual(Book.objects.values('genre').distinct().count(), 4)
+        self.assertLessEqual(len(reviews), 300)
+        self.assertGreater(len(reviews), 250)
+        self.assertEqual(len({(user, book) for user, book, _ in reviews}), len(reviews))
+
+        self.assertEqual(self.generate(seed=1, clear=True), reviews)
+        self.assertNotEqual(self.generate(seed=2, clear=True), reviews)
+
+    def test_bench(self):
+        """
+        Test that the bench reports every endpoint and removes the reviews
+        it creates.
+        """
+        self.generate()
+        before = Review.objects.count()
+        stdout = io.StringIO()
+        call_command(
+            'bench', prefix='test-dataset', duration=0.2, concurrency=2,
+            endpoints='book_list,user_reviews,suggest,add_review,update_review',
+            stdout=stdout, stderr=io.StringIO())
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(list(report['endpoints']), [
+            'book_list', 'user_reviews', 'suggest', 'add_review', 'update_review'])
+        for result in report['endpoints'].values():
+            self.assertGreater(result['requests'], 0)
+            self.assertEqual(result['errors'], 0, report)
+            self.assertLessEqual(result['p50'], result['p99'])
+        self.assertEqual(Review.objects.count(), before)
+
+
+class SchemaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(OPENAPI_SCHEMA={'DIR': directory, 'MAX_AGE': 60})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Schemas loaded by other tests
+        self.addCleanup(schema._schemas.clear)
+        schema._schemas.clear()
+
+    def test_artifact(self):
+        """
+        Test that the artifact of generate_schema is served with an ETag, and
+        that a request with that ETag gets a 304.
+        """
+        call_command('generate_schema', stdout=io.StringIO())
+        with open(schema.get_schema_path('.json'), 'rb') as file:
+            content = file.read()
+        self.assertIn('/book/', json.loads(content)['paths'])
+
+        response = self.client.get('/swagger.json/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        response = self.client.get(
+            '/swagger.json/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/swagger.yaml/')
+        self.assertEqual(response['Content-Type'], 'application/yaml')
+        self.assertEqual(self.client.get('/swagger.xml/').status_code, 404)
+
+    def test_without_artifact(self):
+        """
+        Test that the schema is generated when there is no artifact.
+        """
+        response = self.client.get('/swagger.json/')
+        self.assertEqual(response.status_code, 200)
+        parameters = json.loads(response.content)['paths']['/book/']['get']['parameters']
+        self.assertEqual(parameters[0]['name'], 'genre')
+        self.assertEqual(parameters[0]['in'], 'query')
+
+    def test_ui(self):
+        """
+        Test that the Swagger UI and ReDoc pages load the precomputed schema,
+        without generating it on any request.
+        """
+        with mock.patch(
+                'drf_yasg.generators.OpenAPISchemaGenerator.get_schema') as get_schema:
+            for url in ['/swagger/', '/redoc/', '/swagger/']:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+                self.assertIn('/swagger.json/', response.content.decode())
+        get_schema.assert_not_called()
+
+
+class PreloadTestCase(SimpleTestCase):
+
+    def test_preload(self):
+        """
+        Test that preload runs the registered hooks and freezes the objects
+        of the process.
+        """
+        hook = mock.Mock(__module__='tests', __qualname__='hook')
+        preload.register_preload(hook)
+        self.addCleanup(preload._hooks.remove, hook)
+
+        with mock.patch('gc.freeze') as freeze:
+            timings = preload.preload()
+        hook.assert_called_once_with()
+        freeze.assert_called_once_with()
+        self.assertEqual(list(timings), [
+            'urls', 'settings', 'models', 'serializers', 'translations',
+            'tests.hook', 'freeze'])
+
+    def test_profile_startup(self):
+        """
+        Test that the startup profile has the phases, apps and imports.
+        """
+        stdout = io.StringIO()
+        call_command('profile_startup', '--json', '--top', '5', stdout=stdout)
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(list(report['phases']), [
+            'settings', 'apps', 'middleware', 'urlconf', 'total'])
+        self.assertEqual(
+            set(report['apps'].get('book', {})), {'import', 'models', 'ready'})
+        self.assertIn('django', report['packages'])
+        self.assertEqual(len(report['modules']), 5)
+
+
+BOOK_TITLE = Query(
+    'tests.book_title', "SELECT title || '%%' FROM books WHERE id = %s")
+
+
+class QueryTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(
+            title='Query Title', author='Query Author', genre='Query Genre')
+
+    def prepared_statements(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name FROM pg_prepared_statements')
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_to_positional(self):
+        self.assertEqual(
+            to_positional("SELECT '%%' WHERE a = %s AND b = ANY(%s)"),
+            ("SELECT '%' WHERE a = $1 AND b = ANY($2)", 2))
+
+    def test_prepared(self):
+        """
+        Test that a query is prepared once per connection, and that its
+        calls, time and rows are counted.
+        """
+        calls = BOOK_TITLE.calls
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(BOOK_TITLE.fetchone([self.book.id]), ('Query Title%',))
+            self.assertEqual(BOOK_TITLE.fetchall([0]), [])
+
+        self.assertIn(BOOK_TITLE.statement, self.prepared_statements())
+        self.assertEqual(
+            [query['sql'] for query in queries],
+            [f'EXECUTE tests_book_title({self.book.id})', 'EXECUTE tests_book_title(0)'])
+        self.assertEqual(BOOK_TITLE.calls, calls + 2)
+
+        stdout = io.StringIO()
+        call_command('query_stats', '--json', stdout=stdout, stderr=io.StringIO())
+        stats = {row['query']: row for row in json.loads(stdout.getvalue())}
+        self.assertEqual(stats['tests.book_title']['calls'], BOOK_TITLE.calls)
+
+    def test_not_prepared(self):
+        """
+        Test that queries run as they are without PREPARE.
+        """
+        with mock.patch.dict(connection.settings_dict, PREPARE=False):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(
+                    BOOK_TITLE.fetchone([self.book.id]), ('Query Title%',))
+        self.assertIn('FROM books WHERE id =', queries[0]['sql'])
+
+
+class PlanTestCase(TransactionTestCase):
+
+    def setUp(self):
+        call_command(
+            'generate_dataset', stdout=io.StringIO(), **REFERENCE_DATASET)
+
+    def test_plans(self):
+        """
+        Test that the plans of the named queries meet their expectations and
+        match the baseline on the reference dataset.
+        """
+        stdout = io.StringIO()
+        call_command('check_plans', '--fail-on-diff', stdout=stdout)
+        self.assertIn('suggest.unreviewed_books', stdout.getvalue())
+
+    def test_regression(self):
+        """
+        Test that a plan reading every review instead of using the user_id
+        index is reported, with a diff against the baseline.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SET enable_indexscan = off; SET enable_indexonlyscan = off; '
+                'SET enable_bitmapscan = off')
+        try:
+            results = check_plans(
+                Sample(REFERENCE_DATASET['prefix']), baseline=read_baseline())
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET ALL')
+        result = {result['query']: result for result in results}[
+            'suggest.unreviewed_books']
+        self.assertIn('sequential scan on reviews', result['violations'])
+        self.assertIn('index reviews(user_id) not used', result['violations'])
+        self.assertIn(
+            '-  hashed SubPlan 1: Index Scan using reviews(user_id) on reviews',
+            result['diff'])
+
+
+class SlowQueryTestCase(TestCase):
+
+    def test_fingerprint(self):
+        """
+        Test that literals, placeholders and lists are stripped, and that
+        prepared statements get the fingerprint of their query.
+        """
+        fingerprint, sql, name = get_fingerprint(
+            "SELECT * FROM books WHERE genre = 'Fiction' AND id IN (1, 2, 3)")
+        self.assertEqual(sql, 'SELECT * FROM books WHERE genre = ? AND id IN (...)')
+        self.assertIsNone(name)
+        self.assertEqual(
+            get_fingerprint(
+                "SELECT  *  FROM books WHERE genre = 'it''s' AND id IN (%s)")[0],
+            fingerprint)
+        self.assertEqual(
+            get_fingerprint(f'EXECUTE {BOOK_TITLE.statement}(%s)'),
+            get_fingerprint(BOOK_TITLE.sql)[:2] + ('tests.book_title',))
+
+    def test_sampling(self):
+        """
+        Test that fast queries are only recorded when sampled, and the
+        aggregates of the workers merged.
+        """
+        log = SlowQueryLog(threshold=0.1, sample_rate=0)
+        log.record('SELECT 1', 0.01, 'view')
+        self.assertEqual(log.snapshot()['fingerprints'], [])
+        for duration in (0.2, 0.4):
+            log.record('SELECT 2', duration, 'view')
+        other = SlowQueryLog(threshold=0.1, sample_rate=1)
+        other.record('SELECT 3', 0.05, 'other')
+
+        [stats] = merge_snapshots([log.snapshot(), other.snapshot()])
+        self.assertEqual(stats['sql'], 'SELECT ?')
+        self.assertEqual(
+            (stats['count'], stats['slow'], stats['max'], stats['p99']),
+            (3, 2, 0.4, 0.4))
+        self.assertAlmostEqual(stats['total'], 0.65)
+        self.assertEqual(stats['views'], {'view': 2, 'other': 1})
+
+    def test_slow_queries(self):
+        """
+        Test that the queries of requests are written to the log file and
+        shown to administrators with their view.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        options = {
+            **settings.SLOW_QUERIES, 'ENABLED': True, 'THRESHOLD': 0,
+            'DIR': directory}
+        user = User.objects.create(username='slowuser', password='x')
+        admin = User.objects.create(
+            username='slowadmin', password='x', is_superuser=True)
+        with override_settings(SLOW_QUERIES=options), \
+                mock.patch.multiple(slow_queries, _log=None, _log_pid=None):
+            client = APIClient()
+            client.force_authenticate(user)
+            self.assertEqual(client.get('/api/book/list/').status_code, 200)
+            self.assertEqual(client.get('/api/slow-queries/').status_code, 403)
+            client.force_authenticate(admin)
+            response = client.get('/api/slow-queries/')
+
+        self.assertEqual(response.status_code, 200)
+        stats = {
+            stats['query']: stats for stats in response.json()['fingerprints']}
+        self.assertEqual(stats['book.list']['views'], {'book_list': 1})
+        self.assertEqual(stats['book.list']['sql'], LIST_BOOKS.sql)
+        with open(os.path.join(directory, f'{os.getpid()}.log')) as file:
+            lines = [json.loads(line) for line in file]
+        self.assertIn(
+            ('book.list', 'book_list', True),
+            [(line['query'], line['view'], line['slow']) for line in lines])
+
+    async def test_slow_queries_asgi(self):
+        """
+        Test that under ASGI the queries of a sync view, run in a thread, are
+        recorded with their view.
+        """
+        options = {**settings.SLOW_QUERIES, 'ENABLED': True, 'THRESHOLD': 0}
+        user = await User.objects.acreate(username='slowuser', password='x')
+        token = AccessToken.for_user(user)
+        with override_settings(SLOW_QUERIES=options), \
+                mock.patch.multiple(slow_queries, _log=None, _log_pid=None):
+            response = await self.async_client.get(
+                '/api/book/list/', AUTHORIZATION=f'Bearer {token}')
+            snapshot = slow_queries.get_slow_query_log().snapshot()
+
+        self.assertEqual(response.status_code, 200)
+        stats = {stats['query']: stats for stats in snapshot['fingerprints']}
+        self.assertEqual(stats['book.list']['views'], {'book_list': 1})
+
+
+class SingleFlightTestCase(TransactionTestCase):
+
+    def run_concurrently(self, flight, key, count):
+        calls = []
+        started = threading.Barrier(count)
+        release = threading.Event()
+
+        def compute():
+            calls.append(key)
+            release.wait(5)
+            return [key]
+
+        def call():
+            started.wait(5)
+            results.append(flight.do(key, compute))
+
+        results = []
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # Let the followers find the flight of the leader
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return calls, results
+
+    def test_do(self):
+        """
+        Test that concurrent callers with the same key share one computation,
+        and that a failure is raised to every caller.
+        """
+        flight = SingleFlight('tests.do')
+        calls, results = self.run_concurrently(flight, 'key', 4)
+        self.assertEqual(calls, ['key'])
+        self.assertEqual(results, [['key']] * 4)
+        self.assertIs(results[0], results[3])
+        self.assertEqual((flight.calls, flight.shared), (4, 3))
+        # The next call computes again
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('error', lambda: 1 / 0)
+
+    def test_ado(self):
+        """
+        Test that concurrent coroutines with the same key share one
+        computation, unless the leader is cancelled.
+        """
+        flight = SingleFlight('tests.ado')
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def main():
+            results = await asyncio.gather(
+                *[flight.ado('key', compute) for _ in range(3)])
+            leader = asyncio.ensure_future(flight.ado('cancelled', compute))
+            follower = asyncio.ensure_future(flight.ado('cancelled', compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return results, await follower
+
+        results, follower = asyncio.run(main())
+        self.assertEqual(results, [1, 1, 1])
+        self.assertEqual(follower, 3)
+
+    def test_advisory_locks(self):
+        """
+        Test that leaders of different processes, here different SingleFlight
+        with the same name, compute once and share the result through the
+        cache.
+        """
+        options = {**settings.SINGLE_FLIGHT, 'ADVISORY_LOCKS': True}
+        first, second = SingleFlight('tests.locks'), SingleFlight('tests.locks')
+        calls = []
+        results = {}
+
+        def compute():
+            calls.append(1)
+            # Let the other leader wait for the advisory lock
+            time.sleep(0.2)
+            return 'result'
+
+        def call(flight):
+            try:
+                results[flight] = flight.do('key', compute)
+            finally:
+                connection.close()
+
+        with override_settings(SINGLE_FLIGHT=options):
+            threads = [threading.Thread(target=call, args=[first])]
+            threads[0].start()
+            time.sleep(0.05)
+            threads.append(threading.Thread(target=call, args=[second]))
+            threads[1].start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, {first: 'result', second: 'result'})
+            self.assertEqual(calls, [1])
+            self.assertEqual(second.shared, 1)
+
+            # A later call computes again
+            self.assertEqual(second.do('key', lambda: 'new'), 'new')
+
+
+def current_statement_timeout():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW statement_timeout')
+        return cursor.fetchone()[0]
+
+
+def sleep(seconds=5):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_sleep(%s)', [seconds])
+
+
+class StatementTimeoutTestCase(TestCase):
+
+    def test_in_transaction(self):
+        """
+        Test that a cancelled query leaves the transaction usable, and that
+        the previous timeout is restored.
+        """
+        previous = current_statement_timeout()
+        start = time.monotonic()
+        with self.assertRaises(OperationalError) as raised:
+            with statement_timeout(0.05):
+                sleep()
+        self.assertTrue(is_statement_timeout(raised.exception))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(current_statement_timeout(), previous)
+
+        with statement_timeout(2):
+            self.assertEqual(current_statement_timeout(), '2s')
+        self.assertEqual(current_statement_timeout(), previous)
+
+    def test_fallbacks(self):
+        """
+        Test that fallbacks are tried in order until one returns a result,
+        and that the endpoint answers 503 when none does.
+        """
+        budgets = {'test': 0.05}
+        with override_settings(STATEMENT_TIMEOUTS={
+                **settings.STATEMENT_TIMEOUTS, 'BUDGETS': budgets,
+                'FALLBACK_BUDGET': 0.05}), \
+                self.assertLogs('core.db.timeouts', 'WARNING') as logs:
+            self.assertEqual(
+                run_with_budget('test', 'default', lambda: 'fresh'),
+                ('fresh', None))
+            self.assertEqual(
+                run_with_budget('test', 'default', sleep, fallbacks=[
+                    ('slow', sleep), ('none', lambda: None),
+                    ('stale', lambda: 'stale')]),
+                ('stale', 'stale'))
+            with self.assertRaises(StatementTimeoutExceeded):
+                run_with_budget('test', 'default', sleep, [('slow', sleep)])
+        self.assertIn(
+            'WARNING:core.db.timeouts:The slow fallback of test timed out',
+            logs.output)
+
+
+class AsyncStatementTimeoutTestCase(SimpleTestCase):
+    databases = {'default'}
+
+    def tearDown(self):
+        close_async_pools()
+
+    async def test_fallbacks(self):
+        """
+        Test that async fallbacks are tried in order under their own timeout
+        until one returns a result, and that StatementTimeoutExceeded is
+        raised when none does.
+        """
+        async def asleep(seconds=5):
+            await aio.fetchall('SELECT pg_sleep(%s)', [seconds])
+
+        with override_settings(STATEMENT_TIMEOUTS={
+                **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'test': 0.05},
+                'FALLBACK_BUDGET': 0.05}), \
+                self.assertLogs('core.db.timeouts', 'WARNING'):
+            start = time.monotonic()
+            self.assertEqual(
+                await arun_with_budget('test', asleep, fallbacks=[
+                    ('slow', asleep), ('none', lambda: None),
+                    ('stale', lambda: 'stale')]),
+                ('stale', 'stale'))
+            self.assertLess(time.monotonic() - start, 2)
+            with self.assertRaises(StatementTimeoutExceeded):
+                await arun_with_budget('test', asleep, [('slow', asleep)])
+
+
+class AutocommitStatementTimeoutTestCase(TransactionTestCase):
+
+    def test_restored(self):
+        """
+        Test that the session timeout is restored after a cancelled query.
+        """
+        previous = current_statement_timeout()
+        with self.assertRaises(OperationalError):
+            with statement_timeout(0.05):
+                self.assertEqual(current_statement_timeout(), '50ms')
+                sleep()
+        self.assertEqual(current_statement_timeout(), previous)
+
+
+class InvalidationTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.books = LocalCache(max_size=10, ttl=60)
+        self.suggestions = LocalCache(max_size=10, ttl=60)
+        patcher = mock.patch.object(invalidation, '_caches', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        invalidation.register_cache(self.books, entities=['book'])
+        invalidation.register_cache(
+            self.suggestions, entities=['book'], by_id=['review'])
+        self.fill()
+
+    def fill(self):
+        self.books.set(None, ['book'])
+        for user_id in (1, 2):
+            self.suggestions.set(user_id, ['suggestion'])
+
+    def start_listener(self):
+        conn_params = connection.get_connection_params()
+        conn_params.pop('cursor_factory', None)
+        listener = InvalidationListener(
+            conn_params, settings.INVALIDATION['CHANNEL'],
+            reconnect_interval=0.05)
+        listener.start()
+        self.addCleanup(listener.stop, 5)
+        self.assertTrue(listener.connected.wait(5))
+        # Flushed once listening
+        self.assertEqual(len(self.books), 0)
+        self.fill()
+        return listener
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_payloads(self):
+        """
+        Test that long lists of ids are split into payloads that fit a
+        NOTIFY, and that payloads decode to the entity and ids.
+        """
+        payloads = get_payloads('review', range(100000, 102000))
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) < 8000 for payload in payloads))
+        ids = []
+        for payload in payloads:
+            entity, payload_ids = parse_payload(payload)
+            self.assertEqual(entity, 'review')
+            ids += payload_ids
+        self.assertEqual(ids, list(range(100000, 102000)))
+        self.assertEqual(get_payloads('book'), ['book:'])
+        self.assertEqual(parse_payload('book:'), ('book', None))
+        self.assertEqual(parse_payload(FLUSH), (FLUSH, None))
+
+    def test_invalidate(self):
+        """
+        Test that changes delete the entries of their ids or clear the caches
+        depending on their entity.
+        """
+        invalidation.invalidate('review', [1])
+        self.assertIsNone(self.suggestions.get(1))
+        self.assertIsNotNone(self.suggestions.get(2))
+        self.assertIsNotNone(self.books.get(None))
+        invalidation.invalidate('user', [2])
+        self.assertIsNotNone(self.suggestions.get(2))
+        invalidation.invalidate('book', [3])
+        self.assertEqual((len(self.books), len(self.suggestions)), (0, 0))
+        self.fill()
+        invalidation.invalidate(FLUSH)
+        self.assertEqual((len(self.books), len(self.suggestions)), (0, 0))
+
+    def test_listener(self):
+        """
+        Test that notifications of other connections are applied to the
+        caches, only once their transaction commits.
+        """
+        self.start_listener()
+        with psycopg2.connect(**connection.get_connection_params()) as other:
+            other.autocommit = True
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_notify(%s, %s)',
+                    [settings.INVALIDATION['CHANNEL'], 'review:1'])
+        self.assertTrue(self.wait_for(lambda: 1 not in self.suggestions._entries))
+        self.assertIsNotNone(self.suggestions.get(2))
+
+        with override_settings(INVALIDATION={
+                **settings.INVALIDATION, 'ENABLED': True}):
+            with transaction.atomic():
+                notify('book', [1])
+                time.sleep(0.1)
+                self.assertIsNotNone(self.books.get(None))
+        self.assertTrue(self.wait_for(lambda: not len(self.suggestions)))
+        self.assertEqual(len(self.books), 0)
+
+    def test_reconnect(self):
+        """
+        Test that the caches are flushed when the connection of the listener
+        drops, and that it listens again.
+        """
+        listener = self.start_listener()
+        backend_pid = listener._connection.get_backend_pid()
+        with self.assertLogs('core.invalidation', 'WARNING'):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(%s)', [backend_pid])
+            self.assertTrue(self.wait_for(lambda: not len(self.books)))
+        self.assertEqual(len(self.suggestions), 0)
+        self.assertTrue(self.wait_for(
+            lambda: listener.connected.is_set()
+            and listener._connection.get_backend_pid() != backend_pid))
+
+        self.fill()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [settings.INVALIDATION['CHANNEL'], 'book:'])
+        self.assertTrue(self.wait_for(lambda: not len(self.books)))
@@ -0,0 +1,335 @@
+"""
+Sliding-window request throttling.
+
+A request is allowed while the estimated number of requests in the last
+`window` seconds stays below the limit. The estimate weighs the count of the
+previous fixed window by how much of it still overlaps the sliding one:
+
+    previous * (1 - elapsed / window) + current
+
+so each key only needs two counters. Rejected requests are not counted.
+Throttles of events other than requests, like failed logins, check the
+counters without counting the request and count the events themselves.
+
+The counters are kept in one of three stores, chosen by THROTTLE['BACKEND']:
+
+    shm     a hash table in a memory-mapped file shared by every worker of
+            a host, the default, by default in the temporary directory
+            under a name unique to the project and settings module
+    cache   the default Django cache, shared across hosts
+    local   a dict in the process, for tests and single-process runs since
+            each worker would allow the full rate
+
+The bench_throttle command measures the cost of a check with each store.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+
+def sliding_window(previous, current, elapsed, window, limit):
+    """
+    Decide whether one more request fits in the sliding window.
+
+    Returns:
+        float: 0 if the request is allowed, else the seconds to wait until
+            it would be.
+    """
+    estimate = previous * (1 - elapsed / window) + current
+    if estimate < limit:
+        return 0
+    if current >= limit:
+        return window - elapsed
+    # The share of the previous window shrinks linearly until the count fits
+    return max(0.001, min(
+        window - elapsed, (estimate - limit) / previous * window))
+
+
+class LocalCounterStore:
+    """
+    Counters in a dict of the current process, as lists of the current
+    window index, the previous and current counts and the window size.
+    Keys whose windows have passed are dropped once there are more than
+    `max_keys` of them.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, window, limit, count=True):
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        with self.lock:
+            if len(self.counters) > self.max_keys:
+                self.counters = {
+                    name: counter for name, counter in self.counters.items()
+                    if counter[0] >= now // counter[3] - 1}
+            counter = self.counters.get(key)
+            if counter is None or counter[0] < index - 1:
+                counter = self.counters[key] = [index, 0, 0, window]
+            elif counter[0] == index - 1:
+                counter[:] = [index, counter[2], 0, window]
+            wait = sliding_window(counter[1], counter[2], elapsed, window, limit)
+            if count and not wait:
+                counter[2] += 1
+        return wait
+
+
+class SharedMemoryCounterStore:
+    """
+    Counters in a memory-mapped file shared by the processes of a host.
+
+    The file is a hash table of `slots` slots of 24 bytes: an 8 byte key
+    digest, the 8 byte index of the current window and two 4 byte counts.
+    Keys are hashed to a group of GROUP slots; a key that finds no free slot
+    in its group takes over the one with the oldest window. Each group is
+    guarded by a lock on its byte range of the file, plus a thread lock since
+    file locks do not exclude threads of the same process.
+    """
+    SLOT = struct.Struct('<QqII')
+    GROUP = 8
+
+    def __init__(self, path, slots):
+        self.groups = max(1, slots // self.GROUP)
+        size = self.groups * self.GROUP * self.SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.lock = threading.Lock()
+
+    def hit(self, key, window, limit, count=True):
+        digest = int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        group_size = self.GROUP * self.SLOT.size
+        start = digest % self.groups * group_size
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        index = int(index)
+
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, group_size, start)
+            try:
+                offset = oldest = None
+                for slot in range(start, start + group_size, self.SLOT.size):
+                    slot_digest, slot_index, _, _ = self.SLOT.unpack_from(
+                        self.map, slot)
+                    if slot_digest == digest:
+                        offset = slot
+                        break
+                    if oldest is None or slot_index < oldest[1]:
+                        oldest = (slot, slot_index)
+
+                if offset is None:
+                    if not count:
+                        # Do not take over a slot just to check
+                        return 0
+                    offset, previous, current = oldest[0], 0, 0
+                else:
+                    _, slot_index, previous, current = self.SLOT.unpack_from(
+                        self.map, offset)
+                    if slot_index < index - 1:
+                        previous, current = 0, 0
+                    elif slot_index == index - 1:
+                        previous, current = current, 0
+
+                wait = sliding_window(previous, current, elapsed, window, limit)
+                self.SLOT.pack_into(
+                    self.map, offset, digest, index, previous,
+                    current + (count and not wait))
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, group_size, start)
+        return wait
+
+
+class CacheCounterStore:
+    """
+    Counters in the default Django cache, one key per key and window.
+
+    The check and the increment are separate cache calls, so concurrent
+    requests may slightly exceed the limit.
+    """
+
+    def hit(self, key, window, limit, count=True):
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        index = int(index)
+        current_key = f'throttle:{key}:{index}'
+        counts = cache.get_many([f'throttle:{key}:{index - 1}', current_key])
+        wait = sliding_window(
+            counts.get(f'throttle:{key}:{index - 1}', 0),
+            counts.get(current_key, 0), elapsed, window, limit)
+        if count and not wait:
+            timeout = 2 * window + 1
+            if not cache.add(current_key, 1, timeout=timeout):
+                try:
+                    cache.incr(current_key)
+                except ValueError:
+                    # Expired or evicted since add()
+                    cache.add(current_key, 1, timeout=timeout)
+        return wait
+
+
+def get_shm_path():
+    """
+    Get the file of the shared-memory counters, THROTTLE['SHM_PATH'] or a
+    file of the temporary directory named after the project directory and
+    settings module, so that deployments of a host do not share counters.
+    """
+    if settings.THROTTLE['SHM_PATH']:
+        return settings.THROTTLE['SHM_PATH']
+    suffix = hashlib.blake2b(
+        f'{settings.BASE_DIR}:{settings.SETTINGS_MODULE}'.encode(),
+        digest_size=8).hexdigest()
+    return os.path.join(
+        tempfile.gettempdir(), f'book_recommendation_throttle_{suffix}')
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_counter_store():
+    """
+    Get the counter store of the current process, see THROTTLE['BACKEND'].
+    """
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store_pid != pid:
+        with _store_lock:
+            if _store_pid != pid:
+                backend = settings.THROTTLE['BACKEND']
+                if backend == 'shm':
+                    _store = SharedMemoryCounterStore(
+                        get_shm_path(), settings.THROTTLE['SHM_SLOTS'])
+                elif backend == 'cache':
+                    _store = CacheCounterStore()
+                else:
+                    _store = LocalCounterStore()
+                _store_pid = pid
+    return _store
+
+
+@receiver(setting_changed)
+def reset_counter_store(setting, **kwargs):
+    """
+    Create the counter store again when THROTTLE changes, e.g. in tests.
+    """
+    global _store_pid
+    if setting == 'THROTTLE':
+        _store_pid = None
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Throttle requests per `scope` with the rate in THROTTLE['RATES'].
+
+    Rates are given like DRF's, e.g. '30/min'; an empty rate disables the
+    throttle. Subclasses set `scope` and get_ident_key(). Unless
+    `count_requests` is set, allowed requests are not counted, and views
+    count the events to throttle with record().
+    """
+    scope = None
+    count_requests = True
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self):
+        rate = settings.THROTTLE['RATES'].get(self.scope)
+        if rate:
+            limit, period = rate.split('/')
+            self.limit = int(limit)
+            self.window = self.durations[period[0]]
+        else:
+            self.limit = None
+        self.wait_time = None
+
+    def get_ident_key(self, request, view):
+        """
+        Get what to count requests by, or None to not throttle the request.
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if self.limit is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+        self.wait_time = get_counter_store().hit(
+            f'{self.scope}:{ident}', self.window, self.limit,
+            count=self.count_requests)
+        return not self.wait_time
+
+    def record(self, request, view):
+        """
+        Count an event of the request against the rate.
+        """
+        if self.limit is None:
+            return
+        ident = self.get_ident_key(request, view)
+        if ident is not None:
+            get_counter_store().hit(
+                f'{self.scope}:{ident}', self.window, self.limit)
+
+    def wait(self):
+        return self.wait_time
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class UserRateThrottle(SlidingWindowThrottle):
+    """
+    Throttle authenticated users by id and anonymous requests by IP.
+    """
+
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return self.get_ident(request)
+
+
+class LoginIPRateThrottle(IPRateThrottle):
+    scope = 'login_ip'
+
+
+class LoginUsernameRateThrottle(SlidingWindowThrottle):
+    """
+    Throttle failed login attempts per username and IP, which the login view
+    records. Counting every attempt per username alone would let anyone lock
+    an account out by sending attempts for it; here failures only throttle
+    the IP they come from, and successful logins never count.
+    """
+    scope = 'login_username'
+    count_requests = False
+
+    def get_ident_key(self, request, view):
+        username = request.data.get('username')
+        if not isinstance(username, str) or not username:
+            return None
+        return f'{self.get_ident(request)}:{username}'
+
+
+class ReviewRateThrottle(UserRateThrottle):
+    scope = 'review'
+
+
+class SuggestRateThrottle(UserRateThrottle):
+    scope = 'suggest'
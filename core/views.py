@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+
+from core.db.slow_queries import get_slow_query_log, merge_snapshots
+from core.metrics import get_registry, render_metrics
+from core.schema import get_schema, render_ui
+
+
+def metrics(request):
+    """
+    Expose the metrics of all workers in the Prometheus text format, to
+    scrapers sending METRICS['TOKEN'] as a bearer token, or to staff users
+    logged in to the admin when no token is set.
+
+    Returns:
+        HttpResponse: The merged histograms and samples.
+
+    Raises:
+        PermissionDenied: If the request is not allowed to scrape.
+    """
+    token = settings.METRICS['TOKEN']
+    if token:
+        allowed = constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        raise PermissionDenied
+    return HttpResponse(
+        render_metrics(get_registry().collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def slow_queries(request):
+    """
+    Expose the slow and sampled queries of all workers to administrators,
+    by fingerprint, see core.db.slow_queries.
+
+    Returns:
+        Response: The stats of each fingerprint, by total duration.
+    """
+    return Response({
+        'enabled': settings.SLOW_QUERIES['ENABLED'],
+        'threshold': settings.SLOW_QUERIES['THRESHOLD'],
+        'sample_rate': settings.SLOW_QUERIES['SAMPLE_RATE'],
+        'fingerprints': merge_snapshots(get_slow_query_log().collect()),
+    })
+
+
+def schema_etag(request, format):
+    schema = get_schema(format)
+    return schema.etag if schema else None
+
+
+@condition(etag_func=schema_etag)
+def schema(request, format):
+    """
+    Serve the precomputed OpenAPI schema, see core.schema. Requests with the
+    ETag of the current schema in If-None-Match get a 304.
+
+    Returns:
+        HttpResponse: The schema in JSON or YAML, depending on the format.
+    """
+    artifact = get_schema(format)
+    if artifact is None:
+        raise Http404
+    response = HttpResponse(artifact.content, content_type=artifact.content_type)
+    patch_cache_control(
+        response, public=True, max_age=settings.OPENAPI_SCHEMA['MAX_AGE'])
+    return response
+
+
+def schema_ui(request, renderer):
+    """
+    Render the Swagger UI or ReDoc page of the schema, see
+    core.schema.render_ui().
+    """
+    content = render_ui(request, renderer)
+    if content is None:
+        raise Http404
+    return HttpResponse(content)
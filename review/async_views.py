@@ -0,0 +1,47 @@
+from django.conf import settings
+
+from authentication.models import User
+from book.models import Book
+from core.async_views import async_api_view, json_response
+from core.db.routers import aget_read_alias
+from core.db.timeouts import DEGRADED_HEADER, arun_with_budget
+from review.models import Review
+from review.queries import USER_REVIEWS, USER_REVIEWS_PAGE
+from review.serializers import ReviewSerializer
+
+
+@async_api_view()
+async def user_reviews(request):
+    """
+    Async counterpart of UserReviewsView: list the reviews of the
+    authenticated user.
+
+    The books and the user are fetched with the reviews, so that serializing
+    them does not need further queries. Only the first of them are listed,
+    flagged with the DEGRADED_HEADER header, if fetching them all exceeds
+    the statement timeout.
+
+    Returns:
+        HttpResponse: The list of reviews with their book and user.
+    """
+    user_id = request.user.id
+    using = await aget_read_alias(request)
+    page_size = settings.STATEMENT_TIMEOUTS['PAGE_SIZE']
+    rows, degraded = await arun_with_budget(
+        'user_reviews',
+        lambda: USER_REVIEWS.afetchall([user_id], using=using),
+        fallbacks=[(
+            'partial',
+            lambda: USER_REVIEWS_PAGE.afetchall(
+                [user_id, page_size], using=using)),
+        ])
+    reviews = [
+        Review(
+            id=row[0], rating=row[1],
+            book=Book(id=row[2], title=row[3], author=row[4], genre=row[5]),
+            user=User(id=row[6], username=row[7]))
+        for row in rows
+    ]
+    return json_response(
+        ReviewSerializer(reviews, many=True).data,
+        headers={DEGRADED_HEADER: degraded} if degraded else None)
@@ -0,0 +1,175 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from review.management.commands.partition_reviews import (
+    create_partitioned_table)
+
+
+SCHEMA = 'bench_partitioning'
+
+# The per-user statements issued by the review and suggest apps, with the
+# table name left as a placeholder
+QUERIES = {
+    'user_reviews': (
+        'SELECT id, rating, book_id, user_id FROM {table} WHERE user_id = %s',
+        lambda sample: [sample[0]]),
+    'reviewed_book_ids': (
+        'SELECT book_id FROM {table} WHERE user_id = %s',
+        lambda sample: [sample[0]]),
+    'review_exists': (
+        'SELECT COUNT(*) FROM {table} WHERE book_id = %s AND user_id = %s',
+        lambda sample: [sample[1], sample[0]]),
+    'update_rating': (
+        'UPDATE {table} SET rating = rating WHERE id = %s AND user_id = %s',
+        lambda sample: [sample[2], sample[0]]),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the per-user review queries against an unpartitioned and a '
+        'hash-partitioned copy of a synthetic reviews table. The tables are '
+        f'created in the {SCHEMA} schema, which is dropped afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reviews', type=int, default=1000000,
+            help='Number of synthetic reviews (default: 1000000).')
+        parser.add_argument(
+            '--users', type=int, default=50000,
+            help='Number of synthetic users (default: 50000).')
+        parser.add_argument(
+            '--books', type=int, default=100000,
+            help='Number of synthetic books (default: 100000).')
+        parser.add_argument(
+            '--partitions', type=int, default=16,
+            help='Number of hash partitions (default: 16).')
+        parser.add_argument(
+            '--iterations', type=int, default=2000,
+            help='Number of executions per query and layout (default: 2000).')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed for the sampled users (default: 0).')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help=f'Keep the {SCHEMA} schema after the benchmark.')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+            cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+            try:
+                self.load(cursor, options)
+                self.run(cursor, options)
+            finally:
+                if not options['keep']:
+                    cursor.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+
+    def load(self, cursor, options):
+        """
+        Create both layouts and fill them with the same synthetic reviews.
+
+        User activity is skewed so that a few users have many reviews, as in
+        real rating data.
+        """
+        cursor.execute(f"""
+            CREATE TABLE {SCHEMA}.flat (
+                id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                rating integer NOT NULL,
+                book_id bigint NOT NULL,
+                user_id bigint NOT NULL,
+                UNIQUE (book_id, user_id)
+            )
+        """)
+        cursor.execute(f'CREATE INDEX ON {SCHEMA}.flat (book_id)')
+        cursor.execute(f'CREATE INDEX ON {SCHEMA}.flat (user_id)')
+        # Partitions and indexes are created in the first schema of the
+        # search path
+        cursor.execute(f'SET search_path TO {SCHEMA}, public')
+        try:
+            create_partitioned_table(
+                cursor, 'hashed', options['partitions'], 'hashed',
+                foreign_keys=False)
+        finally:
+            cursor.execute('RESET search_path')
+
+        self.stdout.write(f"Loading {options['reviews']} reviews")
+        start = time.perf_counter()
+        cursor.execute(
+            f"""
+            INSERT INTO {SCHEMA}.flat (rating, book_id, user_id)
+            SELECT 1 + floor(random() * 5)::int,
+                   1 + floor(random() * %s)::bigint,
+                   1 + floor(power(random(), 3) * %s)::bigint
+            FROM generate_series(1, %s)
+            ON CONFLICT DO NOTHING
+            """,
+            [options['books'], options['users'], options['reviews']]
+        )
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.hashed (id, rating, book_id, user_id)
+            SELECT id, rating, book_id, user_id FROM {SCHEMA}.flat
+        """)
+        cursor.execute(f'ANALYZE {SCHEMA}.flat')
+        cursor.execute(f'ANALYZE {SCHEMA}.hashed')
+        self.stdout.write(f'Loaded in {time.perf_counter() - start:.1f}s')
+
+    def run(self, cursor, options):
+        """
+        Time every query on both layouts with the same sampled reviews and
+        report latency percentiles, on-disk size and vacuum time.
+        """
+        cursor.execute(
+            f"""
+            SELECT user_id, book_id, id FROM {SCHEMA}.flat
+            ORDER BY md5(id::text || %s)
+            LIMIT %s
+            """,
+            [str(options['seed']), options['iterations']]
+        )
+        samples = cursor.fetchall()
+        random.Random(options['seed']).shuffle(samples)
+
+        self.stdout.write(
+            f"{'query':<20}{'layout':<8}{'mean ms':>10}{'p50 ms':>10}"
+            f"{'p99 ms':>10}")
+        for name, (sql, params) in QUERIES.items():
+            for layout in ('flat', 'hashed'):
+                statement = sql.format(table=f'{SCHEMA}.{layout}')
+                timings = []
+                for sample in samples:
+                    start = time.perf_counter()
+                    cursor.execute(statement, params(sample))
+                    if cursor.description is not None:
+                        cursor.fetchall()
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{name:<20}{layout:<8}'
+                    f'{statistics.fmean(timings):>10.3f}'
+                    f'{timings[len(timings) // 2]:>10.3f}'
+                    f'{timings[int(len(timings) * 0.99)]:>10.3f}')
+
+        for layout in ('flat', 'hashed'):
+            # pg_partition_tree is empty for a table that is not partitioned
+            cursor.execute(
+                """
+                SELECT COALESCE(
+                    SUM(pg_total_relation_size(relid)),
+                    pg_total_relation_size(%s::regclass))
+                FROM pg_partition_tree(%s)
+                """,
+                [f'{SCHEMA}.{layout}', f'{SCHEMA}.{layout}']
+            )
+            size = cursor.fetchone()[0]
+            start = time.perf_counter()
+            cursor.execute(f'VACUUM {SCHEMA}.{layout}')
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{layout}: {size / 1024 / 1024:.1f} MiB on disk, '
+                f'vacuum {elapsed * 1000:.0f} ms')
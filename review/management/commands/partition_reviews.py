@@ -0,0 +1,208 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+
+def create_partitioned_table(cursor, table, partitions, prefix,
+                             foreign_keys=True):
+    """
+    Create a reviews table hash-partitioned by user_id.
+
+    The layout mirrors the reviews table created by the Django migrations,
+    except that the primary key has to include the partition key.
+
+    Args:
+        cursor (CursorWrapper): The cursor to run the DDL with.
+        table (str): The name of the partitioned table.
+        partitions (int): The number of hash partitions.
+        prefix (str): The prefix of partition, constraint and index names.
+        foreign_keys (bool): Whether to reference the books and users tables.
+    """
+    references = {
+        column: (
+            f'CONSTRAINT {prefix}_{column}_fk REFERENCES {table_name} (id) '
+            f'DEFERRABLE INITIALLY DEFERRED') if foreign_keys else ''
+        for column, table_name in [('book_id', 'books'), ('user_id', 'users')]
+    }
+    cursor.execute(f"""
+        CREATE TABLE {table} (
+            id bigint GENERATED BY DEFAULT AS IDENTITY,
+            rating integer NOT NULL,
+            book_id bigint NOT NULL {references['book_id']},
+            user_id bigint NOT NULL {references['user_id']},
+            CONSTRAINT {prefix}_pkey PRIMARY KEY (id, user_id),
+            CONSTRAINT {prefix}_book_id_user_id_uniq UNIQUE (book_id, user_id)
+        ) PARTITION BY HASH (user_id)
+    """)
+    cursor.execute(f'CREATE INDEX {prefix}_book_id ON {table} (book_id)')
+    cursor.execute(f'CREATE INDEX {prefix}_user_id ON {table} (user_id)')
+    for remainder in range(partitions):
+        cursor.execute(f"""
+            CREATE TABLE {prefix}_{remainder} PARTITION OF {table}
+            FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})
+        """)
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the reviews table into a table hash-partitioned by user_id. '
+        'Reviews are copied in batches while the application keeps running; '
+        'changes made meanwhile are replayed from the review outbox under a '
+        'short write lock before the tables are swapped. The original table '
+        'is kept as reviews_unpartitioned, without its foreign keys, and is '
+        'no longer updated: drop it once the partitioned table is checked.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int, default=16,
+            help='Number of hash partitions (default: 16).')
+        parser.add_argument(
+            '--batch-size', type=int, default=50000,
+            help='Number of reviews copied per transaction (default: 50000).')
+
+    def handle(self, *args, **options):
+        partitions = options['partitions']
+        batch_size = options['batch_size']
+        if partitions < 1:
+            raise CommandError('--partitions must be at least 1')
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.relkind
+                FROM pg_class c
+                WHERE c.oid = to_regclass('reviews')
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                raise CommandError('The reviews table does not exist')
+            if row[0] == 'p':
+                raise CommandError('The reviews table is already partitioned')
+            cursor.execute("SELECT to_regclass('reviews_unpartitioned')")
+            if cursor.fetchone()[0] is not None:
+                raise CommandError('reviews_unpartitioned already exists')
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Changes from any transaction still running are replayed
+                # from the outbox before the swap
+                cursor.execute(
+                    'SELECT txid_snapshot_xmin(txid_current_snapshot())')
+                start_txid = cursor.fetchone()[0]
+                cursor.execute('DROP TABLE IF EXISTS reviews_partitioned')
+                create_partitioned_table(
+                    cursor, 'reviews_partitioned', partitions, 'reviews_part')
+
+        # Copy the existing reviews in id order, one batch per transaction
+        copied = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    # A review deleted and created again since its copy
+                    # conflicts with the stale copy on (book_id, user_id);
+                    # both are in the outbox and replayed below
+                    cursor.execute(
+                        """
+                        WITH source AS (
+                            SELECT id, rating, book_id, user_id
+                            FROM reviews
+                            WHERE id > %s
+                            ORDER BY id
+                            LIMIT %s
+                        ), batch AS (
+                            INSERT INTO reviews_partitioned
+                                (id, rating, book_id, user_id)
+                            SELECT id, rating, book_id, user_id
+                            FROM source
+                            ON CONFLICT DO NOTHING
+                        )
+                        SELECT COUNT(*), MAX(id) FROM source
+                        """,
+                        [last_id, batch_size]
+                    )
+                    count, max_id = cursor.fetchone()
+            if not count:
+                break
+            copied += count
+            last_id = max_id
+            self.stdout.write(f'Copied {copied} reviews')
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Block writers while the remaining changes are applied
+                cursor.execute('LOCK TABLE reviews IN EXCLUSIVE MODE')
+
+                # Re-copy every review touched since the copy started
+                cursor.execute(
+                    """
+                    SELECT DISTINCT review_id
+                    FROM review_events
+                    WHERE txid >= %s
+                    """,
+                    [start_txid]
+                )
+                touched = [row[0] for row in cursor.fetchall()]
+                if touched:
+                    cursor.execute(
+                        'DELETE FROM reviews_partitioned WHERE id = ANY(%s)',
+                        [touched])
+                    cursor.execute(
+                        """
+                        INSERT INTO reviews_partitioned
+                            (id, rating, book_id, user_id)
+                        SELECT id, rating, book_id, user_id
+                        FROM reviews
+                        WHERE id = ANY(%s)
+                        """,
+                        [touched])
+
+                # Copy reviews created after the last batch
+                cursor.execute(
+                    """
+                    INSERT INTO reviews_partitioned
+                        (id, rating, book_id, user_id)
+                    SELECT id, rating, book_id, user_id
+                    FROM reviews
+                    WHERE id > %s
+                    ON CONFLICT DO NOTHING
+                    """,
+                    [last_id]
+                )
+
+                # Continue the id sequence of the original table, which is
+                # past MAX(id) when the newest reviews were deleted: their
+                # ids are in the outbox and must not be reused
+                cursor.execute("""
+                    SELECT setval(
+                        pg_get_serial_sequence('reviews_partitioned', 'id'),
+                        GREATEST(
+                            pg_sequence_last_value(
+                                pg_get_serial_sequence('reviews', 'id')::regclass),
+                            (SELECT MAX(id) FROM reviews),
+                            0) + 1,
+                        false
+                    )
+                """)
+
+                # The original table still holds the reviews, so its foreign
+                # keys would keep users and books with reviews from being
+                # deleted
+                cursor.execute("""
+                    SELECT conname
+                    FROM pg_constraint
+                    WHERE conrelid = 'reviews'::regclass
+                    AND contype = 'f'
+                """)
+                for (name,) in cursor.fetchall():
+                    cursor.execute(
+                        f'ALTER TABLE reviews DROP CONSTRAINT '
+                        f'{connection.ops.quote_name(name)}')
+                cursor.execute(
+                    'ALTER TABLE reviews RENAME TO reviews_unpartitioned')
+                cursor.execute(
+                    'ALTER TABLE reviews_partitioned RENAME TO reviews')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned reviews into {partitions} partitions; the original '
+            f'table is kept as reviews_unpartitioned, without its foreign '
+            f'keys and no longer updated, and can be dropped'))
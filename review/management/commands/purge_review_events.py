@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from review.outbox import purge_review_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the review outbox events every consumer has committed, and '
+        'those older than REVIEW_OUTBOX[\'RETENTION_DAYS\']. Do not run it '
+        'while partition_reviews runs, which replays the events written '
+        'since it started.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=float,
+            default=settings.REVIEW_OUTBOX['RETENTION_DAYS'],
+            help='Age in days after which events are deleted whatever the '
+                 'consumers (default: REVIEW_OUTBOX[\'RETENTION_DAYS\']).')
+
+    def handle(self, *args, **options):
+        deleted = purge_review_events(options['retention_days'])
+        self.stdout.write(f'Deleted {deleted} review events')
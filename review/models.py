@@ -16,3 +16,45 @@ class Review(models.Model):
 
     def __str__(self):
         return f'Review by {self.user} for {self.book} with rating {self.rating}'
+
+
+class ReviewEvent(models.Model):
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OPERATION_CHOICES = [
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    ]
+
+    txid = models.BigIntegerField()
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES)
+    review_id = models.BigIntegerField()
+    book_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+    rating = models.IntegerField(null=True)
+    old_rating = models.IntegerField(null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'review_events'
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='review_events_position'),
+        ]
+
+    def __str__(self):
+        return f'{self.operation} review {self.review_id} at ({self.txid}, {self.id})'
+
+
+class ReviewEventCheckpoint(models.Model):
+    consumer = models.CharField(max_length=100, unique=True)
+    txid = models.BigIntegerField(default=0)
+    event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'review_event_checkpoints'
+
+    def __str__(self):
+        return f'{self.consumer} at ({self.txid}, {self.event_id})'
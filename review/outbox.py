@@ -0,0 +1,174 @@
+from django.db import connection
+
+from review.models import ReviewEvent
+
+
+# Position of an event in the outbox. Events are ordered by the id of the
+# transaction that wrote them and then by their own id, which lets consumers
+# only ever read events of transactions that can no longer commit.
+START = (0, 0)
+
+EVENT_COLUMNS = """
+    id, txid, operation, review_id, book_id, user_id, rating, old_rating,
+    created_at
+"""
+
+
+def read_review_events(position=START, limit=500):
+    """
+    Read a batch of review events after the given position.
+
+    Only events written by transactions older than every transaction still in
+    progress are returned, so an event can never show up behind a position a
+    consumer has already moved past.
+
+    Args:
+        position (tuple): The (txid, event id) of the last processed event.
+        limit (int): The maximum number of events to return.
+
+    Returns:
+        list: ReviewEvent objects in outbox order.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {EVENT_COLUMNS}
+            FROM review_events
+            WHERE (txid, id) > (%s, %s)
+            AND txid < txid_snapshot_xmin(txid_current_snapshot())
+            ORDER BY txid, id
+            LIMIT %s
+            """,
+            [position[0], position[1], limit]
+        )
+        rows = cursor.fetchall()
+
+    return [
+        ReviewEvent(
+            id=row[0], txid=row[1], operation=row[2], review_id=row[3],
+            book_id=row[4], user_id=row[5], rating=row[6], old_rating=row[7],
+            created_at=row[8])
+        for row in rows
+    ]
+
+
+def purge_review_events(retention_days):
+    """
+    Delete the review events at or before the checkpoint of every consumer,
+    and those older than the retention whatever the consumers. Without any
+    consumer, only the retention applies.
+
+    Args:
+        retention_days (float): The age in days after which events are
+            deleted.
+
+    Returns:
+        int: The number of deleted events.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM review_events
+            WHERE (txid, id) <= (
+                SELECT txid, event_id
+                FROM review_event_checkpoints
+                ORDER BY txid, event_id
+                LIMIT 1
+            )
+            OR created_at < now() - %s * interval '1 day'
+            """,
+            [retention_days]
+        )
+        return cursor.rowcount
+
+
+class ReviewEventConsumer:
+    """
+    A named reader of the review outbox with a checkpoint stored in the
+    database.
+
+    Typical use::
+
+        consumer = ReviewEventConsumer('suggest-cache')
+        for events in consumer:
+            handle(events)
+            consumer.commit(events)
+
+    Iterating yields batches from the checkpoint until the outbox is drained.
+    Batches that are not committed are read again by the next poll or
+    iteration.
+    """
+
+    def __init__(self, name, batch_size=500):
+        self.name = name
+        self.batch_size = batch_size
+
+    def position(self):
+        """
+        Get the (txid, event id) checkpoint of this consumer.
+
+        Returns:
+            tuple: The position of the last committed event.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT txid, event_id
+                FROM review_event_checkpoints
+                WHERE consumer = %s
+                """,
+                [self.name]
+            )
+            row = cursor.fetchone()
+        return tuple(row) if row else START
+
+    def poll(self):
+        """
+        Read the next batch of events after the checkpoint.
+
+        Returns:
+            list: Up to batch_size ReviewEvent objects.
+        """
+        return read_review_events(self.position(), self.batch_size)
+
+    def commit(self, events):
+        """
+        Move the checkpoint past the given batch of events.
+
+        Args:
+            events (list): The batch returned by poll(), in outbox order.
+        """
+        if not events:
+            return
+        self.seek((events[-1].txid, events[-1].id))
+
+    def seek(self, position):
+        """
+        Move the checkpoint to the given position.
+
+        Args:
+            position (tuple): The (txid, event id) of the last processed
+                event.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO review_event_checkpoints
+                    (consumer, txid, event_id, updated_at)
+                VALUES (%s, %s, %s, now())
+                ON CONFLICT (consumer) DO UPDATE
+                SET txid = EXCLUDED.txid,
+                    event_id = EXCLUDED.event_id,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [self.name, position[0], position[1]]
+            )
+
+    def __iter__(self):
+        position = self.position()
+        while True:
+            events = read_review_events(position, self.batch_size)
+            if not events:
+                return
+            yield events
+            position = (events[-1].txid, events[-1].id)
@@ -0,0 +1,50 @@
+from core.db.plans import expect_plan
+
+from review.queries import (
+    ALREADY_REVIEWED, BOOK_EXISTS, CREATE_REVIEW, DELETE_BOOK_EVENTS,
+    DELETE_REVIEW, DELETE_USER_EVENTS, UPDATE_REVIEW, USER_REVIEW,
+    USER_REVIEWS, USER_REVIEWS_PAGE)
+
+
+expect_plan(
+    BOOK_EXISTS, lambda sample: [sample.book_id],
+    indexes=['books(id)'], max_cost=20)
+
+expect_plan(
+    ALREADY_REVIEWED, lambda sample: [sample.book_id, sample.user_id],
+    indexes=['reviews(book_id, user_id)'], max_cost=20)
+
+expect_plan(
+    CREATE_REVIEW,
+    lambda sample: [sample.rating, sample.book_id, sample.user_id],
+    max_cost=20)
+
+expect_plan(
+    UPDATE_REVIEW,
+    lambda sample: [
+        sample.review_id, sample.user_id, sample.rating, sample.user_id],
+    indexes=['reviews(id)', 'books(id)', 'users(id)'], max_cost=80)
+
+expect_plan(
+    DELETE_REVIEW, lambda sample: [sample.review_id, sample.user_id],
+    indexes=['reviews(id)'], max_cost=20)
+
+expect_plan(
+    DELETE_USER_EVENTS, lambda sample: [sample.user_id],
+    indexes=['reviews(user_id)'], max_cost=300)
+
+expect_plan(
+    DELETE_BOOK_EVENTS, lambda sample: [sample.book_id],
+    indexes=['reviews(book_id)'], max_cost=300)
+
+expect_plan(
+    USER_REVIEW, lambda sample: [sample.review_id, sample.user_id],
+    indexes=['reviews(id)', 'books(id)', 'users(id)'], max_cost=30)
+
+expect_plan(
+    USER_REVIEWS, lambda sample: [sample.user_id],
+    indexes=['reviews(user_id)', 'books(id)'], max_cost=300)
+
+expect_plan(
+    USER_REVIEWS_PAGE, lambda sample: [sample.user_id, 100],
+    indexes=['reviews(user_id)', 'books(id)'], max_cost=300)
@@ -0,0 +1,121 @@
+from core.db.queries import Query
+
+
+BOOK_EXISTS = Query(
+    'review.book_exists',
+    'SELECT COUNT(*) FROM books WHERE id = %s')
+
+ALREADY_REVIEWED = Query(
+    'review.already_reviewed',
+    'SELECT COUNT(*) FROM reviews WHERE book_id = %s AND user_id = %s')
+
+# Append the outbox event of every row of the review CTE of a change, see
+# review.outbox
+INSERT_EVENT = """
+        INSERT INTO review_events (
+            txid, operation, review_id, book_id, user_id,
+            rating, old_rating, created_at
+        )
+        SELECT txid_current(), '{operation}', id, book_id, user_id,
+               rating, {old_rating}, now()
+        FROM review
+    """
+
+# Insert a review and its outbox event in a single statement, returning no
+# row if the user already reviewed the book
+CREATE_REVIEW = Query('review.create', f"""
+    WITH review AS (
+        INSERT INTO reviews (rating, book_id, user_id)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (book_id, user_id) DO NOTHING
+        RETURNING id, rating, book_id, user_id
+    ), event AS ({INSERT_EVENT.format(operation='create', old_rating='NULL')})
+    SELECT id, rating, book_id, user_id FROM review
+""")
+
+# Update the rating of a review of a user and write its outbox event,
+# returning the review with its book and user
+UPDATE_REVIEW = Query('review.update', f"""
+    WITH old AS (
+        SELECT id, rating
+        FROM reviews
+        WHERE id = %s
+        AND user_id = %s
+        FOR UPDATE
+    ), review AS (
+        UPDATE reviews r
+        SET rating = %s
+        FROM old
+        WHERE r.id = old.id
+        AND r.user_id = %s
+        RETURNING r.id, r.rating, r.book_id, r.user_id,
+                  old.rating AS old_rating
+    ), event AS ({INSERT_EVENT.format(operation='update', old_rating='old_rating')})
+    SELECT r.id, r.rating, b.id, b.title, b.author, b.genre,
+           u.id, u.username
+    FROM review r
+    JOIN books b ON b.id = r.book_id
+    JOIN users u ON u.id = r.user_id
+""")
+
+# A review of a user with its book and the user
+USER_REVIEW = Query('review.user_review', """
+    SELECT r.id, r.rating, b.id, b.title, b.author, b.genre,
+           u.id, u.username
+    FROM reviews r
+    JOIN books b ON b.id = r.book_id
+    JOIN users u ON u.id = r.user_id
+    WHERE r.id = %s
+    AND r.user_id = %s
+""")
+
+# Delete a review of a user and write its outbox event
+DELETE_REVIEW = Query('review.delete', f"""
+    WITH review AS (
+        DELETE FROM reviews
+        WHERE id = %s
+        AND user_id = %s
+        RETURNING id, rating, book_id, user_id
+    ), event AS ({INSERT_EVENT.format(operation='delete', old_rating='NULL')})
+    SELECT id FROM review
+""")
+
+# Write the outbox events of the reviews of a user or a book about to be
+# deleted, which the ORM deletes in cascade
+DELETE_USER_EVENTS = Query('review.delete_user_events', f"""
+    WITH review AS (
+        SELECT id, rating, book_id, user_id
+        FROM reviews
+        WHERE user_id = %s
+    ) {INSERT_EVENT.format(operation='delete', old_rating='NULL')}
+""")
+
+DELETE_BOOK_EVENTS = Query('review.delete_book_events', f"""
+    WITH review AS (
+        SELECT id, rating, book_id, user_id
+        FROM reviews
+        WHERE book_id = %s
+    ) {INSERT_EVENT.format(operation='delete', old_rating='NULL')}
+""")
+
+# The reviews of a user with their books and the user
+USER_REVIEWS = Query('review.user_reviews', """
+    SELECT r.id, r.rating, b.id, b.title, b.author, b.genre,
+           u.id, u.username
+    FROM reviews r
+    JOIN books b ON b.id = r.book_id
+    JOIN users u ON u.id = r.user_id
+    WHERE r.user_id = %s
+""")
+
+# The first reviews of a user, for partial results
+USER_REVIEWS_PAGE = Query('review.user_reviews_page', """
+    SELECT r.id, r.rating, b.id, b.title, b.author, b.genre,
+           u.id, u.username
+    FROM reviews r
+    JOIN books b ON b.id = r.book_id
+    JOIN users u ON u.id = r.user_id
+    WHERE r.user_id = %s
+    ORDER BY r.id
+    LIMIT %s
+""")
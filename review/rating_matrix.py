@@ -0,0 +1,394 @@
+"""
+Compact CSR export of the (user, book, rating) matrix for offline training.
+
+An export is a directory of NumPy arrays that can be memory-mapped:
+
+    indptr.npy    int64, row offsets into indices and data (one row per user)
+    indices.npy   int32, column of each rating (index into book_ids)
+    data.npy      int8, the ratings
+    user_ids.npy  int64, user id of each row
+    book_ids.npy  int64, book id of each column
+    delta.npz     the changes since the arrays above were written, if any
+    meta.json     shape, number of ratings, size of the delta and the outbox
+                  watermark
+
+Rows are sorted by user id and the columns of a row by book id.
+
+The watermark is the review outbox position up to which the export is known
+to be complete; update_rating_matrix() applies the events after it to the
+delta segment, the latest rating of every changed (user, book) pair, 0 for
+a deleted one, and only rewrites that segment. Once the delta outgrows
+COMPACT_RATIO of the ratings, it is merged into the other arrays.
+
+NumPy is only needed by this module and is imported lazily.
+"""
+import io
+import json
+import os
+import shutil
+import time
+
+from django.db import connection, transaction
+
+from review.models import ReviewEvent
+from review.outbox import read_review_events
+
+
+FORMAT_VERSION = 2
+ARRAYS = ['indptr', 'indices', 'data', 'user_ids', 'book_ids']
+DELTA_ARRAYS = ['user_ids', 'book_ids', 'ratings']
+
+# Number of reviews copied from the database at a time
+FETCH_SIZE = 100000
+
+# Merge the delta segment into the other arrays once it holds more changes
+# than this fraction of their ratings
+COMPACT_RATIO = 0.1
+
+COPY_REVIEWS = """
+    COPY (
+        SELECT id::int8, user_id::int8, book_id::int8, rating::int4
+        FROM reviews
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+# A row of COPY_REVIEWS in the binary format: the number of fields, then the
+# size and value of each field, big-endian. The rows follow a header of a
+# signature, flags and the size of a header extension, and end with a -1
+# field count.
+COPY_ROW = [
+    ('fields', '>i2'),
+    ('id_size', '>i4'), ('id', '>i8'),
+    ('user_id_size', '>i4'), ('user_id', '>i8'),
+    ('book_id_size', '>i4'), ('book_id', '>i8'),
+    ('rating_size', '>i4'), ('rating', '>i4'),
+]
+COPY_HEADER_SIZE = 19
+COPY_TRAILER_SIZE = 2
+
+
+def load_rating_matrix(directory, mmap_mode='r', merge=True):
+    """
+    Load an export, memory-mapping its arrays by default.
+
+    Args:
+        directory (str): The export directory.
+        mmap_mode (str, optional): Passed to numpy.load; None reads the
+            arrays into memory.
+        merge (bool, optional): Whether to merge the delta segment into the
+            arrays, in memory, rather than return it as 'delta'.
+
+    Returns:
+        dict: The arrays by name plus 'meta', the parsed meta.json.
+    """
+    import numpy as np
+
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        matrix = {'meta': json.load(meta_file)}
+    for name in ARRAYS:
+        matrix[name] = np.load(
+            os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    delta_path = os.path.join(directory, 'delta.npz')
+    if os.path.exists(delta_path):
+        with np.load(delta_path) as delta_file:
+            delta = {name: delta_file[name] for name in DELTA_ARRAYS}
+    else:
+        delta = {
+            name: np.empty(0, dtype=np.int8 if name == 'ratings' else np.int64)
+            for name in DELTA_ARRAYS
+        }
+    if not merge:
+        matrix['delta'] = delta
+    elif len(delta['ratings']):
+        matrix.update(apply_delta(matrix, delta))
+        matrix['meta'] = {
+            **matrix['meta'],
+            'shape': [len(matrix['user_ids']), len(matrix['book_ids'])],
+            'nnz': len(matrix['data']),
+            'delta_size': 0,
+        }
+    return matrix
+
+
+def build_csr(user_ids, book_ids, ratings):
+    """
+    Build the CSR arrays from parallel arrays of ratings.
+
+    Args:
+        user_ids (numpy.ndarray): The user id of each rating.
+        book_ids (numpy.ndarray): The book id of each rating.
+        ratings (numpy.ndarray): The ratings.
+
+    Returns:
+        dict: The arrays listed in ARRAYS.
+    """
+    import numpy as np
+
+    row_ids, rows = np.unique(user_ids, return_inverse=True)
+    column_ids, columns = np.unique(book_ids, return_inverse=True)
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(len(row_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(row_ids)), out=indptr[1:])
+    return {
+        'indptr': indptr,
+        'indices': columns[order].astype(np.int32),
+        'data': ratings[order].astype(np.int8),
+        'user_ids': row_ids.astype(np.int64),
+        'book_ids': column_ids.astype(np.int64),
+    }
+
+
+def apply_delta(matrix, delta):
+    """
+    Merge a delta segment into the CSR arrays of an export.
+
+    The ratings of the export and of the delta are both sorted by user and
+    book id, so the changed ratings are found by binary search and patched,
+    removed or inserted with vectorized copies, without sorting the export
+    again.
+
+    Args:
+        matrix (dict): The arrays listed in ARRAYS.
+        delta (dict): The arrays listed in DELTA_ARRAYS, sorted by user and
+            book id.
+
+    Returns:
+        dict: The arrays listed in ARRAYS.
+    """
+    import numpy as np
+
+    # Ratings are keyed by the ranks of their user and book ids, whose order
+    # is that of the ids, so that keys fit in 64 bits whatever the ids
+    all_user_ids = np.union1d(matrix['user_ids'], delta['user_ids'])
+    all_book_ids = np.union1d(matrix['book_ids'], delta['book_ids'])
+    if len(all_user_ids) * len(all_book_ids) >= 2 ** 63:
+        raise ValueError('Too many users and books to merge the delta')
+    width = max(len(all_book_ids), 1)
+    counts = np.diff(matrix['indptr'])
+    keys = (
+        np.searchsorted(all_user_ids, np.repeat(matrix['user_ids'], counts))
+        * width
+        + np.searchsorted(
+            all_book_ids, matrix['book_ids'][matrix['indices']]))
+    ratings = np.array(matrix['data'], dtype=np.int8)
+    delta_keys = (
+        np.searchsorted(all_user_ids, delta['user_ids']) * width
+        + np.searchsorted(all_book_ids, delta['book_ids']))
+
+    positions = np.searchsorted(keys, delta_keys)
+    found = positions < len(keys)
+    found[found] = keys[positions[found]] == delta_keys[found]
+    deleted = delta['ratings'] == 0
+
+    ratings[positions[found & ~deleted]] = delta['ratings'][found & ~deleted]
+    keep = np.ones(len(keys), dtype=bool)
+    keep[positions[found & deleted]] = False
+    keys, ratings = keys[keep], ratings[keep]
+    inserted = ~found & ~deleted
+    at = np.searchsorted(keys, delta_keys[inserted])
+    keys = np.insert(keys, at, delta_keys[inserted])
+    ratings = np.insert(ratings, at, delta['ratings'][inserted])
+
+    # Rows start where the user id changes
+    user_ids = all_user_ids[keys // width]
+    starts = np.ones(len(user_ids), dtype=bool)
+    starts[1:] = user_ids[1:] != user_ids[:-1]
+    starts = np.flatnonzero(starts)
+
+    # Columns of the books still rated, old or new
+    book_ids = all_book_ids[keys % width]
+    column_ids = np.union1d(matrix['book_ids'], delta['book_ids'][inserted])
+    columns = np.searchsorted(column_ids, book_ids)
+    used = np.bincount(columns, minlength=len(column_ids)) > 0
+    columns = (np.cumsum(used) - 1)[columns]
+
+    return {
+        'indptr': np.append(starts, len(keys)).astype(np.int64),
+        'indices': columns.astype(np.int32),
+        'data': ratings,
+        'user_ids': user_ids[starts].astype(np.int64),
+        'book_ids': column_ids[used].astype(np.int64),
+    }
+
+
+def write_json(path, data):
+    """
+    Write a JSON file through a temporary file, so that readers never see it
+    partially written.
+    """
+    with open(f'{path}.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(f'{path}.tmp', path)
+
+
+def write_rating_matrix(directory, matrix, watermark):
+    """
+    Write an export without delta segment, replacing any previous one at the
+    same path.
+
+    The arrays are written to a sibling directory first so that readers
+    never see a partially written export.
+    """
+    import numpy as np
+
+    staging = f'{directory}.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name in ARRAYS:
+        np.save(os.path.join(staging, f'{name}.npy'), matrix[name])
+    meta = {
+        'version': FORMAT_VERSION,
+        'shape': [len(matrix['user_ids']), len(matrix['book_ids'])],
+        'nnz': len(matrix['data']),
+        'delta_size': 0,
+        'watermark': list(watermark),
+        'created_at': time.time(),
+    }
+    write_json(os.path.join(staging, 'meta.json'), meta)
+
+    previous = f'{directory}.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, previous)
+    os.rename(staging, directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    return meta
+
+
+def write_delta(directory, delta, meta, watermark):
+    """
+    Replace the delta segment of an export, then its meta data.
+
+    A reader in between sees the new delta with the previous watermark,
+    which holds: the delta only gains the changes after it.
+    """
+    import numpy as np
+
+    path = os.path.join(directory, 'delta.npz')
+    with open(f'{path}.tmp', 'wb') as delta_file:
+        np.savez(delta_file, **delta)
+    os.replace(f'{path}.tmp', path)
+    meta = {
+        **meta,
+        'delta_size': len(delta['ratings']),
+        'watermark': list(watermark),
+        'updated_at': time.time(),
+    }
+    write_json(os.path.join(directory, 'meta.json'), meta)
+    return meta
+
+
+def copy_reviews(cursor, after_id, limit):
+    """
+    Read the reviews following an id with COPY, decoding the binary rows
+    with NumPy rather than into a Python tuple each.
+
+    Returns:
+        numpy.ndarray: A record array of COPY_ROW, ordered by id.
+    """
+    import numpy as np
+
+    output = io.BytesIO()
+    cursor.copy_expert(
+        cursor.mogrify(COPY_REVIEWS, [after_id, limit]).decode(), output)
+    buffer = output.getbuffer()
+    # Skip the header extension, empty so far
+    offset = COPY_HEADER_SIZE + int.from_bytes(
+        buffer[COPY_HEADER_SIZE - 4:COPY_HEADER_SIZE], 'big')
+    dtype = np.dtype(COPY_ROW)
+    count = (len(buffer) - offset - COPY_TRAILER_SIZE) // dtype.itemsize
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+
+def dump_rating_matrix(directory):
+    """
+    Export every review from a consistent snapshot.
+
+    Returns:
+        dict: The meta data of the written export.
+    """
+    import numpy as np
+
+    columns = {'user_id': [], 'book_id': [], 'rating': []}
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if outermost:
+                cursor.execute(
+                    'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            # Events of transactions not finished when the snapshot was taken
+            # may be missing from it and are replayed by the next update
+            cursor.execute(
+                'SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            watermark = (cursor.fetchone()[0], 0)
+
+            last_id = 0
+            while True:
+                rows = copy_reviews(cursor, last_id, FETCH_SIZE)
+                if not len(rows):
+                    break
+                for name, chunks in columns.items():
+                    chunks.append(rows[name].astype(
+                        np.int8 if name == 'rating' else np.int64))
+                last_id = int(rows['id'][-1])
+
+    user_ids, book_ids, ratings = [
+        np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        for chunks in columns.values()
+    ]
+    matrix = build_csr(user_ids, book_ids, ratings)
+    return write_rating_matrix(directory, matrix, watermark)
+
+
+def update_rating_matrix(directory, batch_size=FETCH_SIZE,
+                         compact_ratio=COMPACT_RATIO):
+    """
+    Apply the review outbox events after the watermark of an export.
+
+    The changes are added to the delta segment, which alone is rewritten,
+    so that an update costs in proportion to the changes rather than to the
+    size of the export. The delta is merged into the other arrays once it
+    holds more changes than compact_ratio of their ratings; 0 always merges.
+
+    Returns:
+        dict: The meta data of the written export.
+    """
+    import numpy as np
+
+    matrix = load_rating_matrix(directory, merge=False)
+    meta = matrix['meta']
+    watermark = tuple(meta['watermark'])
+
+    # Keep the latest change of every (user, book) pair, 0 for a delete
+    changes = dict(zip(
+        zip(matrix['delta']['user_ids'].tolist(),
+            matrix['delta']['book_ids'].tolist()),
+        matrix['delta']['ratings'].tolist()))
+    while True:
+        events = read_review_events(watermark, batch_size)
+        if not events:
+            break
+        for event in events:
+            rating = 0 if event.operation == ReviewEvent.DELETE else event.rating
+            changes[(event.user_id, event.book_id)] = rating
+        watermark = (events[-1].txid, events[-1].id)
+
+    compact = len(changes) > compact_ratio * meta['nnz']
+    if watermark == tuple(meta['watermark']) and not compact:
+        return meta
+
+    pairs = np.array(list(changes), dtype=np.int64).reshape(-1, 2)
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    delta = {
+        'user_ids': pairs[order, 0],
+        'book_ids': pairs[order, 1],
+        'ratings': np.array(list(changes.values()), dtype=np.int8)[order],
+    }
+    if compact:
+        return write_rating_matrix(
+            directory, apply_delta(matrix, delta), watermark)
+    return write_delta(directory, delta, meta, watermark)
@@ -1,13 +1,16 @@
 from rest_framework import serializers
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import connection
+from rest_framework.settings import api_settings
 
 from authentication.serializers import UserSerializer
+from core.invalidation import atomic_write, notify
+from core.serializers import TimedListSerializer, TimedSerializerMixin
 from review.models import Review
+from review.queries import ALREADY_REVIEWED, BOOK_EXISTS, CREATE_REVIEW
 from book.serializers import BookSerializer
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     book_id = serializers.IntegerField(
         validators=[MinValueValidator(1)], write_only=True)
     rating = serializers.IntegerField(
@@ -24,6 +27,7 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'rating', 'book', 'user', 'book_id']
+        list_serializer_class = TimedListSerializer
         extra_kwargs = {
             'book_id': {'write_only': True},
             'user': {'read_only': True},
@@ -47,40 +51,22 @@ class ReviewSerializer(serializers.ModelSerializer):
             serializers.ValidationError: If the book does not exist or the user has already reviewed the book.
         """
         # Check if the book exists in the database
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT COUNT(*)
-                FROM books
-                WHERE id = %s
-                """,
-                [data['book_id']]
-            )
-            count = cursor.fetchone()[0]
-            if count == 0:
-                # If the book does not exist, raise an error
-                raise serializers.ValidationError('Book does not exist')
+        count = BOOK_EXISTS.fetchone([data['book_id']])[0]
+        if count == 0:
+            # If the book does not exist, raise an error
+            raise serializers.ValidationError('Book does not exist')
 
         # Add current user id to data
         data['user_id'] = self.context['request'].user.id
 
         if self.context['request'].method == 'POST':
             # Check if the user has already reviewed the book
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT COUNT(*)
-                    FROM reviews
-                    WHERE book_id = %s
-                    AND user_id = %s
-                    """,
-                    (data['book_id'], data['user_id'])
-                )
-                count = cursor.fetchone()[0]
-                if count > 0:
-                    # If the user has already reviewed the book, raise an error
-                    raise serializers.ValidationError(
-                        'User has already reviewed this book')
+            count = ALREADY_REVIEWED.fetchone(
+                [data['book_id'], data['user_id']])[0]
+            if count > 0:
+                # If the user has already reviewed the book, raise an error
+                raise serializers.ValidationError(
+                    'User has already reviewed this book')
 
         # Return validated data
         return data
@@ -96,27 +82,27 @@ class ReviewSerializer(serializers.ModelSerializer):
             review.models.Review: The newly created Review object.
 
         Raises:
-            None.
+            serializers.ValidationError: If a concurrent request of the user
+                reviewed the book since validate().
         """
-        # Insert a new review into the database
-        with connection.cursor() as cursor:
-            # Use a parameterized query to prevent SQL injection
-            cursor.execute(
-                """
-                INSERT INTO reviews (rating, book_id, user_id)
-                VALUES (%s, %s, %s)
-                RETURNING id, rating, book_id, user_id;
-                """,
-                (validated_data['rating'], validated_data['book_id'],
-                 validated_data['user_id'])
-            )
-            # Fetch the newly created review from the database
-            row = cursor.fetchone()
-            # Create a new Review object with the fetched data
-            return Review(id=row[0], rating=row[1], book_id=row[2], user_id=row[3])
-
-
-class UpdateReviewSerializer(serializers.ModelSerializer):
+        # Insert a new review and its outbox event in a single statement,
+        # nothing if the user already reviewed the book, committed with the
+        # notification of the other workers
+        with atomic_write():
+            row = CREATE_REVIEW.fetchone(
+                [validated_data['rating'], validated_data['book_id'],
+                 validated_data['user_id']])
+            if row is not None:
+                notify('review', [validated_data['user_id']])
+        if row is None:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'User has already reviewed this book']})
+        # Create a new Review object with the fetched data
+        return Review(id=row[0], rating=row[1], book_id=row[2], user_id=row[3])
+
+
+class UpdateReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     rating = serializers.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)])
     user = serializers.SerializerMethodField()
@@ -134,3 +120,13 @@ class UpdateReviewSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'user': {'read_only': True},
         }
+
+
+class ReviewExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(
+        choices=['ndjson', 'csv'], default='ndjson')
+    user_id = serializers.IntegerField(required=False)
+    book_id = serializers.IntegerField(required=False)
+    genre = serializers.CharField(max_length=50, required=False)
+    min_id = serializers.IntegerField(required=False)
+    max_id = serializers.IntegerField(required=False)
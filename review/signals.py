@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from authentication.models import User
+from book.models import Book
+from core.invalidation import notify
+from review.models import Review
+from review.queries import DELETE_BOOK_EVENTS, DELETE_USER_EVENTS
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_cached_reviews(sender, instance, using, **kwargs):
+    """
+    Drop the cached results of the user of a review saved or deleted through
+    the ORM, e.g. from the admin; the review endpoints notify themselves.
+    """
+    notify('review', [instance.user_id], using)
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Book)
+def record_cascaded_review_deletes(sender, instance, using, **kwargs):
+    """
+    Write the outbox events of the reviews of a user or a book deleted
+    through the ORM, before their cascaded delete and in its transaction, so
+    that the consumers of the outbox, like partition_reviews, see them.
+    """
+    query = DELETE_USER_EVENTS if sender is User else DELETE_BOOK_EVENTS
+    query.run([instance.id], using)
@@ -1,10 +1,39 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
-from rest_framework.test import APIRequestFactory
-from django.db import connection
+from rest_framework.test import APIClient, APIRequestFactory
+from django.db import DatabaseError, connection, connections, transaction
 from rest_framework.test import force_authenticate
-
-from review.views import CreateReviewView, UpdateReviewView, DestroyReviewView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from book.models import Book
+from core.db.aio import close_async_pools
+from core.db.timeouts import statement_timeout
+from core.testing import DATA_SIZES, QueryBudgetMixin, create_reviews
+from review.models import Review, ReviewEvent
+from review.outbox import ReviewEventConsumer
+from review.queries import USER_REVIEWS
+from review.serializers import ReviewSerializer
+from review.views import (
+    CreateReviewView, UpdateReviewView, DestroyReviewView, ReviewExportView,
+    UserReviewsView, stream_reviews)
 from authentication.models import User
 
 
@@ -79,9 +108,12 @@ class CreateReviewViewTestCase(TestCase):
         # Process the request using the view under test
         response = self.view(request)
 
-        # The expected review object returned by the view
+        # The expected review object returned by the view, with the id the
+        # review got, which depends on the reviews of the tests run before
+        review_id = Review.objects.get(
+            book_id=self.book_id, user_id=self.user.id).id
         expected_review = {
-            'id': 2,
+            'id': review_id,
             'rating': 4,
             'book': {
                 'id': self.book_id,
@@ -191,6 +223,31 @@ class CreateReviewViewTestCase(TestCase):
             # The message if the assertion fails
             "Expected status code 400, received %s" % response.status_code)
 
+    def test_create_review_concurrently(self):
+        """
+        Test that a review of a book the user reviewed after the validation,
+        e.g. by a concurrent request, returns a 400 Bad Request response.
+        """
+        request = self.factory.post(
+            '/api/review/', {'rating': 4, 'book_id': self.book_id})
+        force_authenticate(request, user=self.user)
+        self.assertEqual(self.view(request).status_code, status.HTTP_201_CREATED)
+
+        # Validate as if the first review was not committed yet
+        def validate(serializer, data):
+            return {**data, 'user_id': serializer.context['request'].user.id}
+
+        with mock.patch.object(ReviewSerializer, 'validate', validate):
+            response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            {'non_field_errors': ['User has already reviewed this book']})
+        self.assertEqual(
+            Review.objects.filter(
+                book_id=self.book_id, user_id=self.user.id).count(), 1)
+
 
 class UpdateReviewViewTestCase(TestCase):
 
@@ -340,6 +397,75 @@ class UpdateReviewViewTestCase(TestCase):
             "Expected status code 200, received %s" % response.status_code)
 
 
+    def test_partial_update_review(self):
+        """
+        Test that a PATCH updates the rating it is given, and returns the
+        review unchanged when it is given none.
+        """
+        request = self.factory.patch(
+            f'/api/review/update/{self.review_id}/', {'rating': 5})
+        force_authenticate(request, user=self.user)
+        response = self.view(request, id=self.review_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rating'], 5)
+
+        request = self.factory.patch(
+            f'/api/review/update/{self.review_id}/', {})
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(1):
+            response = self.view(request, id=self.review_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rating'], 5)
+        self.assertEqual(response.data['book']['title'], 'Test Title')
+
+        # Verify no outbox event is written for the unchanged review
+        self.assertEqual(ReviewEvent.objects.count(), 1)
+
+        # A PUT still requires the rating
+        request = self.factory.put(
+            f'/api/review/update/{self.review_id}/', {})
+        force_authenticate(request, user=self.user)
+        response = self.view(request, id=self.review_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # A PATCH of another user's review is not found
+        request = self.factory.patch(
+            f'/api/review/update/{self.review_id}/', {})
+        force_authenticate(request, user=User(id=self.user.id + 1))
+        response = self.view(request, id=self.review_id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_update_review_of_other_user(self):
+        """
+        Test that a user cannot update a review owned by another user and
+        that the update runs as a single query.
+        """
+        # Insert another user into the 'users' table using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password) VALUES (%s, %s)
+                RETURNING id
+            ''', ['otheruser', 'testpassword'])
+            other_user = User(id=cursor.fetchone()[0])
+
+        request = self.factory.put(
+            f'/api/review/update/{self.review_id}/', {'rating': 1})
+        force_authenticate(request, user=other_user)
+
+        with self.assertNumQueries(1):
+            response = self.view(request, id=self.review_id)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_404_NOT_FOUND,
+            "Expected status code 404, received %s" % response.status_code)
+
+        # Verify the review is left unchanged
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rating FROM reviews WHERE id = %s', [self.review_id])
+            self.assertEqual(cursor.fetchone()[0], 3)
+
+
 class DestroyReviewViewTestCase(TestCase):
 
     def setUp(self):
@@ -464,3 +590,810 @@ class DestroyReviewViewTestCase(TestCase):
         self.assertEqual(
             response.status_code, status.HTTP_404_NOT_FOUND,
             "Expected status code 404, received %s" % response.status_code)
+
+    def test_destroy_review_of_other_user(self):
+        """
+        Test that a user cannot delete a review owned by another user and
+        that the delete runs as a single query.
+        """
+        # Insert another user into the 'users' table using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password) VALUES (%s, %s)
+                RETURNING id
+            ''', ['otheruser', 'testpassword'])
+            other_user = User(id=cursor.fetchone()[0])
+
+        request = self.factory.delete(f'/api/review/delete/{self.review_id}/')
+        force_authenticate(request, user=other_user)
+
+        with self.assertNumQueries(1):
+            response = self.view(request, id=self.review_id)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_404_NOT_FOUND,
+            "Expected status code 404, received %s" % response.status_code)
+
+        # Verify the review still exists
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*) FROM reviews WHERE id = %s', [self.review_id])
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class UserReviewsAsyncTestCase(TransactionTestCase):
+    # The async view queries over connections of its own, which do not see
+    # the data of an open test transaction
+
+    def tearDown(self):
+        # Idle connections would keep the test database from being dropped
+        close_async_pools()
+
+    async def test_same_response_as_sync_view(self):
+        """
+        Test that the async user reviews view returns the same reviews,
+        with their book and user, as the sync one.
+        """
+        user = await User.objects.acreate(username='asyncreviewer', password='x')
+        other_user = await User.objects.acreate(username='otherreviewer', password='x')
+        books = await Book.objects.abulk_create([
+            Book(id=910000 + i, title=f'Book {i}', author='Author', genre='Drama')
+            for i in range(3)
+        ])
+        await Review.objects.abulk_create([
+            Review(id=910000, book=books[0], user=user, rating=4),
+            Review(id=910001, book=books[1], user=user, rating=2),
+            Review(id=910002, book=books[2], user=other_user, rating=5),
+        ])
+        authorization = f'Bearer {AccessToken.for_user(user)}'
+
+        response = await self.async_client.get(
+            '/api/async/review/list', AUTHORIZATION=authorization)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = await sync_to_async(
+            APIClient(HTTP_AUTHORIZATION=authorization).get)('/api/review/list')
+        self.assertEqual(
+            sorted(response.json(), key=lambda review: review['id']),
+            sorted(expected.json(), key=lambda review: review['id']))
+        self.assertEqual(len(response.json()), 2)
+
+
+class PartitionReviewsCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        # Insert two users, three books and their reviews using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password)
+                VALUES (%s, %s), (%s, %s)
+                RETURNING id
+            ''', ['partitionuser1', 'testpassword',
+                  'partitionuser2', 'testpassword'])
+            self.user_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre)
+                SELECT 'Partition ' || i, 'Author', 'Genre'
+                FROM generate_series(1, 3) AS i
+                RETURNING id
+            ''')
+            self.book_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.executemany('''
+                INSERT INTO reviews (rating, book_id, user_id)
+                VALUES (%s, %s, %s)
+            ''', [
+                (rating, book_id, user_id)
+                for user_id in self.user_ids
+                for rating, book_id in enumerate(self.book_ids, start=1)
+            ])
+
+    def test_partition_reviews(self):
+        """
+        Test that the command moves every review into a table hash-partitioned
+        by user_id, that per-user queries scan a single partition and that
+        new reviews can still be written, without reusing the ids of deleted
+        reviews.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM reviews
+                WHERE id = (SELECT MAX(id) FROM reviews)
+                RETURNING id, user_id, book_id
+            ''')
+            last_id, last_user_id, last_book_id = cursor.fetchone()
+
+        call_command(
+            'partition_reviews', partitions=4, batch_size=2, stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE oid = 'reviews'::regclass")
+            self.assertEqual(cursor.fetchone()[0], 'p')
+
+            cursor.execute('''
+                SELECT user_id, book_id, rating FROM reviews
+                ORDER BY user_id, book_id
+            ''')
+            self.assertEqual(cursor.fetchall(), [
+                (user_id, book_id, rating)
+                for user_id in self.user_ids
+                for rating, book_id in enumerate(self.book_ids, start=1)
+                if (user_id, book_id) != (last_user_id, last_book_id)
+            ])
+
+            # Verify partition pruning applies to per-user queries
+            cursor.execute('''
+                EXPLAIN (FORMAT JSON)
+                SELECT id, rating, book_id, user_id
+                FROM reviews
+                WHERE user_id = %s
+            ''', [self.user_ids[0]])
+            plan = json.dumps(cursor.fetchone()[0])
+            self.assertEqual(plan.count('"Relation Name": "reviews_part_'), 1)
+
+        # Verify the review views still work on the partitioned table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM reviews WHERE user_id = %s AND book_id = %s',
+                [self.user_ids[0], self.book_ids[0]])
+            review_id = cursor.fetchone()[0]
+        request = self.factory.delete(f'/api/review/delete/{review_id}/')
+        force_authenticate(request, user=User(id=self.user_ids[0]))
+        response = DestroyReviewView.as_view()(request, id=review_id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        request = self.factory.post(
+            '/api/review/add/', {'rating': 5, 'book_id': self.book_ids[0]})
+        force_authenticate(request, user=User(id=self.user_ids[0]))
+        response = CreateReviewView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(response.data['id'], last_id)
+
+    def test_partition_reviews_with_cascaded_delete(self):
+        """
+        Test that the reviews of a user deleted through the ORM while the
+        reviews are copied are not kept in the partitioned table.
+        """
+        user_ids = self.user_ids
+
+        class Output(StringIO):
+            def write(self, message):
+                # Delete the first user once its first reviews are copied
+                if message.startswith('Copied') and User.objects.filter(
+                        id=user_ids[0]).exists():
+                    User.objects.filter(id=user_ids[0]).delete()
+                return super().write(message)
+
+        call_command(
+            'partition_reviews', partitions=4, batch_size=2, stdout=Output())
+
+        self.assertEqual(
+            ReviewEvent.objects.filter(
+                operation='delete', user_id=user_ids[0]).count(),
+            len(self.book_ids))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT user_id, book_id FROM reviews ORDER BY book_id')
+            self.assertEqual(cursor.fetchall(), [
+                (user_ids[1], book_id) for book_id in self.book_ids])
+
+
+    def test_partition_reviews_with_recreated_review(self):
+        """
+        Test that a review deleted and created again while the reviews are
+        copied is replayed instead of failing the copy, and that users with
+        reviews can still be deleted after the swap.
+        """
+        user = User(id=self.user_ids[0])
+        book_id = self.book_ids[0]
+        recreated = {}
+
+        class Output(StringIO):
+            def write(self, message):
+                # Review the first book again once its review is copied
+                if message.startswith('Copied') and not recreated:
+                    review = Review.objects.get(user_id=user.id, book_id=book_id)
+                    request = APIRequestFactory().delete(
+                        f'/api/review/delete/{review.id}/')
+                    force_authenticate(request, user=user)
+                    DestroyReviewView.as_view()(request, id=review.id)
+                    request = APIRequestFactory().post(
+                        '/api/review/add/', {'rating': 5, 'book_id': book_id})
+                    force_authenticate(request, user=user)
+                    recreated.update(CreateReviewView.as_view()(request).data)
+                return super().write(message)
+
+        call_command(
+            'partition_reviews', partitions=4, batch_size=2, stdout=Output())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, rating FROM reviews WHERE user_id = %s AND book_id = %s',
+                [user.id, book_id])
+            self.assertEqual(
+                cursor.fetchall(), [(recreated['id'], recreated['rating'])])
+            cursor.execute('SELECT COUNT(*) FROM reviews')
+            self.assertEqual(
+                cursor.fetchone()[0], len(self.user_ids) * len(self.book_ids))
+
+            # The foreign keys are deferred, check them now
+            User.objects.filter(id=self.user_ids[1]).delete()
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(
+                'SELECT COUNT(*) FROM reviews WHERE user_id = %s',
+                [self.user_ids[1]])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+class ReviewExportViewTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ReviewExportView.as_view()
+        # Insert an administrator, a user, two books and their reviews
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password, is_superuser)
+                VALUES (%s, %s, %s), (%s, %s, %s)
+                RETURNING id
+            ''', ['exportadmin', 'testpassword', True,
+                  'exportuser', 'testpassword', False])
+            self.admin = User(id=cursor.fetchone()[0], is_superuser=True)
+            self.user = User(id=cursor.fetchone()[0])
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre)
+                VALUES (%s, %s, %s), (%s, %s, %s)
+                RETURNING id
+            ''', ['Export A', 'Author A', 'Drama',
+                  'Export B', 'Author B', 'Poetry'])
+            self.book_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                INSERT INTO reviews (rating, book_id, user_id)
+                VALUES (%s, %s, %s), (%s, %s, %s)
+                RETURNING id
+            ''', [4, self.book_ids[0], self.user.id,
+                  2, self.book_ids[1], self.user.id])
+            self.review_ids = [row[0] for row in cursor.fetchall()]
+
+    def export(self, user, query):
+        request = self.factory.get('/api/review/export/', query)
+        force_authenticate(request, user=user)
+        response = self.view(request)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_non_admin_request(self):
+        """
+        Test that a non-administrator cannot export reviews.
+        """
+        request = self.factory.get('/api/review/export/')
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_403_FORBIDDEN,
+            "Expected status code 403, received %s" % response.status_code)
+
+    def test_export_ndjson(self):
+        """
+        Test that reviews are streamed as NDJSON in id order.
+        """
+        response, content = self.export(self.admin, {'user_id': self.user.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [{'id': self.review_ids[0], 'user_id': self.user.id,
+              'book_id': self.book_ids[0], 'rating': 4},
+             {'id': self.review_ids[1], 'user_id': self.user.id,
+              'book_id': self.book_ids[1], 'rating': 2}])
+
+    def test_export_csv_by_genre(self):
+        """
+        Test that reviews filtered by genre are streamed as CSV.
+        """
+        response, content = self.export(
+            self.admin, {'output': 'csv', 'genre': 'Poetry'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            content,
+            'id,user_id,book_id,rating\n%d,%d,%d,2\n' %
+            (self.review_ids[1], self.user.id, self.book_ids[1]))
+
+    def test_export_invalid_filter(self):
+        """
+        Test that an invalid filter returns a 400 Bad Request response.
+        """
+        request = self.factory.get('/api/review/export/', {'min_id': 'abc'})
+        force_authenticate(request, user=self.admin)
+        response = self.view(request)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST,
+            "Expected status code 400, received %s" % response.status_code)
+
+    def test_export_in_batches(self):
+        """
+        Test that the export reads the reviews in batches resuming after the
+        last id, each under the export budget, without a transaction of its
+        own.
+        """
+        options = {
+            **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'export_reviews': 5}}
+        with self.settings(STATEMENT_TIMEOUTS=options), \
+                mock.patch(
+                    'review.views.statement_timeout',
+                    wraps=statement_timeout) as timeout, \
+                CaptureQueriesContext(connection) as queries:
+            chunks = list(stream_reviews({}, 'csv', chunk_size=1))
+
+        self.assertEqual(chunks, [b'id,user_id,book_id,rating\n'] + [
+            b'%d,%d,%d,%d\n' % (review_id, self.user.id, book_id, rating)
+            for review_id, book_id, rating in zip(
+                self.review_ids, self.book_ids, [4, 2])])
+        # Two full batches and an empty one
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(timeout.call_args_list, [mock.call(5)] * 3)
+        # An atomic block would show up as a savepoint of the test transaction
+        self.assertNotIn('SAVEPOINT', ''.join(
+            query['sql'] for query in queries))
+
+
+class ReviewExportAsyncTestCase(TransactionTestCase):
+    # Under ASGI the view queries over the connection of its thread, which
+    # does not see the data of an open test transaction
+
+    async def test_export_asgi(self):
+        """
+        Test that under ASGI the export is streamed chunk by chunk through an
+        async iterator, rather than buffered from a sync one.
+        """
+        admin = await User.objects.acreate(
+            username='asyncexportadmin', password='x', is_superuser=True)
+        books = await Book.objects.abulk_create([
+            Book(title=f'Async Export {i}', author='Author', genre='Drama')
+            for i in range(3)
+        ])
+        reviews = await Review.objects.abulk_create([
+            Review(book=book, user=admin, rating=i + 1)
+            for i, book in enumerate(books)
+        ])
+
+        with warnings.catch_warnings(), \
+                mock.patch('review.views.EXPORT_CHUNK_SIZE', 1):
+            # Django warns when it consumes a sync iterator under ASGI
+            warnings.simplefilter('error')
+            response = await self.async_client.get(
+                '/api/review/export/', {'output': 'csv'},
+                AUTHORIZATION=f'Bearer {AccessToken.for_user(admin)}')
+            content = b''.join([chunk async for chunk in response])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            content.decode(),
+            'id,user_id,book_id,rating\n' + ''.join(
+                f'{review.id},{admin.id},{review.book_id},{review.rating}\n'
+                for review in reviews))
+
+
+class ReviewEventOutboxTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        # Insert a user and a book into the database using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password) VALUES (%s, %s)
+                RETURNING id
+            ''', ['outboxuser', 'testpassword'])
+            self.user = User(id=cursor.fetchone()[0])
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre) VALUES (%s, %s, %s)
+                RETURNING id
+            ''', ['Outbox Title', 'Outbox Author', 'Outbox Genre'])
+            self.book_id = cursor.fetchone()[0]
+
+    def test_changes_are_consumed_in_order(self):
+        """
+        Test that creating, updating and deleting a review through the views
+        appends one outbox event each, read in order from the checkpoint.
+        """
+        request = self.factory.post(
+            '/api/review/add/', {'rating': 2, 'book_id': self.book_id})
+        force_authenticate(request, user=self.user)
+        review_id = CreateReviewView.as_view()(request).data['id']
+
+        request = self.factory.put(
+            f'/api/review/update/{review_id}/', {'rating': 5})
+        force_authenticate(request, user=self.user)
+        UpdateReviewView.as_view()(request, id=review_id)
+
+        request = self.factory.delete(f'/api/review/delete/{review_id}/')
+        force_authenticate(request, user=self.user)
+        DestroyReviewView.as_view()(request, id=review_id)
+
+        consumer = ReviewEventConsumer('test-consumer', batch_size=2)
+        batches = list(consumer)
+
+        # Verify the events are returned in batches and in order
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        events = batches[0] + batches[1]
+        self.assertEqual(
+            [(event.operation, event.rating, event.old_rating)
+             for event in events],
+            [(ReviewEvent.CREATE, 2, None), (ReviewEvent.UPDATE, 5, 2),
+             (ReviewEvent.DELETE, 5, None)])
+        self.assertTrue(all(event.review_id == review_id for event in events))
+
+        # Verify the checkpoint only moves when a batch is committed
+        self.assertEqual(len(consumer.poll()), 2)
+        consumer.commit(batches[0])
+        self.assertEqual(consumer.poll(), batches[1])
+        consumer.commit(batches[1])
+        self.assertEqual(consumer.poll(), [])
+
+    def test_purge_review_events(self):
+        """
+        Test that purging deletes the events every consumer has committed,
+        and older events whatever the consumers.
+        """
+        for rating in [1, 2, 3]:
+            request = self.factory.post(
+                '/api/review/add/', {'rating': rating, 'book_id': self.book_id})
+            force_authenticate(request, user=self.user)
+            review_id = CreateReviewView.as_view()(request).data['id']
+            request = self.factory.delete(f'/api/review/delete/{review_id}/')
+            force_authenticate(request, user=self.user)
+            DestroyReviewView.as_view()(request, id=review_id)
+        events = list(ReviewEvent.objects.order_by('txid', 'id'))
+        self.assertEqual(len(events), 6)
+
+        # Without consumers only the retention applies
+        call_command('purge_review_events', stdout=StringIO())
+        self.assertEqual(ReviewEvent.objects.count(), 6)
+
+        first = ReviewEventConsumer('first-consumer')
+        second = ReviewEventConsumer('second-consumer')
+        first.commit(events[:4])
+        second.commit(events[:2])
+        output = StringIO()
+        call_command('purge_review_events', stdout=output)
+        self.assertEqual(output.getvalue(), 'Deleted 2 review events\n')
+        self.assertEqual(
+            list(ReviewEvent.objects.order_by('txid', 'id')), events[2:])
+        self.assertEqual(second.poll(), events[2:])
+
+        # Events older than the retention go whatever the consumers
+        ReviewEvent.objects.filter(id=events[2].id).update(
+            created_at=timezone.now() - timedelta(days=8))
+        call_command(
+            'purge_review_events', retention_days=7, stdout=StringIO())
+        self.assertEqual(
+            list(ReviewEvent.objects.order_by('txid', 'id')), events[3:])
+
+
+class ReviewInvalidationTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        # Insert a user, a book and a review into the database using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password) VALUES (%s, %s)
+                RETURNING id
+            ''', ['notifyuser', 'testpassword'])
+            self.user = User(id=cursor.fetchone()[0])
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre) VALUES (%s, %s, %s)
+                RETURNING id
+            ''', ['Notify Title', 'Notify Author', 'Notify Genre'])
+            self.book_id = cursor.fetchone()[0]
+
+            cursor.execute('''
+                INSERT INTO reviews (rating, book_id, user_id) VALUES (%s, %s, %s)
+                RETURNING id
+            ''', [3, self.book_id, self.user.id])
+            self.review_id = cursor.fetchone()[0]
+
+    def test_failed_notify_rolls_back_write(self):
+        """
+        Test that a write whose notification fails is not committed, so that
+        no change is left without an invalidation of the other workers.
+        """
+        other_book = Book.objects.create(
+            title='Other Title', author='Other Author', genre='Other Genre')
+        requests = [
+            (CreateReviewView.as_view(), 'review.serializers.notify',
+             self.factory.post(
+                 '/api/review/add/', {'rating': 5, 'book_id': other_book.id}),
+             {}),
+            (UpdateReviewView.as_view(), 'review.views.notify',
+             self.factory.put(
+                 f'/api/review/update/{self.review_id}/', {'rating': 5}),
+             {'id': self.review_id}),
+            (DestroyReviewView.as_view(), 'review.views.notify',
+             self.factory.delete(f'/api/review/delete/{self.review_id}/'),
+             {'id': self.review_id}),
+        ]
+        invalidation = {**settings.INVALIDATION, 'ENABLED': True}
+        for view, target, request, kwargs in requests:
+            force_authenticate(request, user=self.user)
+            with self.settings(INVALIDATION=invalidation), \
+                    mock.patch(target, side_effect=DatabaseError), \
+                    self.assertRaises(DatabaseError):
+                view(request, **kwargs)
+
+        # Verify the reviews and their outbox events are left unchanged
+        self.assertEqual(
+            list(Review.objects.values_list('id', 'rating')),
+            [(self.review_id, 3)])
+        self.assertFalse(ReviewEvent.objects.exists())
+
+
+@unittest.skipUnless(
+    'replica' in settings.DATABASES, 'POSTGRES_REPLICA_HOST is not set')
+@override_settings(DATABASE_REPLICA={
+    **settings.DATABASE_REPLICA, 'PIN_STORE': 'cache', 'CACHE': 'default'})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password) VALUES (%s, %s)
+                RETURNING id
+            ''', ['replicauser', 'testpassword'])
+            self.user = User(id=cursor.fetchone()[0])
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre) VALUES (%s, %s, %s)
+                RETURNING id
+            ''', ['Replica Title', 'Replica Author', 'Replica Genre'])
+            self.book_id = cursor.fetchone()[0]
+
+    def tearDown(self):
+        connections['replica'].close()
+
+    def list_reviews(self):
+        """
+        Get the reviews of the user, and the database their query was sent
+        to.
+        """
+        request = self.factory.get('/api/review/list')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = UserReviewsView.as_view()(request)
+        aliases = [
+            alias
+            for alias, queries in [('default', primary), ('replica', replica)]
+            for query in queries
+            if USER_REVIEWS.sql in query['sql']
+            or USER_REVIEWS.statement in query['sql']
+        ]
+        return response.data, aliases
+
+    def test_reads_stick_to_primary_after_write(self):
+        """
+        Test that the reviews of a user are read from the replica, and from
+        the primary after they write a review.
+        """
+        reviews, aliases = self.list_reviews()
+        self.assertEqual(reviews, [])
+        self.assertEqual(aliases, ['replica'])
+
+        request = self.factory.post(
+            '/api/review/add/', {'rating': 4, 'book_id': self.book_id})
+        force_authenticate(request, user=self.user)
+        CreateReviewView.as_view()(request)
+
+        reviews, aliases = self.list_reviews()
+        self.assertEqual([review['rating'] for review in reviews], [4])
+        self.assertEqual(aliases, ['default'])
+
+    def test_bearer_token_client_reads_its_writes(self):
+        """
+        Test that a client authenticating with a bearer token and sending no
+        cookies reads its reviews from the primary after writing one.
+        """
+        client = APIClient(
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        response = client.post(
+            '/api/review/add/', {'rating': 4, 'book_id': self.book_id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        client.cookies.clear()
+
+        with CaptureQueriesContext(connections['default']) as primary:
+            response = client.get('/api/review/list')
+        self.assertEqual(
+            [review['rating'] for review in response.data], [4])
+        self.assertTrue(any(
+            USER_REVIEWS.sql in query['sql']
+            or USER_REVIEWS.statement in query['sql']
+            for query in primary))
+
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'NumPy is not installed')
+class RatingMatrixExportTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.directory = tempfile.mkdtemp()
+        # Insert two users, two books and three reviews using raw SQL
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO users (username, password)
+                VALUES (%s, %s), (%s, %s)
+                RETURNING id
+            ''', ['matrixuser1', 'testpassword', 'matrixuser2', 'testpassword'])
+            self.user_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                INSERT INTO books (title, author, genre)
+                VALUES (%s, %s, %s), (%s, %s, %s)
+                RETURNING id
+            ''', ['Matrix A', 'Author', 'Genre', 'Matrix B', 'Author', 'Genre'])
+            self.book_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                INSERT INTO reviews (rating, book_id, user_id)
+                VALUES (%s, %s, %s), (%s, %s, %s), (%s, %s, %s)
+                RETURNING id
+            ''', [5, self.book_ids[0], self.user_ids[0],
+                  3, self.book_ids[1], self.user_ids[0],
+                  1, self.book_ids[1], self.user_ids[1]])
+            self.review_ids = [row[0] for row in cursor.fetchall()]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def ratings(self):
+        from review.rating_matrix import load_rating_matrix
+
+        matrix = load_rating_matrix(self.directory)
+        triples = []
+        for row, user_id in enumerate(matrix['user_ids']):
+            start, end = matrix['indptr'][row], matrix['indptr'][row + 1]
+            for column, rating in zip(
+                    matrix['indices'][start:end], matrix['data'][start:end]):
+                triples.append(
+                    (int(user_id), int(matrix['book_ids'][column]), int(rating)))
+        return triples
+
+    def test_full_and_incremental_export(self):
+        """
+        Test that a full export holds every rating and that an incremental
+        export applies the creates, updates and deletes made since.
+        """
+        call_command('export_rating_matrix', self.directory, stdout=StringIO())
+        self.assertEqual(self.ratings(), [
+            (self.user_ids[0], self.book_ids[0], 5),
+            (self.user_ids[0], self.book_ids[1], 3),
+            (self.user_ids[1], self.book_ids[1], 1),
+        ])
+
+        # Change the reviews through the views so that events are recorded
+        request = self.factory.put(
+            f'/api/review/update/{self.review_ids[1]}/', {'rating': 4})
+        force_authenticate(request, user=User(id=self.user_ids[0]))
+        UpdateReviewView.as_view()(request, id=self.review_ids[1])
+
+        request = self.factory.delete(
+            f'/api/review/delete/{self.review_ids[2]}/')
+        force_authenticate(request, user=User(id=self.user_ids[1]))
+        DestroyReviewView.as_view()(request, id=self.review_ids[2])
+
+        request = self.factory.post(
+            '/api/review/add/', {'rating': 2, 'book_id': self.book_ids[0]})
+        force_authenticate(request, user=User(id=self.user_ids[1]))
+        CreateReviewView.as_view()(request)
+
+        # Only the delta segment is written while it is small enough
+        from review.rating_matrix import update_rating_matrix
+
+        data_path = os.path.join(self.directory, 'data.npy')
+        modified = os.stat(data_path).st_mtime_ns
+        meta = update_rating_matrix(self.directory, compact_ratio=1)
+        self.assertEqual(meta['delta_size'], 3)
+        self.assertEqual(os.stat(data_path).st_mtime_ns, modified)
+        expected = [
+            (self.user_ids[0], self.book_ids[0], 5),
+            (self.user_ids[0], self.book_ids[1], 4),
+            (self.user_ids[1], self.book_ids[0], 2),
+        ]
+        self.assertEqual(self.ratings(), expected)
+
+        call_command(
+            'export_rating_matrix', self.directory, incremental=True,
+            compact=True, stdout=StringIO())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory, 'delta.npz')))
+        self.assertEqual(self.ratings(), expected)
+
+
+    def test_apply_delta_large_ids(self):
+        """
+        Test that merging a delta keeps user and book ids beyond 32 bits.
+        """
+        import numpy as np
+
+        from review.rating_matrix import apply_delta, build_csr
+
+        big_user, big_book = 2 ** 40 + 1, 2 ** 33 + 7
+        matrix = build_csr(
+            np.array([1, 1, big_user], dtype=np.int64),
+            np.array([2, big_book, 2], dtype=np.int64),
+            np.array([5, 3, 1], dtype=np.int8))
+        delta = {
+            'user_ids': np.array([1, big_user, big_user], dtype=np.int64),
+            'book_ids': np.array([2, 2, big_book], dtype=np.int64),
+            'ratings': np.array([0, 4, 2], dtype=np.int8),
+        }
+        merged = apply_delta(matrix, delta)
+        expected = build_csr(
+            np.array([1, big_user, big_user], dtype=np.int64),
+            np.array([big_book, 2, big_book], dtype=np.int64),
+            np.array([3, 4, 2], dtype=np.int8))
+        for name in expected:
+            self.assertEqual(merged[name].tolist(), expected[name].tolist())
+
+class ReviewQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='budgetuser', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_budgets(self):
+        """
+        Test that listing, creating, updating and deleting reviews run a
+        fixed number of queries, fetching only the rows they return,
+        whatever the number of reviews of the user.
+        """
+        counts = {'list': {}, 'add': {}, 'update': {}, 'delete': {}}
+        for size in DATA_SIZES:
+            with self.subTest(size=size), transaction.atomic():
+                create_reviews(self.user.id, size, first_id=1000000)
+
+                with self.assertQueryBudget(queries=1, rows=size) as log:
+                    response = self.client.get('/api/review/list')
+                self.assertNotDegraded(response)
+                self.assertEqual(
+                    sorted(review['id'] for review in response.data),
+                    list(range(1000000, 1000000 + size)))
+                counts['list'][size] = len(log)
+
+                # Validation, the insert, then the book and the user of the
+                # response
+                with self.assertQueryBudget(queries=5, rows=5) as log:
+                    response = self.client.post(
+                        '/api/review/add/',
+                        {'book_id': 1000000 + size, 'rating': 3})
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                counts['add'][size] = len(log)
+                review_id = response.data['id']
+
+                with self.assertQueryBudget(queries=1, rows=1) as log:
+                    response = self.client.put(
+                        f'/api/review/update/{review_id}/', {'rating': 5})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts['update'][size] = len(log)
+
+                with self.assertQueryBudget(queries=1, rows=1) as log:
+                    response = self.client.delete(
+                        f'/api/review/delete/{review_id}/')
+                self.assertEqual(
+                    response.status_code, status.HTTP_204_NO_CONTENT)
+                counts['delete'][size] = len(log)
+
+                transaction.set_rollback(True)
+
+        for view in counts.values():
+            self.assertConstantQueries(view)
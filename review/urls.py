@@ -1,6 +1,6 @@
 from django.urls import path
 
-from review.views import CreateReviewView, UpdateReviewView, DestroyReviewView, UserReviewsView
+from review.views import CreateReviewView, UpdateReviewView, DestroyReviewView, UserReviewsView, ReviewExportView
 
 
 urlpatterns = [
@@ -8,4 +8,5 @@ urlpatterns = [
     path('add/', CreateReviewView.as_view(), name='add_review'),
     path('update/<int:id>/', UpdateReviewView.as_view(), name='update_review'),
     path('delete/<int:id>/', DestroyReviewView.as_view(), name='delete_review'),
+    path('export/', ReviewExportView.as_view(), name='export_reviews'),
 ]
@@ -1,16 +1,50 @@
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import connection
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
+from authentication.models import User
+from book.models import Book
+from core.db.routers import get_read_alias, pin_to_primary
+from core.db.timeouts import (
+    DEGRADED_HEADER, run_with_budget, statement_timeout)
+from core.invalidation import atomic_write, notify
+from core.throttling import ReviewRateThrottle
 from review.models import Review
-from review.serializers import ReviewSerializer, UpdateReviewSerializer
+from review.queries import (
+    DELETE_REVIEW, UPDATE_REVIEW, USER_REVIEW, USER_REVIEWS,
+    USER_REVIEWS_PAGE)
+from review.serializers import (
+    ReviewExportSerializer, ReviewSerializer, UpdateReviewSerializer)
+
+
+# Number of rows fetched and written per chunk
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = {
+    'ndjson': {
+        'content_type': 'application/x-ndjson',
+        'header': '',
+        'row': '{"id":%d,"user_id":%d,"book_id":%d,"rating":%d}\n',
+    },
+    'csv': {
+        'content_type': 'text/csv',
+        'header': 'id,user_id,book_id,rating\n',
+        'row': '%d,%d,%d,%d\n',
+    },
+}
 
 
 class CreateReviewView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ReviewRateThrottle]
     serializer_class = ReviewSerializer
 
     """
@@ -48,6 +82,7 @@ class CreateReviewView(generics.CreateAPIView):
 
         # Save the validated data to the database
         serializer.save()
+        pin_to_primary(request)
 
         # Return a response with the serialized data and a status code of 201 Created
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -75,35 +110,55 @@ class UpdateReviewView(generics.UpdateAPIView):
             path, which is 'id'.
     """
 
-    def get_object(self):
+    def update(self, request, *args, **kwargs):
         """
-        Get the review object to be updated.
+        Update the rating of a review owned by the authenticated user.
 
-        This method retrieves the review object identified by the ID in the URL
-        path and locks it for update. If the review is not found, it raises an
-        Http404 exception.
+        The update, its outbox event and the book and user needed for the
+        response are handled by a single UPDATE ... RETURNING statement, so
+        the row lock is only held for the duration of that statement. A PATCH
+        without a rating returns the review unchanged.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments, with partial set for PATCH.
 
         Returns:
-            Review: The review object to be updated.
+            Response: The serialized updated review.
 
         Raises:
-            Http404: If the review is not found.
+            Http404: If the review is not found or belongs to another user.
         """
-        review_id = self.kwargs.get('id')
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, rating, book_id, user_id
-                FROM reviews
-                WHERE id = %s
-                FOR UPDATE OF reviews;
-                """,
-                [review_id]
-            )
-            row = cursor.fetchone()
-            if not row:
-                raise Http404("Review not found.")
-            return Review(id=row[0], rating=row[1], book_id=row[2], user_id=row[3])
+        # Validate the new rating
+        serializer = self.get_serializer(
+            data=request.data, partial=kwargs.get('partial', False))
+        serializer.is_valid(raise_exception=True)
+
+        user_id = request.user.id
+        if 'rating' not in serializer.validated_data:
+            # Nothing to update, read the review as it is
+            row = USER_REVIEW.fetchone([self.kwargs.get('id'), user_id])
+        else:
+            # Commit the update with the notification of the other workers
+            with atomic_write():
+                row = UPDATE_REVIEW.fetchone(
+                    [self.kwargs.get('id'), user_id,
+                     serializer.validated_data['rating'], user_id])
+                if row:
+                    notify('review', [user_id])
+
+        if not row:
+            raise Http404("Review not found.")
+        pin_to_primary(request)
+
+        # Build the review with its book and user already loaded
+        review = Review(
+            id=row[0], rating=row[1],
+            book=Book(id=row[2], title=row[3], author=row[4], genre=row[5]),
+            user=User(id=row[6], username=row[7]))
+
+        return Response(self.get_serializer(review).data, status=status.HTTP_200_OK)
 
 
 class DestroyReviewView(generics.DestroyAPIView):
@@ -128,41 +183,37 @@ class DestroyReviewView(generics.DestroyAPIView):
             path, which is 'id'.
     """
 
-    def get_object(self):
+    def destroy(self, request, *args, **kwargs):
         """
-        Get the review object to be deleted.
+        Delete a review owned by the authenticated user.
 
-        This method retrieves the review object identified by the ID in the URL
-        path and locks it for update. If the review is not found, it raises an
-        Http404 exception.
+        The delete and its outbox event are handled by a single
+        DELETE ... RETURNING statement.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
 
         Returns:
-            Review: The review object to be deleted.
+            Response: An empty response with a status code of 204 No Content.
 
         Raises:
-            Http404: If the review is not found.
+            Http404: If the review is not found or belongs to another user.
         """
-        # Get the review ID from the URL path
-        review_id = self.kwargs.get('id')
-
-        # Execute a SQL query to retrieve the review and lock it for update
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, rating, book_id, user_id
-                FROM reviews
-                WHERE id = %s
-                FOR UPDATE OF reviews;
-                """,
-                [review_id]
-            )
-            # Fetch the review from the query result
-            row = cursor.fetchone()
-
-            # If the review is not found, raise an Http404 exception
-            if not row:
-                raise Http404("Review not found.")
-            return Review(id=row[0], rating=row[1], book_id=row[2], user_id=row[3])
+        # Commit the delete with the notification of the other workers
+        with atomic_write():
+            row = DELETE_REVIEW.fetchone(
+                [self.kwargs.get('id'), request.user.id])
+            if row:
+                notify('review', [request.user.id])
+
+        # If the review is not found, raise an Http404 exception
+        if not row:
+            raise Http404("Review not found.")
+        pin_to_primary(request)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class UserReviewsView(generics.ListAPIView):
@@ -182,29 +233,199 @@ class UserReviewsView(generics.ListAPIView):
             get a list of reviews.
         serializer_class (class): The serializer class used to serialize the
             review data.
+        degraded (str): The fallback used when fetching the reviews exceeded
+            the statement timeout, if any.
     """
+    degraded = None
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the reviews, flagging the response if they are partial.
+        """
+        response = super().list(request, *args, **kwargs)
+        if self.degraded:
+            response[DEGRADED_HEADER] = self.degraded
+        return response
 
     def get_queryset(self):
         """
         Get a list of all reviews created by the authenticated user.
 
+        The books and the user are fetched with the reviews, so that
+        serializing them does not need a query per review.
+
         Returns:
             QuerySet: A queryset of Review objects.
         """
         # Get the user id from the request
         user_id = self.request.user.id
 
-        # Execute a SQL query to retrieve all reviews created by the user
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, rating, book_id, user_id
-                FROM reviews
-                WHERE user_id = %s
-                """,
-                [user_id]
-            )
+        # Execute a SQL query to retrieve all reviews created by the user,
+        # or the first of them if it exceeds the statement timeout
+        using = get_read_alias(self.request)
+        page_size = settings.STATEMENT_TIMEOUTS['PAGE_SIZE']
+        rows, self.degraded = run_with_budget(
+            'user_reviews', using,
+            lambda: USER_REVIEWS.fetchall([user_id], using=using),
+            fallbacks=[(
+                'partial',
+                lambda: USER_REVIEWS_PAGE.fetchall(
+                    [user_id, page_size], using=using)),
+            ])
+
+        # Create a list of Review objects, with their book and user, from
+        # the fetched rows
+        return [
+            Review(
+                id=row[0], rating=row[1],
+                book=Book(id=row[2], title=row[3], author=row[4], genre=row[5]),
+                user=User(id=row[6], username=row[7]))
+            for row in rows
+        ]
+
+
+def stream_reviews(filters, output, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream reviews matching the filters in the given output format.
+
+    Rows are read in batches of the chunk size, each a query of its own in
+    autocommit resuming after the last id of the previous one, so memory use
+    is bounded by the chunk size whatever the number of reviews, and each
+    batch runs under the 'export_reviews' budget of
+    STATEMENT_TIMEOUTS['BUDGETS']. No transaction stays open while a slow
+    client downloads the export, as its snapshot would hold back the
+    txid_snapshot_xmin() up to which read_review_events() delivers outbox
+    events to their consumers. The export is therefore not a snapshot:
+    reviews changed while it streams may appear with either rating, or not
+    at all if they are created or deleted behind its position, but never
+    twice.
+
+    Args:
+        filters (dict): Validated filters from ReviewExportSerializer.
+        output (str): One of the keys of EXPORT_FORMATS.
+        chunk_size (int): The number of rows read and written per chunk.
+
+    Yields:
+        bytes: Encoded chunks of the export.
+    """
+    conditions = ['r.id > %s']
+    params = []
+    join = ''
+    if 'genre' in filters:
+        join = 'JOIN books b ON b.id = r.book_id'
+        conditions.append('b.genre = %s')
+        params.append(filters['genre'])
+    for field, condition in [
+            ('user_id', 'r.user_id = %s'), ('book_id', 'r.book_id = %s'),
+            ('min_id', 'r.id >= %s'), ('max_id', 'r.id <= %s')]:
+        if field in filters:
+            conditions.append(condition)
+            params.append(filters[field])
+    sql = f"""
+        SELECT r.id, r.user_id, r.book_id, r.rating
+        FROM reviews r
+        {join}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY r.id
+        LIMIT %s
+    """
+
+    export_format = EXPORT_FORMATS[output]
+    row_format = export_format['row']
+    if export_format['header']:
+        yield export_format['header'].encode()
+
+    budget = settings.STATEMENT_TIMEOUTS['BUDGETS'].get('export_reviews')
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor, \
+                statement_timeout(budget) if budget else nullcontext():
+            cursor.execute(sql, [last_id, *params, chunk_size])
             rows = cursor.fetchall()
+        if not rows:
+            break
+        yield ''.join([row_format % row for row in rows]).encode()
+        if len(rows) < chunk_size:
+            break
+        last_id = rows[-1][0]
+
 
-        # Create a list of Review objects from the fetched rows
-        return [Review(id=row[0], rating=row[1], book_id=row[2], user_id=row[3]) for row in rows]
+class AsyncChunks:
+    """
+    Async iterator over the chunks of a sync generator, for streaming
+    responses under ASGI.
+
+    Django buffers a sync iterator of a StreamingHttpResponse in full under
+    ASGI. Here each chunk is read in its own sync_to_async call instead, on
+    the thread of the request, whose database connection the generator
+    queries. Django closes the response, and with it the generator, on that
+    same thread.
+
+    Args:
+        chunks (generator): The generator of the chunks, none of them None.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.next_chunk = sync_to_async(next, thread_sensitive=True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.next_chunk(self.chunks, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        self.chunks.close()
+
+
+class ReviewExportView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    serializer_class = ReviewExportSerializer
+
+    """
+    View for exporting reviews to administrators.
+
+    This view handles HTTP GET requests and streams every review matching the
+    optional user_id, book_id, genre, min_id and max_id filters, ordered by
+    id, as NDJSON or CSV depending on the output query parameter. Under ASGI
+    the chunks are streamed through AsyncChunks.
+
+    Attributes:
+        permission_classes (list): A list containing the permission classes
+            IsAuthenticated and IsAdminUser, which ensure that only
+            administrators can export reviews.
+        serializer_class (class): The serializer class used to validate the
+            export filters.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handle HTTP GET request for exporting reviews.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            StreamingHttpResponse: The streamed export.
+        """
+        # Validate the filters and the output format
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+        output = filters.pop('output')
+
+        chunks = stream_reviews(filters, output, EXPORT_CHUNK_SIZE)
+        if isinstance(request._request, ASGIRequest):
+            chunks = AsyncChunks(chunks)
+        response = StreamingHttpResponse(
+            chunks,
+            content_type=EXPORT_FORMATS[output]['content_type'])
+        response['Content-Disposition'] = (
+            f'attachment; filename="reviews.{output}"')
+        return response
@@ -0,0 +1,97 @@
+from django.conf import settings
+
+from book.models import Book
+from book.serializers import BookSerializer
+from core.async_views import async_api_view, json_response
+from core.db.routers import aget_read_alias
+from core.db.timeouts import DEGRADED_HEADER, arun_with_budget
+from core.throttling import SuggestRateThrottle
+from suggest.queries import GENRE_RATINGS, POPULAR_BOOKS, UNREVIEWED_BOOKS
+from suggest.views import SUGGEST_FLIGHT, popular_books, stale_suggestions
+
+
+@async_api_view(throttle_classes=[SuggestRateThrottle])
+async def suggest_books(request):
+    """
+    Async counterpart of SuggestBookView: suggest the books of the user's
+    best rated genres that the user has not reviewed yet.
+
+    Returns:
+        HttpResponse: The suggested books, or 404 if the user has no
+            reviews or no unreviewed books are left in those genres.
+    """
+    user_id = request.user.id
+    using = await aget_read_alias(request)
+
+    # Concurrent requests of the user wait for one computation
+    (data, status), degraded = await SUGGEST_FLIGHT.ado(
+        (user_id, using), lambda: asuggest_with_budget(user_id, using))
+    return json_response(
+        data, status=status,
+        headers={DEGRADED_HEADER: degraded} if degraded else None)
+
+
+async def asuggest_with_budget(user_id, using):
+    """
+    Async counterpart of suggest.views.suggest_with_budget().
+    """
+    async def popular():
+        data = await aget_popular_books(using)
+        return None if data is None else (data, 200)
+
+    result, degraded = await arun_with_budget(
+        'suggest_book', lambda: asuggest_books(user_id, using),
+        fallbacks=[
+            ('stale', lambda: stale_suggestions.get(user_id)),
+            ('popular', popular),
+        ])
+    if degraded is None:
+        stale_suggestions.set(user_id, result)
+    return result, degraded
+
+
+async def aget_popular_books(using):
+    """
+    Async counterpart of suggest.views.get_popular_books().
+    """
+    data = popular_books.get(using)
+    if data is None:
+        rows = await POPULAR_BOOKS.afetchall(
+            [settings.STATEMENT_TIMEOUTS['PAGE_SIZE']], using=using)
+        if not rows:
+            return None
+        books = [
+            Book(id=row[0], title=row[1], author=row[2], genre=row[3])
+            for row in rows
+        ]
+        data = BookSerializer(books, many=True).data
+        popular_books.set(using, data)
+    return data
+
+
+async def asuggest_books(user_id, using):
+    """
+    Async counterpart of suggest.views.suggest_books().
+    """
+    # Determine the user's preferred genres based on highest average rating
+    genre_ratings = await GENRE_RATINGS.afetchall([user_id], using=using)
+    if not genre_ratings:
+        return {'detail': 'No preferred genres found'}, 404
+
+    max_avg_rating = genre_ratings[0][1]
+    preferred_genres = [
+        row[0] for row in genre_ratings if row[1] == max_avg_rating]
+
+    # Fetch books from the user's preferred genres that they haven't reviewed
+    rows = await UNREVIEWED_BOOKS.afetchall(
+        [preferred_genres, user_id], using=using)
+    if not rows:
+        return (
+            {'detail': 'No book suggestions available for the preferred genres.'},
+            404)
+
+    books = [
+        Book(id=row[0], title=row[1], author=row[2], genre=row[3])
+        for row in rows
+    ]
+    return BookSerializer(books, many=True).data, 200
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from suggest.popular import refresh_popular_books
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the reviews of the books and keep the most reviewed ones in '
+        'the popular_books table, which suggestions fall back to when they '
+        'exceed their statement timeout. Run it on deploy and on a schedule.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int,
+            default=settings.STATEMENT_TIMEOUTS['PAGE_SIZE'],
+            help='Number of books to keep (default: '
+                 'STATEMENT_TIMEOUTS[\'PAGE_SIZE\']).')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = refresh_popular_books(options['size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Kept {count} popular books in {time.perf_counter() - start:.1f}s'))
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.14 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularBook',
+            fields=[
+                ('book_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('reviews', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'popular_books',
+            },
+        ),
+    ]
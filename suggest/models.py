@@ -1,3 +1,16 @@
 from django.db import models
 
-# Create your models here.
+
+class PopularBook(models.Model):
+    """
+    A most reviewed book, with its number of reviews, as of the last run of
+    the refresh_popular_books command.
+    """
+    book_id = models.BigIntegerField(primary_key=True)
+    reviews = models.IntegerField()
+
+    class Meta:
+        db_table = 'popular_books'
+
+    def __str__(self):
+        return f'Book {self.book_id}: {self.reviews} reviews'
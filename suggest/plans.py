@@ -0,0 +1,20 @@
+from core.db.plans import expect_plan
+
+from suggest.queries import GENRE_RATINGS, POPULAR_BOOKS, UNREVIEWED_BOOKS
+
+
+expect_plan(
+    GENRE_RATINGS, lambda sample: [sample.user_id],
+    indexes=['reviews(user_id)', 'books(id)'], max_cost=300)
+
+# The reviewed books must be read once, through the user_id index, into a
+# hashed subplan, not once per book or with a scan of every review
+expect_plan(
+    UNREVIEWED_BOOKS, lambda sample: [[sample.genre], sample.user_id],
+    indexes=['reviews(user_id)'], seq_scans=['books'], max_cost=600)
+
+# A fallback under a short statement timeout, see suggest.views: it must
+# only read the precomputed popular_books, never count the reviews
+expect_plan(
+    POPULAR_BOOKS, lambda sample: [100],
+    indexes=['books(id)'], seq_scans=['popular_books'], max_cost=1000)
@@ -0,0 +1,38 @@
+"""
+The most reviewed books, the fallback of suggestions that exceed their
+statement timeout.
+
+Counting the reviews of every book reads the whole reviews table, too slow
+for the short budget of a fallback, so the counts of the most reviewed books
+are kept in the popular_books table, replaced by refresh_popular_books() on
+a schedule, and the fallback only reads that table.
+"""
+from django.db import connection, transaction
+
+from core.invalidation import notify
+
+
+def refresh_popular_books(size):
+    """
+    Replace the content of the popular_books table with the `size` most
+    reviewed books. Readers keep seeing the previous books until it is done.
+
+    Returns:
+        int: The number of books kept.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM popular_books')
+        cursor.execute(
+            """
+            INSERT INTO popular_books (book_id, reviews)
+            SELECT book_id, COUNT(*) AS reviews
+            FROM reviews
+            GROUP BY book_id
+            ORDER BY reviews DESC, book_id
+            LIMIT %s
+            """,
+            [size]
+        )
+        count = cursor.rowcount
+        notify('popular_books')
+    return count
@@ -0,0 +1,34 @@
+from core.db.queries import Query
+
+
+# The user's genres by average rating, best first
+GENRE_RATINGS = Query('suggest.genre_ratings', """
+    SELECT b.genre, AVG(r.rating) as avg_rating
+    FROM books b
+    JOIN reviews r ON b.id = r.book_id
+    WHERE r.user_id = %s
+    GROUP BY b.genre
+    ORDER BY avg_rating DESC
+""")
+
+# The books of a list of genres that the user has not reviewed
+UNREVIEWED_BOOKS = Query('suggest.unreviewed_books', """
+    SELECT b.id, b.title, b.author, b.genre
+    FROM books b
+    WHERE b.genre = ANY(%s)
+    AND b.id NOT IN (
+        SELECT book_id
+        FROM reviews
+        WHERE user_id = %s
+    )
+""")
+
+# The most reviewed books, most reviewed first, as counted by the last
+# refresh of the popular_books table, see suggest.popular
+POPULAR_BOOKS = Query('suggest.popular_books', """
+    SELECT b.id, b.title, b.author, b.genre
+    FROM popular_books p
+    JOIN books b ON b.id = p.book_id
+    ORDER BY p.reviews DESC, b.id
+    LIMIT %s
+""")
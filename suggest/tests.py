@@ -1,9 +1,23 @@
 from unittest import TestCase
 from random import randint
-from unittest.mock import Mock
-from django.test import RequestFactory
+from unittest.mock import Mock, patch
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.test import RequestFactory, override_settings
+from django.db import connections, transaction
+from django.test import TestCase as DjangoTestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 from authentication.models import User
-from suggest.views import SuggestBookView
+from book.models import Book
+from core.db.aio import close_async_pools
+from core.testing import (
+    DATA_SIZES, GENRES, QueryBudgetMixin, create_reviews)
+from review.models import Review
+from suggest.models import PopularBook
+from suggest.popular import refresh_popular_books
+from suggest.views import (
+    SuggestBookView, popular_books, stale_suggestions, suggest_books)
 
 
 class TestSuggestBookView(TestCase):
@@ -41,3 +55,157 @@ class TestSuggestBookView(TestCase):
         self.assertEqual(response.status_code, 404)
 
     
+
+
+class TestAsyncSuggestBooks(TransactionTestCase):
+    # The async view queries over connections of its own, which do not see
+    # the data of an open test transaction
+
+    def tearDown(self):
+        # Idle connections would keep the test database from being dropped
+        close_async_pools()
+
+    async def test_same_response_as_sync_view(self):
+        """
+        Test that the async view suggests the same books as the sync one, and
+        answers 404 for a user without reviews.
+        """
+        user = await User.objects.acreate(username='asyncsuggest', password='x')
+        books = await Book.objects.abulk_create([
+            Book(id=920000 + i, title=f'Book {i}', author='Author',
+                 genre=['Horror', 'Romance', 'Horror', 'Romance', 'Drama'][i])
+            for i in range(5)
+        ])
+        await Review.objects.abulk_create([
+            Review(id=920000, book=books[0], user=user, rating=5),
+            Review(id=920001, book=books[1], user=user, rating=2),
+        ])
+        authorization = f'Bearer {AccessToken.for_user(user)}'
+
+        response = await self.async_client.get(
+            '/api/async/suggest/', AUTHORIZATION=authorization)
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(
+            APIClient(HTTP_AUTHORIZATION=authorization).get)('/api/suggest/')
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual([book['id'] for book in response.json()], [920002])
+
+        other_user = await User.objects.acreate(username='nosuggest', password='x')
+        response = await self.async_client.get(
+            '/api/async/suggest/',
+            AUTHORIZATION=f'Bearer {AccessToken.for_user(other_user)}')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestSuggestQueryBudget(QueryBudgetMixin, DjangoTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='budgetuser', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for cache in (stale_suggestions, popular_books):
+            self.addCleanup(cache.clear)
+
+    def test_query_budgets(self):
+        """
+        Test that suggesting books runs two queries, fetching the genres and
+        the suggested books only, whatever the number of reviews of the user.
+        """
+        unreviewed = 10
+        counts = {}
+        for size in DATA_SIZES:
+            # The fallbacks must not answer with the books of another size
+            for cache in (stale_suggestions, popular_books):
+                cache.clear()
+            with self.subTest(size=size), transaction.atomic():
+                create_reviews(
+                    self.user.id, size, first_id=1000000, unreviewed=unreviewed)
+
+                with self.assertQueryBudget(
+                        queries=2, rows=len(GENRES) + unreviewed) as log:
+                    response = self.client.get('/api/suggest/')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotDegraded(response)
+                # The unreviewed books of the best rated genre; ratings grow
+                # with the genre of the book, see create_reviews()
+                best = max(
+                    id % len(GENRES) for id in range(1000000, 1000000 + size))
+                self.assertEqual(
+                    sorted(book['id'] for book in response.data),
+                    [id for id in range(1000000 + size, 1000000 + size + unreviewed)
+                     if id % len(GENRES) == best])
+                counts[size] = len(log)
+
+                transaction.set_rollback(True)
+
+        self.assertConstantQueries(counts)
+
+
+class TestSuggestStatementTimeout(DjangoTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='timeoutuser', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        create_reviews(self.user.id, 3, first_id=3000000, unreviewed=5)
+        for cache in (stale_suggestions, popular_books):
+            cache.clear()
+            self.addCleanup(cache.clear)
+
+    def slow_suggest_books(self, user_id, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT pg_sleep(5)')
+        return suggest_books(user_id, using)
+
+    def test_fallbacks(self):
+        """
+        Test that suggestions exceeding their statement timeout are answered
+        with the most reviewed books, then with the last suggestions of the
+        user, and flagged.
+        """
+        slow_suggest_books = self.slow_suggest_books
+        refresh_popular_books(100)
+        options = {
+            **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'suggest_book': 0.05}}
+        with override_settings(STATEMENT_TIMEOUTS=options):
+            with patch('suggest.views.suggest_books', slow_suggest_books), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = self.client.get('/api/suggest/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Degraded'], 'popular')
+            self.assertEqual(
+                {book['id'] for book in response.json()},
+                set(range(3000000, 3000003)))
+
+            response = self.client.get('/api/suggest/')
+            self.assertNotIn('X-Degraded', response)
+            suggestions = response.json()
+
+            with patch('suggest.views.suggest_books', slow_suggest_books), \
+                    self.assertLogs('core.db.timeouts', 'WARNING'):
+                response = self.client.get('/api/suggest/')
+            self.assertEqual(response['X-Degraded'], 'stale')
+            self.assertEqual(response.json(), suggestions)
+
+    def test_refresh_popular_books(self):
+        """
+        Test that popular_books keeps the most reviewed books, and that
+        suggestions exceeding their statement timeout answer 503 until it is
+        first refreshed, without counting the reviews.
+        """
+        other_user = User.objects.create(username='otherreviewer', password='x')
+        Review.objects.create(book_id=3000002, user=other_user, rating=4)
+
+        options = {
+            **settings.STATEMENT_TIMEOUTS, 'BUDGETS': {'suggest_book': 0.05}}
+        with override_settings(STATEMENT_TIMEOUTS=options), \
+                patch('suggest.views.suggest_books', self.slow_suggest_books), \
+                self.assertLogs('core.db.timeouts', 'WARNING'):
+            response = self.client.get('/api/suggest/')
+        self.assertEqual(response.status_code, 503)
+
+        self.assertEqual(refresh_popular_books(2), 2)
+        self.assertEqual(
+            list(PopularBook.objects.order_by('-reviews', 'book_id')
+                 .values_list('book_id', 'reviews')),
+            [(3000002, 2), (3000000, 1)])
@@ -1,15 +1,40 @@
+from django.conf import settings
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from django.db import connection
+from django.db import connections
 
 from book.models import Book
 from book.serializers import BookSerializer
+from core.caches import LocalCache
+from core.db.routers import get_read_alias
+from core.db.timeouts import DEGRADED_HEADER, run_with_budget
+from core.invalidation import register_cache
+from core.singleflight import SingleFlight
+from core.throttling import SuggestRateThrottle
+from suggest.queries import GENRE_RATINGS, POPULAR_BOOKS, UNREVIEWED_BOOKS
+
+
+# The suggestions of a user, by user id and database alias
+SUGGEST_FLIGHT = SingleFlight('suggest')
+
+# The last suggestions of each user, by user id, and the most reviewed books,
+# by database alias, for when suggesting exceeds the statement timeout
+# Reviews are sent with the id of their user
+stale_suggestions = register_cache(LocalCache(
+    max_size=settings.STATEMENT_TIMEOUTS['STALE_SIZE'],
+    ttl=settings.STATEMENT_TIMEOUTS['STALE_TTL']),
+    entities=['book'], by_id=['review'])
+popular_books = register_cache(LocalCache(
+    max_size=len(settings.DATABASES),
+    ttl=settings.STATEMENT_TIMEOUTS['STALE_TTL']),
+    entities=['book', 'popular_books'])
 
 
 class SuggestBookView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [SuggestRateThrottle]
     serializer_class = BookSerializer
 
     """
@@ -26,55 +51,107 @@ class SuggestBookView(generics.ListAPIView):
 
     def get(self, request, *args, **kwargs):
         user_id = request.user.id
+        using = get_read_alias(request)
+
+        # Concurrent requests of the user wait for one computation
+        (data, status_code), degraded = SUGGEST_FLIGHT.do(
+            (user_id, using), lambda: suggest_with_budget(user_id, using))
+        response = Response(data, status=status_code)
+        if degraded:
+            response[DEGRADED_HEADER] = degraded
+        return response
+
+
+def suggest_with_budget(user_id, using):
+    """
+    Compute the suggestions of a user under the statement timeout of the
+    endpoint, falling back to their last suggestions or the most reviewed
+    books.
+
+    Returns:
+        tuple: The result of suggest_books() and the fallback used, or None.
+    """
+    result, degraded = run_with_budget(
+        'suggest_book', using, lambda: suggest_books(user_id, using),
+        fallbacks=[
+            ('stale', lambda: stale_suggestions.get(user_id)),
+            ('popular', lambda: popular_suggestions(using)),
+        ])
+    if degraded is None:
+        stale_suggestions.set(user_id, result)
+    return result, degraded
+
+
+def get_popular_books(using):
+    """
+    Get the most reviewed books, serialized, see suggest.popular.
+
+    Returns:
+        ReturnList: The books, None if popular_books was never refreshed.
+    """
+    data = popular_books.get(using)
+    if data is None:
+        rows = POPULAR_BOOKS.fetchall(
+            [settings.STATEMENT_TIMEOUTS['PAGE_SIZE']], using=using)
+        if not rows:
+            return None
+        books = [
+            Book(id=row[0], title=row[1], author=row[2], genre=row[3])
+            for row in rows
+        ]
+        data = BookSerializer(books, many=True).data
+        popular_books.set(using, data)
+    return data
+
+
+def popular_suggestions(using):
+    """
+    Suggest the most reviewed books, the result of suggest_books() for the
+    'popular' fallback, or None if there are none.
+    """
+    data = get_popular_books(using)
+    return None if data is None else (data, status.HTTP_200_OK)
+
+
+def suggest_books(user_id, using):
+    """
+    Compute the suggestions of a user, see SuggestBookView.
+
+    Returns:
+        tuple: The response data, shared with concurrent requests, and the
+            status code.
+    """
+    with connections[using].cursor() as cursor:
+        # Determine the user's preferred genres based on highest average rating
+        genre_ratings = GENRE_RATINGS.execute(cursor, [user_id]).fetchall()
+
+        if genre_ratings:
+            max_avg_rating = genre_ratings[0][1]
+            preferred_genres = [row[0]
+                                for row in genre_ratings if row[1] == max_avg_rating]
+
+            if preferred_genres:
+                # Fetch books from the user's preferred genres that they haven't reviewed
+                books = UNREVIEWED_BOOKS.execute(
+                    cursor, [preferred_genres, user_id]).fetchall()
+
+                if books:
+                    # Create a list of Book objects from the fetched rows
+                    books = [
+                        Book(
+                            id=row[0], title=row[1],
+                            author=row[2], genre=row[3])
+                        for row in books
+                    ]
+
+                    # Serialize the books
+                    serializer = BookSerializer(books, many=True)
+                    return serializer.data, status.HTTP_200_OK
 
-        with connection.cursor() as cursor:
-            # Determine the user's preferred genres based on highest average rating
-            cursor.execute("""
-                SELECT b.genre, AVG(r.rating) as avg_rating
-                FROM books b
-                JOIN reviews r ON b.id = r.book_id
-                WHERE r.user_id = %s
-                GROUP BY b.genre
-                ORDER BY avg_rating DESC
-            """, [user_id])
-            genre_ratings = cursor.fetchall()
-
-            if genre_ratings:
-                max_avg_rating = genre_ratings[0][1]
-                preferred_genres = [row[0]
-                                    for row in genre_ratings if row[1] == max_avg_rating]
-
-                if preferred_genres:
-                    # Fetch books from the user's preferred genres that they haven't reviewed
-                    cursor.execute("""
-                        SELECT b.id, b.title, b.author, b.genre
-                        FROM books b
-                        WHERE b.genre IN %s
-                        AND b.id NOT IN (
-                            SELECT book_id
-                            FROM reviews
-                            WHERE user_id = %s
-                        )
-                    """, [tuple(preferred_genres), user_id])
-                    books = cursor.fetchall()
-
-                    if books:
-                        # Create a list of Book objects from the fetched rows
-                        books = [
-                            Book(
-                                id=row[0], title=row[1],
-                                author=row[2], genre=row[3])
-                            for row in books
-                        ]
-
-                        # Serialize the books and return the response
-                        serializer = self.serializer_class(books, many=True)
-                        return Response(serializer.data, status=status.HTTP_200_OK)
-
-                    else:
-                        # Return an error message if no book suggestions are found
-                        return Response(
-                            {"detail": "No book suggestions available for the preferred genres."},
-                            status=status.HTTP_404_NOT_FOUND)
-            # Return an error message if no preferred genres are found
-            return Response({"detail": "No preferred genres found"}, status=status.HTTP_404_NOT_FOUND)
+                else:
+                    # Return an error message if no book suggestions are found
+                    return (
+                        {"detail": "No book suggestions available for the preferred genres."},
+                        status.HTTP_404_NOT_FOUND)
+        # Return an error message if no preferred genres are found
+        return {"detail": "No preferred genres found"}, status.HTTP_404_NOT_FOUND